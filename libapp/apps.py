@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LibappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "libapp"
+
+    def ready(self):
+        from . import receivers, tasks  # noqa: F401
@@ -0,0 +1,101 @@
+from django.core.cache import cache
+from django.db.models import Max
+from django.shortcuts import render
+from django.utils.safestring import mark_safe
+
+from . import attachments, views
+from .models import Author
+from .stats import adashboard
+from .utils import aget_hierarchy_or_404
+
+
+class AsyncLoginRequiredMixin:
+    """
+    Замена проверки LoginRequiredMixin для async-представлений: пользователь
+    загружается через request.auser(), синхронный ленивый request.user
+    в async-контексте обращаться к базе не может.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncShowMixin(AsyncLoginRequiredMixin):
+    """
+    Асинхронный get() для страниц просмотра из views.py под ASGI. Контекст
+    и шаблоны те же; цепочка автор -> серия -> книга и отметка времени для
+    условного GET загружаются через асинхронный ORM, а страница списка -
+    только если её фрагмента нет в кэше.
+    """
+
+    async def aget_last_modified(self):
+        if "author_id" in self.kwargs:
+            self._hierarchy = await aget_hierarchy_or_404(
+                self.kwargs.get("author_id"),
+                self.kwargs.get("series_book_id"),
+                self.kwargs.get("book_id"),
+            )
+        return self.get_last_modified()
+
+    async def aget_response(self):
+        # Фрагмент берётся из кэша один раз, и шаблон выводит именно его:
+        # если бы шаблон читал кэш сам, фрагмент мог бы устареть между
+        # проверкой и отрисовкой, и ленивая страница пошла бы в базу
+        # синхронно.
+        self.object_list = self.get_queryset()
+        context = self.get_context_data()
+        fragment = await cache.aget(self.fragment_key(context))
+        if fragment is None:
+            await context["page_obj"].aload()
+            if "facets" in context:
+                await context["facets"].aload()
+        else:
+            context["cached_fragment"] = mark_safe(fragment)
+        return self.render_to_response(context)
+
+    async def get(self, request, *args, **kwargs):
+        last_modified = await self.aget_last_modified()
+        if last_modified is None:
+            return await self.aget_response()
+        etag, timestamp, response = self.check_conditional(last_modified)
+        if response is None:
+            response = await self.aget_response()
+        return self.patch_conditional(response, etag, timestamp)
+
+
+async def main_page(request):
+    request.user = await request.auser()
+    context = {}
+    if request.user.is_authenticated:
+        context["stats"] = await adashboard(request.user)
+    return render(request, "libapp/main.html", context)
+
+
+class ShowAuthors(AsyncShowMixin, views.ShowAuthors):
+    async def aget_last_modified(self):
+        result = await Author.objects.aaggregate(last_modified=Max("updated_at"))
+        return result["last_modified"]
+
+
+class ShowAuthor(AsyncShowMixin, views.ShowAuthor):
+    pass
+
+
+class ShowSeriesBook(AsyncShowMixin, views.ShowSeriesBook):
+    pass
+
+
+class ShowBook(AsyncShowMixin, views.ShowBook):
+    async def aget_last_modified(self):
+        self.storage = await attachments.astorage_usage(self.request.user)
+        return await super().aget_last_modified()
+
+    async def aget_response(self):
+        self.object = self.get_object()
+        self.files_context = await attachments.abook_context(
+            self.object, self.request.user, self.storage[0]
+        )
+        return self.render_to_response(self.get_context_data(object=self.object))
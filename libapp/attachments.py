@@ -0,0 +1,338 @@
+import fcntl
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.move import file_move_safe
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import F
+from django.http import FileResponse, Http404, HttpResponse
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import BookFile, StorageUsage
+
+# Формат -> начало файла. FB2 - XML, перед ним возможны BOM и пробелы.
+SIGNATURES = {
+    BookFile.Format.EPUB: b"PK\x03\x04",
+    BookFile.Format.PDF: b"%PDF-",
+    BookFile.Format.FB2: b"<",
+}
+CONTENT_TYPES = {
+    BookFile.Format.EPUB: "application/epub+zip",
+    BookFile.Format.PDF: "application/pdf",
+    BookFile.Format.FB2: "application/x-fictionbook+xml",
+}
+# Форматы, из которых читаются метаданные (libapp.metadata).
+METADATA_FORMATS = {BookFile.Format.EPUB, BookFile.Format.FB2}
+HEAD_BYTES = 16
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """
+    Пишет загружаемый файл во временный файл по частям и попутно считает
+    sha256 и размер, поэтому после загрузки файл не перечитывается.
+    Файл больше LIBAPP_ATTACHMENT_MAX_BYTES пропускается (too_large = True).
+    Устанавливается в request.upload_handlers до первого чтения POST.
+    """
+
+    too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > settings.LIBAPP_ATTACHMENT_MAX_BYTES:
+            self.too_large = True
+            raise SkipFile
+        if len(self.head) < HEAD_BYTES:
+            self.head += raw_data[: HEAD_BYTES - len(self.head)]
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        upload = super().file_complete(file_size)
+        upload.sha256 = self.sha256.hexdigest()
+        upload.head = self.head
+        return upload
+
+
+def path_for(digest):
+    """Файлы хранятся по sha256 содержимого: одинаковые - один раз."""
+    return os.path.join(settings.LIBAPP_ATTACHMENT_ROOT, digest[:2], digest)
+
+
+@contextmanager
+def file_lock(digest):
+    """
+    Блокировка файла digest между процессами (flock) для store() и
+    remove_unreferenced(). Одна блокировка на первые два символа sha256.
+    """
+    path = os.path.join(settings.LIBAPP_ATTACHMENT_ROOT, "locks", digest[:2])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def detect_format(upload):
+    """Формат по расширению, подтверждённый началом файла."""
+    extension = os.path.splitext(upload.name)[1].lower().lstrip(".")
+    if extension not in SIGNATURES:
+        raise ValidationError("Поддерживаются файлы EPUB, FB2 и PDF")
+    head = upload.head
+    if extension == BookFile.Format.FB2:
+        head = head.lstrip(b"\xef\xbb\xbf \t\r\n")
+    if not head.startswith(SIGNATURES[extension]):
+        raise ValidationError("Содержимое файла не похоже на %s" % extension.upper())
+    return extension
+
+
+def charge(user, size):
+    """
+    Резервирует size байт квоты одним условным UPDATE: параллельные загрузки
+    не могут вместе превысить квоту, а файлы на диске не перебираются.
+    """
+    StorageUsage.objects.bulk_create([StorageUsage(user=user)], ignore_conflicts=True)
+    return bool(
+        StorageUsage.objects.filter(
+            user=user, bytes_used__lte=settings.LIBAPP_ATTACHMENT_QUOTA - size
+        ).update(bytes_used=F("bytes_used") + size, updated_at=timezone.now())
+    )
+
+
+def release(user_id, size):
+    StorageUsage.objects.filter(user_id=user_id).update(
+        bytes_used=F("bytes_used") - size, updated_at=timezone.now()
+    )
+
+
+def attach(book, user, upload):
+    """
+    Сохраняет файл, загруженный через HashingUploadHandler, и привязывает
+    его к книге; book = None - книга будет создана по метаданным файла
+    (libapp.metadata). Файл переносится на место после фиксации транзакции
+    (store), поэтому при её откате на диске ничего не остаётся.
+    """
+    file_format = detect_format(upload)
+    temporary_path = upload.temporary_file_path()
+    with transaction.atomic():
+        if not charge(user, upload.size):
+            raise ValidationError(
+                "Недостаточно места: доступно %s"
+                % filesizeformat(settings.LIBAPP_ATTACHMENT_QUOTA)
+            )
+        attachment = BookFile.objects.create(
+            book=book,
+            user=user,
+            name=os.path.basename(upload.name)[:255],
+            format=file_format,
+            size=upload.size,
+            sha256=upload.sha256,
+            metadata_state=(
+                BookFile.MetadataState.PENDING
+                if file_format in METADATA_FORMATS
+                else BookFile.MetadataState.NONE
+            ),
+        )
+        transaction.on_commit(lambda: store(upload.sha256, temporary_path))
+    return attachment
+
+
+def store(digest, temporary_path):
+    """
+    Переносит временный файл на место, если файла с таким содержимым ещё
+    нет. Временный файл переносится без копирования, если он на той же
+    файловой системе.
+    """
+    path = path_for(digest)
+    with file_lock(digest):
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            file_move_safe(temporary_path, path, allow_overwrite=True)
+
+
+def remove_unreferenced(digest):
+    """
+    Удаляет файл, на который не осталось ссылок. Ссылки проверяются под
+    file_lock: store() той же загрузки, зафиксированной после проверки,
+    вернёт файл на место.
+    """
+    with file_lock(digest):
+        if not BookFile.objects.filter(sha256=digest).exists():
+            try:
+                os.remove(path_for(digest))
+            except FileNotFoundError:
+                pass
+
+
+def usage(bytes_used):
+    quota = settings.LIBAPP_ATTACHMENT_QUOTA
+    return {
+        "used": bytes_used,
+        "quota": quota,
+        "percent": min(100, round(100 * bytes_used / quota)) if quota else 100,
+    }
+
+
+def book_files(book, user):
+    return BookFile.objects.filter(book=book, user=user).order_by("pk")
+
+
+def storage_rows(user):
+    return StorageUsage.objects.filter(user=user).values_list(
+        "bytes_used", "updated_at"
+    )
+
+
+def storage_usage(user):
+    """
+    (занято байт, время изменения) для страницы книги: время входит в её
+    Last-Modified. (0, None) - пользователь ещё не загружал файлов.
+    """
+    return next(iter(storage_rows(user)), (0, None))
+
+
+async def astorage_usage(user):
+    return await storage_rows(user).afirst() or (0, None)
+
+
+def book_context(book, user, bytes_used):
+    """Файлы книги и занятое место для страницы книги."""
+    return {"files": list(book_files(book, user)), "storage": usage(bytes_used)}
+
+
+async def abook_context(book, user, bytes_used):
+    return {
+        "files": [f async for f in book_files(book, user)],
+        "storage": usage(bytes_used),
+    }
+
+
+def etag(attachment):
+    return '"%s"' % attachment.sha256
+
+
+def parse_range(header, size):
+    """
+    Заголовок Range -> (начало, конец) включительно. None - отдать файл
+    целиком: заголовка нет, он с ошибкой или задаёт несколько диапазонов.
+    ValueError - диапазон вне файла (ответ 416).
+    """
+    match = RANGE_RE.fullmatch(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = int(last)
+        if not length or not size:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def range_applies(request, attachment):
+    """
+    If-Range: диапазон отдаётся, только если файл не изменился - совпал
+    ETag или дата Last-Modified. Иначе клиент получает весь файл.
+    """
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return if_range == etag(attachment)
+    return if_range == http_date(attachment.created_at.timestamp())
+
+
+class FileRange:
+    """
+    Часть открытого файла для FileResponse. Без fileno(), поэтому сервер
+    не отправит через sendfile весь файл вместо части.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def serve(request, attachment):
+    """
+    Отдаёт файл через FileResponse, не читая его в память: целиком или
+    один диапазон Range (206) для докачки. Поддерживаются If-Range,
+    If-None-Match и If-Modified-Since.
+    """
+    tag = etag(attachment)
+    timestamp = attachment.created_at.timestamp()
+    response = get_conditional_response(request, etag=tag, last_modified=int(timestamp))
+    if response is None:
+        response = file_response(request, attachment)
+    response["ETag"] = tag
+    response["Last-Modified"] = http_date(timestamp)
+    response["Accept-Ranges"] = "bytes"
+    patch_cache_control(response, private=True)
+    return response
+
+
+def file_response(request, attachment):
+    size = attachment.size
+    try:
+        byte_range = (
+            parse_range(request.headers.get("Range"), size)
+            if range_applies(request, attachment)
+            else None
+        )
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = "bytes */%d" % size
+        return response
+    try:
+        file = open(path_for(attachment.sha256), "rb")
+    except FileNotFoundError:
+        raise Http404
+    options = {
+        "as_attachment": True,
+        "filename": attachment.name,
+        "content_type": CONTENT_TYPES[attachment.format],
+    }
+    if byte_range is None:
+        return FileResponse(file, **options)
+    start, end = byte_range
+    response = FileResponse(
+        FileRange(file, start, end - start + 1), status=206, **options
+    )
+    response["Content-Length"] = str(end - start + 1)
+    response["Content-Range"] = "bytes %d-%d/%d" % (start, end, size)
+    return response
@@ -0,0 +1,165 @@
+from django.db import transaction
+from django.forms.models import model_to_dict
+
+from .bulk import bulk_create_and_notify, bulk_update_and_notify
+from .forms import AddAuthorForm, AddSeriesBookForm, AddBookForm
+from .models import Author, SeriesBook, Book
+
+MAX_ITEMS = 1000
+
+
+class BatchError(ValueError):
+    pass
+
+
+class BatchKind:
+    """
+    Модель, форма для проверки данных, queryset доступных для изменения
+    объектов и родитель новых объектов (поле и queryset).
+    """
+
+    def __init__(self, model, form_class, objects, parent_field=None, parents=None):
+        self.model = model
+        self.form_class = form_class
+        self.objects = objects
+        self.parent_field = parent_field
+        self.parents = parents
+
+
+KINDS = {
+    "authors": BatchKind(Author, AddAuthorForm, lambda: Author.undeleted.all()),
+    "series_books": BatchKind(
+        SeriesBook,
+        AddSeriesBookForm,
+        lambda: SeriesBook.undeleted.filter(author__is_deleted=False),
+        "author",
+        lambda: Author.undeleted.all(),
+    ),
+    "books": BatchKind(
+        Book,
+        AddBookForm,
+        lambda: Book.undeleted.filter(
+            series__is_deleted=False, series__author__is_deleted=False
+        ),
+        "series",
+        lambda: SeriesBook.undeleted.filter(author__is_deleted=False),
+    ),
+}
+
+
+def form_data(data):
+    # Поля "Статус" - выбор из 0/1, а JSON-клиенты присылают true/false.
+    return {
+        key: int(value) if isinstance(value, bool) else value
+        for key, value in data.items()
+    }
+
+
+def form_errors(form):
+    return {field: list(messages) for field, messages in form.errors.items()}
+
+
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def get_ids(items, key=None):
+    return {
+        value for value in (i.get(key) if key else i for i in items) if is_id(value)
+    }
+
+
+def check_items(payload, name):
+    items = payload.get(name, [])
+    if not isinstance(items, list):
+        raise BatchError("%s должен быть списком" % name)
+    if name != "delete" and not all(isinstance(item, dict) for item in items):
+        raise BatchError("Элементы %s должны быть объектами" % name)
+    return items
+
+
+def apply_batch(user, kind_name, payload):
+    """
+    Создаёт, изменяет и помечает удалёнными пачку объектов одного вида.
+
+    payload: {"create": [{...}], "update": [{"id": ..., ...}], "delete": [id]}.
+    Каждый элемент проверяется формой, как в CreateBook/EditBookPage;
+    прошедшие проверку изменения применяются одним bulk_create и одним
+    bulk_update в общей транзакции. Возвращает результаты по элементам
+    в том же порядке: {"id": ...} или {"errors": {...}}.
+    """
+    kind = KINDS.get(kind_name)
+    if kind is None:
+        raise BatchError("Неизвестный вид объектов: %s" % kind_name)
+    if not isinstance(payload, dict):
+        raise BatchError("Ожидается JSON-объект")
+    creates = check_items(payload, "create")
+    updates = check_items(payload, "update")
+    deletes = check_items(payload, "delete")
+    if len(creates) + len(updates) + len(deletes) > MAX_ITEMS:
+        raise BatchError("Не больше %d элементов за запрос" % MAX_ITEMS)
+
+    results = {"create": [], "update": [], "delete": []}
+    with transaction.atomic():
+        parents = {}
+        if kind.parent_field and creates:
+            parents = kind.parents().in_bulk(get_ids(creates, kind.parent_field))
+        new_objects = []
+        for item in creates:
+            form = kind.form_class(data=form_data(item))
+            parent_id = item.get(kind.parent_field)
+            parent = parents.get(parent_id) if is_id(parent_id) else None
+            valid = form.is_valid()
+            if kind.parent_field and parent is None:
+                form.add_error(None, "Не найден родитель %s" % kind.parent_field)
+                valid = False
+            if not valid:
+                results["create"].append({"errors": form_errors(form)})
+                continue
+            obj = form.save(commit=False)
+            obj.user = user
+            if parent is not None:
+                setattr(obj, kind.parent_field, parent)
+            new_objects.append(obj)
+            results["create"].append(obj)
+
+        objects = kind.objects().in_bulk(get_ids(updates, "id") | get_ids(deletes))
+        fields = kind.form_class._meta.fields
+        changed = []
+        for item in updates:
+            obj = objects.get(item["id"]) if is_id(item.get("id")) else None
+            if obj is None:
+                results["update"].append({"errors": {"id": ["Не найден"]}})
+                continue
+            data = form_data({**model_to_dict(obj, fields=fields), **item})
+            form = kind.form_class(data=data, instance=obj)
+            if not form.is_valid():
+                results["update"].append({"errors": form_errors(form)})
+                continue
+            changed.append(form.save(commit=False))
+            results["update"].append({"id": obj.pk})
+
+        lookup = {"user": user}
+        if kind.parent_field:
+            lookup["%s_id__in" % kind.parent_field] = {
+                getattr(obj, "%s_id" % kind.parent_field) for obj in new_objects
+            }
+        created = bulk_create_and_notify(kind.model, new_objects, **lookup)
+        bulk_update_and_notify(kind.model, changed, fields)
+
+        # Удаление каскадное и обновляет счётчики, поэтому идёт по одному
+        # объекту через soft_delete() (несколько UPDATE на объект).
+        for pk in deletes:
+            obj = objects.get(pk) if is_id(pk) else None
+            if obj is None:
+                results["delete"].append({"errors": {"id": ["Не найден"]}})
+                continue
+            obj.soft_delete()
+            results["delete"].append({"id": pk})
+
+    created = iter(created)
+    results["create"] = [
+        {"id": next(created).pk} if not isinstance(r, dict) else r
+        for r in results["create"]
+    ]
+    return results
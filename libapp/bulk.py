@@ -0,0 +1,62 @@
+import uuid
+
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from .signals import bulk_created, bulk_updated
+
+
+def bulk_insert(model, objects, batch_size=None, **lookup):
+    """
+    bulk_create, возвращающий созданные объекты с pk. MySQL не возвращает pk
+    из многострочного INSERT, поэтому там созданные строки перечитываются.
+    У моделей с полем insert_token строки вставки помечаются одной
+    случайной меткой и перечитываются по ней: при READ COMMITTED вставки
+    параллельных запросов того же пользователя в выборку не попадут.
+    Остальные модели (пользователи в seed_library) перечитываются по pk
+    больше прежнего максимума и фильтру lookup. Вызывать внутри транзакции.
+    """
+    objects = list(objects)
+    if not objects:
+        return []
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objects, batch_size=batch_size)
+    last_pk = model.objects.aggregate(last_pk=Max("pk"))["last_pk"] or 0
+    if any(field.name == "insert_token" for field in model._meta.concrete_fields):
+        token = uuid.uuid4()
+        for obj in objects:
+            obj.insert_token = token
+        lookup = {"insert_token": token}
+    model.objects.bulk_create(objects, batch_size=batch_size)
+    return list(model.objects.filter(pk__gt=last_pk, **lookup).order_by("pk"))
+
+
+def bulk_create_and_notify(model, objects, batch_size=None, **lookup):
+    """
+    bulk_insert с рассылкой сигнала bulk_created (индекс поиска, счётчики,
+    версии кэша). Возвращает созданные объекты с pk.
+    """
+    created = bulk_insert(model, objects, batch_size, **lookup)
+    if created:
+        bulk_created.send(sender=model, objects=created)
+    return created
+
+
+def bulk_update_and_notify(model, objects, fields, batch_size=None):
+    """
+    bulk_update с обновлением updated_at и рассылкой сигнала bulk_updated.
+    Счётчики пересчитываются по снимкам, сделанным при загрузке объектов,
+    поэтому объекты должны быть загружены из базы целиком.
+    """
+    objects = list(objects)
+    if not objects:
+        return 0
+    now = timezone.now()
+    for obj in objects:
+        obj.updated_at = now
+    updated = model.objects.bulk_update(
+        objects, [*fields, "updated_at"], batch_size=batch_size
+    )
+    bulk_updated.send(sender=model, objects=objects)
+    return updated
@@ -0,0 +1,70 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from library.replicas import reading_replica
+
+KEY_PREFIX = "libapp:version"
+FRAGMENT_TIMEOUT = getattr(settings, "LIBAPP_FRAGMENT_CACHE_TIMEOUT", 600)
+
+
+def fragment_timeout():
+    """
+    Время жизни фрагментов для {% cache %}. Страница, прочитанная с реплики,
+    могла отстать от текущей версии списка, поэтому её фрагменты не
+    сохраняются (0 - запись сразу устаревает).
+    """
+    return 0 if reading_replica() else FRAGMENT_TIMEOUT
+
+
+def version_key(scope, pk=None):
+    if pk is None:
+        return "%s:%s" % (KEY_PREFIX, scope)
+    return "%s:%s:%s" % (KEY_PREFIX, scope, pk)
+
+
+def get_version(scope, pk=None):
+    """
+    Текущая версия списка. Если ключа нет (ещё не создан или вытеснен),
+    он заводится от текущего времени, чтобы не совпасть со старыми
+    фрагментами в кэше.
+    """
+    key = version_key(scope, pk)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump(*keys):
+    """
+    Увеличивает версии списков после фиксации транзакции, чтобы параллельный
+    запрос не закэшировал данные, которые ещё не видны. keys - пары
+    (scope, pk); pk может быть None.
+    """
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def _bump(keys):
+    for scope, pk in keys:
+        key = version_key(scope, pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def author_changed(author_id):
+    bump(("authors", None), ("author", author_id))
+
+
+def series_changed(author_id, series_id):
+    bump(("authors", None), ("author", author_id), ("series", series_id))
+
+
+def books_changed(series_ids):
+    bump(("authors", None), *(("series", pk) for pk in set(series_ids)))
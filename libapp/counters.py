@@ -0,0 +1,295 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import stats
+from .models import Author, SeriesBook, Book
+
+BOOK_COUNTERS = ("book_count", "rating_sum", "completed_count")
+
+
+def book_counters(book):
+    """Вклад книги в счётчики серии и автора."""
+    if book.is_deleted or book.series_id is None:
+        return {"book_count": 0, "rating_sum": 0, "completed_count": 0}
+    return {
+        "book_count": 1,
+        "rating_sum": book.rating or 0,
+        "completed_count": 1 if book.is_completed else 0,
+    }
+
+
+def subtract(new, old):
+    return {key: new.get(key, 0) - old.get(key, 0) for key in new.keys() | old.keys()}
+
+
+def increment(queryset, delta):
+    """
+    Прибавляет delta к счётчикам и обновляет updated_at: изменение дочерних
+    строк меняет и страницу родителя (см. условные GET в libapp.utils).
+    """
+    updates = {key: F(key) + value for key, value in delta.items() if value}
+    queryset.update(updated_at=timezone.now(), **updates)
+
+
+def apply_book_delta(series_id, delta):
+    """Прибавляет delta к счётчикам серии и её автора (два UPDATE)."""
+    apply_book_deltas({series_id: delta})
+
+
+def apply_book_deltas(deltas):
+    """
+    Прибавляет {series_id: delta} к счётчикам серий и их авторов, затем
+    сбрасывает их в кэше объектов.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if pk is not None}
+    for series_id, delta in deltas.items():
+        increment(SeriesBook.objects.filter(pk=series_id), delta)
+        increment(
+            Author.objects.filter(
+                pk__in=SeriesBook.objects.filter(pk=series_id).values("author_id")
+            ),
+            delta,
+        )
+    invalidate_series(deltas)
+
+
+def invalidate_series(series_ids):
+    """
+    Сбрасывает в кэше объектов серии и их авторов. Автор серии берётся из
+    кэша, и только для серий, которых там нет, - одним запросом.
+    """
+    series_ids = set(series_ids)
+    if not series_ids:
+        return
+    cached = SeriesBook.cached.peek_many(series_ids)
+    author_ids = {series.author_id for series in cached.values()}
+    missing = series_ids - cached.keys()
+    if missing:
+        author_ids.update(
+            SeriesBook.objects.filter(pk__in=missing).values_list(
+                "author_id", flat=True
+            )
+        )
+    SeriesBook.cached.invalidate(series_ids)
+    Author.cached.invalidate(author_ids)
+
+
+def apply_series_delta(author_id, delta):
+    if author_id is not None:
+        increment(Author.objects.filter(pk=author_id), delta)
+        Author.cached.invalidate([author_id])
+
+
+def add_books(books):
+    """
+    Учитывает в счётчиках пачку новых книг (например после bulk_create):
+    по два UPDATE на каждую затронутую серию.
+    """
+    deltas = defaultdict(lambda: dict.fromkeys(BOOK_COUNTERS, 0))
+    stat_deltas = stats.new_deltas()
+    for book in books:
+        new = book_counters(book)
+        for key, value in new.items():
+            deltas[book.series_id][key] += value
+        stats.add(stat_deltas, book.user_id, stats.book_buckets(book, new))
+    apply_book_deltas(deltas)
+    stats.apply(stat_deltas)
+
+
+def add_series(series_list):
+    """Учитывает в счётчиках авторов пачку новых серий."""
+    deltas = defaultdict(int)
+    for series in series_list:
+        if not series.is_deleted:
+            deltas[series.author_id] += 1
+    for author_id, count in deltas.items():
+        apply_series_delta(author_id, {"series_count": count})
+
+
+def update_books(books):
+    """
+    Учитывает в счётчиках пачку изменённых книг (после bulk_update) по их
+    снимкам: по два UPDATE на каждую затронутую серию. Книги без снимка
+    пересчитываются целиком.
+    """
+    deltas = defaultdict(lambda: dict.fromkeys(BOOK_COUNTERS, 0))
+    stat_deltas = stats.new_deltas()
+    stale = set()
+    stale_users = set()
+    for book in books:
+        if not hasattr(book, "_counter_snapshot"):
+            stale.add(book.series_id)
+            stale_users.add(book.user_id)
+            continue
+        old_series_id, old = book._counter_snapshot
+        new = book_counters(book)
+        for key, value in old.items():
+            deltas[old_series_id][key] -= value
+        for key, value in new.items():
+            deltas[book.series_id][key] += value
+        stats.add(stat_deltas, book.user_id, stats.book_buckets(book, old), -1)
+        stats.add(stat_deltas, book.user_id, stats.book_buckets(book, new))
+        snapshot(book)
+    apply_book_deltas(deltas)
+    stats.apply(stat_deltas)
+    if stale:
+        recount_series(SeriesBook.objects.filter(pk__in=stale))
+        stats.rebuild(stale_users - {None})
+
+
+def touch_authors(series_list):
+    """Обновляет updated_at авторов изменённых серий (одним UPDATE)."""
+    author_ids = {series.author_id for series in series_list}
+    increment(Author.objects.filter(pk__in=author_ids), {})
+    Author.cached.invalidate(author_ids)
+
+
+SNAPSHOT_FIELDS = {
+    Book: {"series", "is_deleted", "rating", "is_completed"},
+    SeriesBook: {"author", "is_deleted"},
+}
+
+
+def snapshot(instance):
+    """
+    Запоминает состояние объекта, чтобы после save() посчитать разницу.
+    Для объектов с отложенными полями снимок не делается (иначе был бы
+    лишний запрос), и после сохранения счётчики пересчитываются целиком.
+    """
+    fields = SNAPSHOT_FIELDS.get(type(instance))
+    if fields is None:
+        return
+    deferred = instance.get_deferred_fields()
+    if deferred & fields or deferred & {f + "_id" for f in fields}:
+        return
+    if isinstance(instance, Book):
+        instance._counter_snapshot = (instance.series_id, book_counters(instance))
+    else:
+        instance._counter_snapshot = (instance.author_id, instance.is_deleted)
+
+
+def book_saved(book, created):
+    new = book_counters(book)
+    stat_deltas = stats.new_deltas()
+    stats.add(stat_deltas, book.user_id, stats.book_buckets(book, new))
+    if created:
+        apply_book_delta(book.series_id, new)
+    elif not hasattr(book, "_counter_snapshot"):
+        recount_series(SeriesBook.objects.filter(pk=book.series_id))
+        if book.user_id is not None:
+            stats.rebuild([book.user_id])
+        snapshot(book)
+        return
+    else:
+        old_series_id, old = book._counter_snapshot
+        stats.add(stat_deltas, book.user_id, stats.book_buckets(book, old), -1)
+        if old_series_id == book.series_id:
+            apply_book_delta(book.series_id, subtract(new, old))
+        else:
+            apply_book_delta(old_series_id, subtract({}, old))
+            apply_book_delta(book.series_id, new)
+    stats.apply(stat_deltas)
+    snapshot(book)
+
+
+def series_saved(series, created):
+    if created:
+        old_author_id, old_deleted = series.author_id, True
+    elif not hasattr(series, "_counter_snapshot"):
+        recount_authors(Author.objects.filter(pk=series.author_id))
+        snapshot(series)
+        return
+    else:
+        old_author_id, old_deleted = series._counter_snapshot
+    if old_author_id != series.author_id or old_deleted != series.is_deleted:
+        contribution = {
+            "series_count": 1,
+            **SeriesBook.objects.filter(pk=series.pk).values(*BOOK_COUNTERS).get(),
+        }
+        if not old_deleted:
+            apply_series_delta(old_author_id, subtract({}, contribution))
+        if not series.is_deleted:
+            apply_series_delta(series.author_id, contribution)
+    else:
+        apply_series_delta(series.author_id, {})
+    snapshot(series)
+
+
+def series_soft_deleted(series):
+    """Вычитает удалённую каскадом серию (со всеми книгами) из счётчиков автора."""
+    totals = (
+        SeriesBook.objects.filter(pk=series.pk)
+        .values("author_id", *BOOK_COUNTERS)
+        .get()
+    )
+    author_id = totals.pop("author_id")
+    apply_series_delta(author_id, subtract({}, {"series_count": 1, **totals}))
+
+
+def book_soft_deleted(book):
+    # Вызывается до того, как soft_delete() выставит book.is_deleted.
+    old = book_counters(book)
+    apply_book_delta(book.series_id, subtract({}, old))
+    stat_deltas = stats.new_deltas()
+    stats.add(stat_deltas, book.user_id, stats.book_buckets(book, old), -1)
+    stats.apply(stat_deltas)
+
+
+def recount_series(queryset):
+    """Пересчитывает счётчики серий и их авторов из фактических данных."""
+    recount_authors(Author.objects.filter(pk__in=queryset.values("author_id")))
+    pks = list(queryset.values_list("pk", flat=True))
+    count = queryset.update(updated_at=timezone.now(), **series_actual_counters())
+    SeriesBook.cached.invalidate(pks)
+    return count
+
+
+def recount_authors(queryset):
+    pks = list(queryset.values_list("pk", flat=True))
+    count = queryset.update(updated_at=timezone.now(), **author_actual_counters())
+    Author.cached.invalidate(pks)
+    return count
+
+
+def aggregate(queryset, group_field, expression):
+    return Coalesce(
+        Subquery(
+            queryset.order_by()
+            .values(group_field)
+            .annotate(value=expression)
+            .values("value")[:1]
+        ),
+        Value(0),
+    )
+
+
+def book_aggregates(books, group_field):
+    return {
+        "book_count": aggregate(books, group_field, Count("pk")),
+        "rating_sum": aggregate(books, group_field, Sum("rating")),
+        "completed_count": aggregate(
+            books, group_field, Count("pk", filter=Q(is_completed=True))
+        ),
+    }
+
+
+def author_actual_counters():
+    """Выражения с фактическими значениями счётчиков автора."""
+    return {
+        "series_count": aggregate(
+            SeriesBook.undeleted.filter(author=OuterRef("pk")), "author", Count("pk")
+        ),
+        **book_aggregates(
+            Book.undeleted.filter(
+                series__author=OuterRef("pk"), series__is_deleted=False
+            ),
+            "series__author",
+        ),
+    }
+
+
+def series_actual_counters():
+    return book_aggregates(Book.undeleted.filter(series=OuterRef("pk")), "series")
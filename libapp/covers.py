@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.http import Http404
+from django.urls import reverse
+
+from . import jobs
+from .pools import get_executor
+from .thumbnails import FORMATS, height_for, make_thumbnails, thumbnail_name
+
+logger = logging.getLogger("libapp.covers")
+
+# Ширины уменьшенных копий; высота - по пропорциям thumbnails.ASPECT.
+WIDTHS = (64, 128, 256)
+# Где показывается обложка -> ширина на экране и загрузка изображения.
+# Для экранов с плотностью 2x берётся копия вдвое шире.
+DISPLAYS = {
+    "list": {"width": 64, "loading": "lazy"},
+    "page": {"width": 128, "loading": "eager"},
+}
+ACCEPTED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+CONTENT_TYPES = {"webp": "image/webp", "jpg": "image/jpeg"}
+ORIGINAL = "original"
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+# Адрес файла зависит от содержимого, поэтому его можно кэшировать вечно.
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def root():
+    return os.path.join(settings.MEDIA_ROOT, "covers")
+
+
+def directory(digest):
+    """MEDIA_ROOT/covers/ab/abcdef...: два уровня, чтобы не держать всё в одном."""
+    return os.path.join(root(), digest[:2], digest)
+
+
+def validate(upload):
+    """
+    Вызывается для файла, уже проверенного forms.ImageField (upload.image -
+    открытое Pillow изображение).
+    """
+    max_bytes = settings.LIBAPP_COVER_MAX_BYTES
+    if upload.size > max_bytes:
+        raise ValidationError(
+            "Файл больше %d МБ" % (max_bytes // (1024 * 1024)), code="file_size"
+        )
+    if upload.image.format not in ACCEPTED_FORMATS:
+        raise ValidationError(
+            "Поддерживаются JPEG, PNG, WebP и GIF", code="invalid_image"
+        )
+
+
+def store(upload):
+    """
+    Сохраняет оригинал обложки под путём из sha256 содержимого и ставит
+    уменьшение в пул процессов; возвращает хэш для поля cover. Одинаковые
+    файлы хранятся один раз, повторная загрузка ничего не пишет.
+    """
+    sha = hashlib.sha256()
+    for chunk in upload.chunks():
+        sha.update(chunk)
+    digest = sha.hexdigest()
+    folder = directory(digest)
+    path = os.path.join(folder, ORIGINAL)
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+        os.replace(tmp, path)
+    if not is_ready(digest):
+        submit(digest)
+    return digest
+
+
+def is_ready(digest):
+    folder = directory(digest)
+    return all(
+        os.path.exists(os.path.join(folder, thumbnail_name(width, extension)))
+        for width in WIDTHS
+        for extension in FORMATS
+    )
+
+
+def submit(digest):
+    """
+    Уменьшает обложку в пуле процессов, не задерживая ответ. С
+    LIBAPP_COVER_WORKERS = 0 - сразу в текущем процессе (тесты, команды).
+    """
+    folder = directory(digest)
+    args = (os.path.join(folder, ORIGINAL), folder, WIDTHS)
+    if not settings.LIBAPP_COVER_WORKERS:
+        return make_thumbnails(*args)
+    executor = get_executor("covers", settings.LIBAPP_COVER_WORKERS)
+    future = executor.submit(make_thumbnails, *args)
+    future.add_done_callback(lambda f: log_failure(digest, f))
+    return future
+
+
+def log_failure(digest, future):
+    if future.exception() is None:
+        return
+    logger.error(
+        "Не удалось уменьшить обложку %s",
+        digest,
+        exc_info=future.exception(),
+        extra={"digest": digest},
+    )
+    # Повтор - фоновой задачей с задержкой (libapp.jobs). Обратный вызов
+    # выполняется в служебном потоке пула со своим соединением с базой.
+    try:
+        jobs.enqueue("cover_thumbnails", {"digest": digest})
+    finally:
+        connections.close_all()
+
+
+def url(digest, width, extension):
+    return reverse("cover", args=(digest[:2], digest, thumbnail_name(width, extension)))
+
+
+def srcset(digest, width, extension):
+    sources = [url(digest, width, extension)]
+    if width * 2 in WIDTHS:
+        sources[0] += " 1x"
+        sources.append(url(digest, width * 2, extension) + " 2x")
+    return ", ".join(sources)
+
+
+def picture(digest, display):
+    """Контекст шаблона libapp/cover.html: <picture> с WebP и JPEG."""
+    options = DISPLAYS[display]
+    width = options["width"]
+    return {
+        "display": display,
+        "webp": srcset(digest, width, "webp"),
+        "jpg": srcset(digest, width, "jpg"),
+        "src": url(digest, width, "jpg"),
+        "width": width,
+        "height": height_for(width),
+        "loading": options["loading"],
+    }
+
+
+def thumbnail_path(shard, digest, name):
+    """Путь к уменьшенной копии по частям адреса; чужие имена - 404."""
+    names = {thumbnail_name(w, e) for w in WIDTHS for e in FORMATS}
+    if not DIGEST_RE.fullmatch(digest) or shard != digest[:2] or name not in names:
+        raise Http404
+    return os.path.join(directory(digest), name)
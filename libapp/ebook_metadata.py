@@ -0,0 +1,182 @@
+"""
+Чтение метаданных EPUB и FB2: название, авторы, серия, номер в серии и
+аннотация. Модуль не зависит от Django и выполняется в процессах пула
+(libapp.metadata). Файлы читаются потоково: из EPUB распаковывается только
+OPF, FB2 разбирается до конца <description>, тело книги не читается.
+"""
+
+import html
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+
+MAX_ANNOTATION = 5000
+TAG_RE = re.compile(r"<[^>]+>")
+SPACES_RE = re.compile(r"[ \t\r\f\v]+")
+
+
+class MetadataError(Exception):
+    pass
+
+
+def local(tag):
+    """Имя элемента или атрибута без пространства имён."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def attr(element, name):
+    for key, value in element.attrib.items():
+        if local(key) == name:
+            return value
+    return None
+
+
+def clean(text):
+    text = SPACES_RE.sub(" ", html.unescape(TAG_RE.sub(" ", text or "")))
+    lines = (line.strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)[:MAX_ANNOTATION]
+
+
+def series_index(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def empty():
+    return {
+        "title": "",
+        "authors": [],
+        "series": "",
+        "series_index": None,
+        "annotation": "",
+    }
+
+
+def read_epub(path):
+    try:
+        with zipfile.ZipFile(path) as archive:
+            with archive.open("META-INF/container.xml") as f:
+                container = ElementTree.parse(f).getroot()
+            rootfile = next(
+                (e for e in container.iter() if local(e.tag) == "rootfile"), None
+            )
+            if rootfile is None or not attr(rootfile, "full-path"):
+                raise MetadataError("В container.xml нет OPF")
+            with archive.open(posixpath.normpath(attr(rootfile, "full-path"))) as f:
+                return parse_opf(f)
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise MetadataError("Не удалось прочитать EPUB: %s" % e)
+
+
+def parse_opf(f):
+    """Разбирает <metadata> OPF и останавливается на его конце."""
+    result = empty()
+    collections = {}
+    positions = {}
+    for event, element in ElementTree.iterparse(f, events=("end",)):
+        name = local(element.tag)
+        text = (element.text or "").strip()
+        if name == "title" and not result["title"]:
+            result["title"] = text
+        elif name == "creator" and text:
+            if attr(element, "role") in (None, "aut"):
+                result["authors"].append(text)
+        elif name == "description" and not result["annotation"]:
+            result["annotation"] = clean(text)
+        elif name == "meta":
+            meta_name, prop = attr(element, "name"), attr(element, "property")
+            if meta_name == "calibre:series":
+                result["series"] = attr(element, "content") or ""
+            elif meta_name == "calibre:series_index":
+                result["series_index"] = series_index(attr(element, "content"))
+            elif prop == "belongs-to-collection":
+                collections[attr(element, "id")] = text
+            elif prop == "group-position" and attr(element, "refines"):
+                positions[attr(element, "refines").lstrip("#")] = text
+        elif name == "metadata":
+            break
+    if not result["series"] and collections:
+        key, result["series"] = next(iter(collections.items()))
+        result["series_index"] = series_index(positions.get(key))
+    return result
+
+
+def read_fb2(path):
+    try:
+        with open(path, "rb") as f:
+            return parse_fb2(f)
+    except ElementTree.ParseError as e:
+        raise MetadataError("Не удалось прочитать FB2: %s" % e)
+
+
+def author_name(element):
+    parts = {local(child.tag): (child.text or "").strip() for child in element}
+    name = " ".join(
+        parts[key]
+        for key in ("first-name", "middle-name", "last-name")
+        if parts.get(key)
+    )
+    return name or parts.get("nickname", "")
+
+
+def parse_fb2(f):
+    """Читает <title-info> и останавливается на конце <description>."""
+    result = empty()
+    path = []
+    for event, element in ElementTree.iterparse(f, events=("start", "end")):
+        name = local(element.tag)
+        if event == "start":
+            path.append(name)
+            continue
+        path.pop()
+        if "title-info" not in path:
+            if name == "description":
+                break
+            continue
+        parent = path[-1]
+        if parent != "title-info":
+            continue
+        if name == "book-title":
+            result["title"] = (element.text or "").strip()
+        elif name == "author":
+            author = author_name(element)
+            if author:
+                result["authors"].append(author)
+        elif name == "sequence" and not result["series"]:
+            result["series"] = (attr(element, "name") or "").strip()
+            result["series_index"] = series_index(attr(element, "number"))
+        elif name == "annotation":
+            result["annotation"] = clean("\n".join(element.itertext()))
+    return result
+
+
+READERS = {"epub": read_epub, "fb2": read_fb2}
+
+
+def read_metadata(path, file_format):
+    """
+    Метаданные файла или MetadataError. Для пула: исключения других типов
+    тоже превращаются в MetadataError, чтобы один битый файл не прерывал
+    пакетную обработку.
+    """
+    try:
+        return READERS[file_format](path)
+    except MetadataError:
+        raise
+    except Exception as e:
+        raise MetadataError("%s: %s" % (type(e).__name__, e))
+
+
+def read_many(items):
+    """[(id, путь, формат)] -> [(id, метаданные, ошибка)] для Pool.map."""
+    results = []
+    for pk, path, file_format in items:
+        try:
+            results.append((pk, read_metadata(path, file_format), None))
+        except MetadataError as e:
+            results.append((pk, None, str(e)))
+    return results
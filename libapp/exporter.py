@@ -0,0 +1,123 @@
+import csv
+import json
+
+from django.utils.text import compress_sequence
+
+from .models import Author, SeriesBook, Book
+
+FORMATS = ("csv", "jsonl")
+FIELDS = [
+    "author",
+    "series",
+    "name",
+    "description",
+    "rating",
+    "is_completed",
+    "series_description",
+    "series_rating",
+    "series_is_completed",
+]
+CHUNK_SIZE = 2000
+CONTENT_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+def iter_records(user, chunk_size=CHUNK_SIZE):
+    """
+    Все записи библиотеки пользователя в формате импорта (libapp.importer).
+    Книги читаются одним запросом с select_related через iterator(), поэтому
+    память не зависит от размера библиотеки. Порядок - по pk: сортировка по
+    именам через соединение заставила бы базу отсортировать все строки до
+    отправки первой. Пустые серии и авторы без серий находятся по
+    денормализованным счётчикам и выводятся строками без книги. Поля серии
+    повторяются в каждой строке, импорт берёт их из первой.
+    """
+    books = (
+        Book.undeleted.filter(
+            series__is_deleted=False,
+            series__author__is_deleted=False,
+            series__author__user=user,
+        )
+        .select_related("series__author")
+        .order_by("pk")
+    )
+    for book in books.iterator(chunk_size=chunk_size):
+        yield {
+            **series_fields(book.series),
+            "name": book.name,
+            "description": book.description or "",
+            "rating": book.rating,
+            "is_completed": book.is_completed,
+        }
+    empty_series = (
+        SeriesBook.undeleted.filter(
+            book_count=0, author__is_deleted=False, author__user=user
+        )
+        .select_related("author")
+        .order_by("pk")
+    )
+    for series in empty_series.iterator(chunk_size=chunk_size):
+        yield series_fields(series)
+    authors = Author.undeleted.filter(user=user, series_count=0).order_by("pk")
+    for author in authors.iterator(chunk_size=chunk_size):
+        yield {"author": author.name}
+
+
+def series_fields(series):
+    return {
+        "author": series.author.name,
+        "series": series.name,
+        "series_description": series.description or "",
+        "series_rating": series.rating,
+        "series_is_completed": series.is_completed,
+    }
+
+
+class Echo:
+    """Псевдофайл для csv.writer: write() возвращает строку, не сохраняя её."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(records):
+    writer = csv.DictWriter(Echo(), fieldnames=FIELDS, restval="")
+    yield writer.writeheader()
+    for record in records:
+        record = dict(record)
+        for field in ("is_completed", "series_is_completed"):
+            if field in record:
+                record[field] = int(record[field])
+        yield writer.writerow(record)
+
+
+def iter_jsonl(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+WRITERS = {"csv": iter_csv, "jsonl": iter_jsonl}
+
+
+def iter_export(user, file_format, compress=False, chunk_size=CHUNK_SIZE):
+    """
+    Поток байтов экспорта. Строки склеиваются в куски по chunk_size записей,
+    чтобы не отдавать серверу по одной короткой строке.
+    """
+    lines = WRITERS[file_format](iter_records(user, chunk_size))
+    chunks = iter_batches(lines, chunk_size)
+    return compress_sequence(chunks) if compress else chunks
+
+
+def iter_batches(lines, size):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield "".join(batch).encode()
+            batch = []
+    if batch:
+        yield "".join(batch).encode()
+
+
+def export_filename(file_format, compress=False):
+    return "library.%s%s" % (file_format, ".gz" if compress else "")
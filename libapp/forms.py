@@ -1,6 +1,9 @@
 from django import forms
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.template.defaultfilters import filesizeformat
 
+from . import attachments, covers
 from .models import Author, SeriesBook, Book
 
 
@@ -15,13 +18,39 @@ class AddAuthorForm(forms.ModelForm):
         labels = {"name": "Имя"}
 
 
-class AddSeriesBookForm(forms.ModelForm):
+class CoverFormMixin:
+    """
+    Поле cover - загружаемый файл; в модель попадает только хэш сохранённой
+    обложки (libapp.covers). Без файла обложка не меняется.
+    """
+
+    def clean_cover(self):
+        upload = self.cleaned_data["cover"]
+        if upload:
+            covers.validate(upload)
+        return upload
+
+    def save(self, commit=True):
+        # Представления вызывают save дважды (commit=False, затем True);
+        # файл сохраняется при первом вызове.
+        upload = self.cleaned_data.pop("cover", None)
+        if upload:
+            self.instance.cover = covers.store(upload)
+        return super().save(commit)
+
+
+class AddSeriesBookForm(CoverFormMixin, forms.ModelForm):
     rating = forms.IntegerField(
         min_value=0,
         max_value=10,
         label="Оценка",
         widget=forms.NumberInput(attrs={"class": "form-input"}),
     )
+    cover = forms.ImageField(
+        required=False,
+        label="Обложка",
+        widget=forms.FileInput(attrs={"class": "form-input", "accept": "image/*"}),
+    )
 
     class Meta:
         model = SeriesBook
@@ -40,13 +69,18 @@ class AddSeriesBookForm(forms.ModelForm):
         }
 
 
-class AddBookForm(forms.ModelForm):
+class AddBookForm(CoverFormMixin, forms.ModelForm):
     rating = forms.IntegerField(
         min_value=0,
         max_value=10,
         label="Оценка",
         widget=forms.NumberInput(attrs={"class": "form-input"}),
     )
+    cover = forms.ImageField(
+        required=False,
+        label="Обложка",
+        widget=forms.FileInput(attrs={"class": "form-input", "accept": "image/*"}),
+    )
 
     class Meta:
         model = Book
@@ -63,3 +97,100 @@ class AddBookForm(forms.ModelForm):
             # 'rating': 'Оценка',
             "is_completed": "Статус",
         }
+
+
+# Сколько книг можно добавить одной формой.
+BOOKS_PER_FORMSET = 100
+
+
+class AddBookRowForm(AddBookForm):
+    """
+    Строка формы нескольких книг. Без обложки: книги вставляются одним
+    bulk_create, обложку можно добавить потом на странице книги.
+    """
+
+    cover = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["description"].widget.attrs["rows"] = 2
+        # Браузер отправит первый вариант статуса и у нетронутой строки;
+        # с этим начальным значением она считается пустой и пропускается.
+        self.fields["is_completed"].initial = Book.Status.UNCOMPLETE
+
+
+class BaseAddBookFormSet(forms.BaseFormSet):
+    def clean(self):
+        if any(self.errors):
+            return
+        seen = set()
+        for form in self.filled_forms():
+            name = form.cleaned_data["name"].strip()
+            if name.casefold() in seen:
+                raise ValidationError("Книга «%s» указана несколько раз" % name)
+            seen.add(name.casefold())
+
+    def filled_forms(self):
+        """Заполненные строки; нетронутые добавленные строки пропускаются."""
+        return [form for form in self.forms if form.has_changed()]
+
+
+AddBookFormSet = forms.formset_factory(
+    AddBookRowForm,
+    formset=BaseAddBookFormSet,
+    extra=0,
+    min_num=1,
+    validate_min=True,
+    max_num=BOOKS_PER_FORMSET,
+    validate_max=True,
+    absolute_max=BOOKS_PER_FORMSET,
+)
+
+
+class ImportLibraryForm(forms.Form):
+    file = forms.FileField(
+        label="Файл", widget=forms.ClearableFileInput(attrs={"class": "form-input"})
+    )
+    format = forms.ChoiceField(
+        label="Формат",
+        required=False,
+        choices=[
+            ("", "По расширению файла"),
+            ("csv", "CSV"),
+            ("json", "JSON"),
+            ("jsonl", "JSONL"),
+        ],
+        widget=forms.Select(attrs={"class": "form-input"}),
+    )
+    background = forms.BooleanField(
+        label="В фоне",
+        required=False,
+        help_text="Для больших файлов: импорт выполнит фоновая задача",
+    )
+
+
+class BookFileForm(forms.Form):
+    file = forms.FileField(
+        required=False,
+        label="Файл",
+        widget=forms.FileInput(
+            attrs={"class": "form-input", "accept": ".epub,.fb2,.pdf"}
+        ),
+    )
+
+    def __init__(self, *args, too_large=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        # HashingUploadHandler пропускает слишком большой файл, и без этого
+        # флага форма сообщила бы, что файл не выбран.
+        self.too_large = too_large
+
+    def clean_file(self):
+        if self.too_large:
+            raise ValidationError(
+                "Файл больше %s" % filesizeformat(settings.LIBAPP_ATTACHMENT_MAX_BYTES)
+            )
+        upload = self.cleaned_data["file"]
+        if not upload:
+            raise ValidationError("Выберите файл")
+        attachments.detect_format(upload)
+        return upload
@@ -0,0 +1,303 @@
+import csv
+import json
+import time
+
+from django.db import transaction
+
+from .bulk import bulk_create_and_notify
+from .models import Author, SeriesBook, Book
+
+FORMATS = ("csv", "json", "jsonl")
+CHUNK_SIZE = 64 * 1024
+TRUE_VALUES = {"1", "true", "yes", "да", "завершено", "завершена"}
+
+
+class RecordError(ValueError):
+    pass
+
+
+def detect_format(filename, default="csv"):
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    return extension if extension in FORMATS else default
+
+
+def read_text_chunks(file, chunk_size=CHUNK_SIZE):
+    """Читает открытый в текстовом режиме файл кусками по chunk_size."""
+    return iter(lambda: file.read(chunk_size), "")
+
+
+def iter_lines(chunks):
+    """
+    Собирает строки (с символами перевода строки) из потока кусков текста.
+    Делит только по "\n": str.splitlines делит ещё и по U+2028, \x0c и
+    другим символам, которые JSON и CSV пишут внутри значений как есть.
+    "\r\n" остаётся в конце строки, csv разбирает его сам.
+    """
+    tail = ""
+    for chunk in chunks:
+        lines = (tail + chunk).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if tail:
+        yield tail
+
+
+def read_csv(chunks):
+    # csv.Error (поле больше csv.field_size_limit(), "\r" в поле без
+    # кавычек, NUL до Python 3.11) - ошибка файла, как некорректный JSON.
+    reader = csv.DictReader(iter_lines(chunks))
+    try:
+        yield from reader
+    except csv.Error as e:
+        raise RecordError("Строка %d: %s" % (reader.line_num, e))
+
+
+def read_jsonl(chunks):
+    for number, line in enumerate(iter_lines(chunks), 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise RecordError("Строка %d: %s" % (number, e))
+
+
+def read_json(chunks):
+    """
+    Потоково разбирает JSON-массив объектов: в памяти держится только
+    текущий кусок файла и один разбираемый объект.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    chunks = iter(chunks)
+    exhausted = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started:
+            if not buffer:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    raise RecordError("Пустой JSON-файл")
+                buffer += chunk
+                continue
+            if buffer[0] != "[":
+                raise RecordError("Ожидается JSON-массив объектов")
+            buffer = buffer[1:]
+            started = True
+            continue
+        if buffer.startswith(","):
+            buffer = buffer[1:]
+            continue
+        if buffer.startswith("]"):
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer)
+        except ValueError:
+            if exhausted:
+                raise RecordError("Некорректный JSON")
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+            else:
+                buffer += chunk
+            continue
+        yield obj
+        buffer = buffer[end:]
+
+
+READERS = {"csv": read_csv, "json": read_json, "jsonl": read_jsonl}
+
+
+def read_records(chunks, file_format):
+    return READERS[file_format](chunks)
+
+
+def clean_text(record, field, max_length=None, required=False):
+    value = record.get(field)
+    value = "" if value is None else str(value).strip()
+    if required and not value:
+        raise RecordError("Не заполнено поле %s" % field)
+    if max_length and len(value) > max_length:
+        raise RecordError("Поле %s длиннее %d символов" % (field, max_length))
+    return value
+
+
+def clean_rating(value):
+    if value in (None, ""):
+        return 0
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        raise RecordError("Оценка должна быть целым числом")
+    if not 0 <= rating <= 10:
+        raise RecordError("Оценка должна быть от 0 до 10")
+    return rating
+
+
+def clean_completed(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in TRUE_VALUES
+
+
+def clean_record(record):
+    if not isinstance(record, dict):
+        raise RecordError("Запись должна быть объектом")
+    # Запись без книги (или без серии) добавляет только автора и серию:
+    # так экспорт сохраняет пустые серии и авторов без серий.
+    cleaned = {
+        "author": clean_text(record, "author", 100, required=True),
+        "series": clean_text(record, "series", 255),
+        "name": clean_text(record, "name", 255),
+        "description": clean_text(record, "description"),
+        "rating": clean_rating(record.get("rating")),
+        "is_completed": clean_completed(record.get("is_completed")),
+        "series_description": clean_text(record, "series_description"),
+        "series_rating": clean_rating(record.get("series_rating")),
+        "series_is_completed": clean_completed(record.get("series_is_completed")),
+    }
+    if cleaned["name"] and not cleaned["series"]:
+        raise RecordError("Не заполнено поле series")
+    return cleaned
+
+
+class LibraryImporter:
+    """
+    Импорт книг из потока записей. Авторы и серии ищутся или создаются через
+    кэш имя -> pk, книги вставляются bulk_create порциями, каждая порция в
+    своей транзакции. Память не растёт с размером файла: в ней только текущая
+    порция и ограниченный кэш.
+    """
+
+    def __init__(self, user, batch_size=1000, cache_size=100000, progress=None):
+        self.user = user
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.authors = {}
+        self.series = {}
+        self.progress = progress
+        self.stats = {
+            "rows": 0,
+            "authors": 0,
+            "series": 0,
+            "books": 0,
+            "skipped": 0,
+            "errors": [],
+            "seconds": 0.0,
+        }
+
+    def run(self, records):
+        started = time.monotonic()
+        batch = []
+        for record in records:
+            self.stats["rows"] += 1
+            try:
+                batch.append(clean_record(record))
+            except RecordError as e:
+                self.skip(e)
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+                self.report(started)
+        if batch:
+            self.import_batch(batch)
+        self.report(started)
+        return self.stats
+
+    def skip(self, error):
+        self.stats["skipped"] += 1
+        if len(self.stats["errors"]) < 100:
+            self.stats["errors"].append("Запись %d: %s" % (self.stats["rows"], error))
+
+    def report(self, started):
+        self.stats["seconds"] = time.monotonic() - started
+        if self.progress:
+            self.progress(self.stats)
+
+    @transaction.atomic
+    def import_batch(self, batch):
+        # Кэши очищаются только между порциями, чтобы внутри порции
+        # все найденные pk оставались доступны.
+        for names in (self.authors, self.series):
+            if len(names) > self.cache_size:
+                names.clear()
+        self.resolve_authors({r["author"] for r in batch})
+        series = {}
+        for r in batch:
+            if r["series"]:
+                series.setdefault((self.authors[r["author"]], r["series"]), r)
+        self.resolve_series(series)
+        books = [
+            Book(
+                user=self.user,
+                name=r["name"],
+                description=r["description"],
+                rating=r["rating"],
+                is_completed=r["is_completed"],
+                series_id=self.series[self.authors[r["author"]], r["series"]],
+            )
+            for r in batch
+            if r["name"]
+        ]
+        created = bulk_create_and_notify(
+            Book,
+            books,
+            user=self.user,
+            series_id__in={book.series_id for book in books},
+        )
+        self.stats["books"] += len(created)
+
+    def resolve_authors(self, names):
+        missing = [name for name in names if name not in self.authors]
+        if not missing:
+            return
+        for pk, name in Author.undeleted.filter(
+            user=self.user, name__in=missing
+        ).values_list("pk", "name"):
+            self.authors[name] = pk
+        new = [name for name in missing if name not in self.authors]
+        created = bulk_create_and_notify(
+            Author,
+            (Author(user=self.user, name=name) for name in new),
+            user=self.user,
+        )
+        for author in created:
+            self.authors[author.name] = author.pk
+        self.stats["authors"] += len(created)
+
+    def resolve_series(self, keys):
+        """
+        keys - пары (pk автора, название) или словарь пара -> запись, из
+        которой новая серия получает описание, оценку и статус.
+        """
+        details = keys if isinstance(keys, dict) else {}
+        missing = [key for key in keys if key not in self.series]
+        if not missing:
+            return
+        for pk, author_id, name in SeriesBook.undeleted.filter(
+            user=self.user,
+            author_id__in={author_id for author_id, _ in missing},
+            name__in={name for _, name in missing},
+        ).values_list("pk", "author_id", "name"):
+            self.series[author_id, name] = pk
+        new = [key for key in missing if key not in self.series]
+        created = bulk_create_and_notify(
+            SeriesBook,
+            (self.new_series(key, details.get(key, {})) for key in new),
+            user=self.user,
+        )
+        for series in created:
+            self.series[series.author_id, series.name] = series.pk
+        self.stats["series"] += len(created)
+
+    def new_series(self, key, record):
+        author_id, name = key
+        return SeriesBook(
+            user=self.user,
+            author_id=author_id,
+            name=name,
+            description=record.get("series_description", ""),
+            rating=record.get("series_rating", 0),
+            is_completed=record.get("series_is_completed", False),
+        )
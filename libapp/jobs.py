@@ -0,0 +1,305 @@
+"""
+Фоновые задачи в таблице Job: ничего, кроме базы данных, не нужно.
+Задача ставится enqueue (можно в той же транзакции, что и данные), а
+выполняется командой run_workers. Обработчик забирает задачи с блокировкой
+строк (SKIP LOCKED, где база его поддерживает) и условным UPDATE, получает
+аренду на LIBAPP_JOB_LEASE_SECONDS и продлевает её, пока задача идёт.
+Ошибка - повтор с экспоненциальной задержкой, после max_attempts - FAILED.
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger("libapp.jobs")
+
+# Имя задачи -> функция fn(job), результат которой (JSON) пишется в
+# Job.result. Функции регистрируются в libapp.tasks.
+TASKS = {}
+# Имя задачи -> fn(job), вызываемая, когда задача брошена: обработчик
+# упал на последней попытке, и claim() переводит её в FAILED. Здесь
+# удаляется то, что задача убрала бы за собой сама (файлы и т.п.).
+ABANDON_HANDLERS = {}
+
+
+def task(name):
+    def register(fn):
+        TASKS[name] = fn
+        return fn
+
+    return register
+
+
+def on_abandon(name):
+    def register(fn):
+        ABANDON_HANDLERS[name] = fn
+        return fn
+
+    return register
+
+
+def enqueue(kind, payload=None, user=None, max_attempts=None, delay=0):
+    if kind not in TASKS:
+        raise ValueError("Неизвестная задача %s" % kind)
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        user=user,
+        max_attempts=max_attempts or settings.LIBAPP_JOB_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def lease():
+    return timedelta(seconds=settings.LIBAPP_JOB_LEASE_SECONDS)
+
+
+def backoff(attempt):
+    """
+    Задержка перед попыткой attempt + 1: удваивается с каждой попыткой до
+    LIBAPP_JOB_RETRY_MAX_SECONDS, случайная доля не даёт задачам, упавшим
+    вместе, повторяться тоже вместе.
+    """
+    delay = min(
+        settings.LIBAPP_JOB_RETRY_SECONDS * 2 ** (attempt - 1),
+        settings.LIBAPP_JOB_RETRY_MAX_SECONDS,
+    )
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def available(now):
+    """Задачи в очереди и задачи, чья аренда истекла (обработчик упал)."""
+    return Q(state=Job.State.QUEUED, run_at__lte=now) | Q(
+        state=Job.State.RUNNING, locked_until__lt=now
+    )
+
+
+def claim(worker, limit=1):
+    """
+    Забирает до limit задач. SELECT ... FOR UPDATE SKIP LOCKED не даёт двум
+    обработчикам ждать одни и те же строки; условный UPDATE по attempts
+    делает захват надёжным и там, где блокировок строк нет (SQLite).
+    """
+    now = timezone.now()
+    candidates = Job.objects.filter(available(now)).order_by("run_at", "pk")
+    if connection.features.has_select_for_update_skip_locked:
+        candidates = candidates.select_for_update(skip_locked=True)
+    claimed = []
+    abandoned = []
+    with transaction.atomic():
+        for job in candidates[:limit]:
+            same = Job.objects.filter(pk=job.pk, state=job.state, attempts=job.attempts)
+            if job.attempts >= job.max_attempts:
+                # Аренда последней попытки истекла: повторять больше нельзя.
+                if same.update(
+                    state=Job.State.FAILED,
+                    error=job.error or "Обработчик не завершил задачу",
+                    locked_by="",
+                    locked_until=None,
+                    updated_at=now,
+                ):
+                    abandoned.append(job)
+                continue
+            if same.update(
+                state=Job.State.RUNNING,
+                attempts=F("attempts") + 1,
+                locked_by=worker,
+                locked_until=now + lease(),
+                updated_at=now,
+            ):
+                job.state = Job.State.RUNNING
+                job.attempts += 1
+                job.locked_by = worker
+                claimed.append(job)
+    for job in abandoned:
+        abandon(job)
+    return claimed
+
+
+def abandon(job):
+    handler = ABANDON_HANDLERS.get(job.kind)
+    if handler is None:
+        return
+    try:
+        handler(job)
+    except Exception:
+        logger.exception(
+            "Не удалось убрать за брошенной задачей %s (%s)",
+            job.pk,
+            job.kind,
+            extra={"job": job.pk},
+        )
+
+
+def owned(job, worker):
+    return Job.objects.filter(pk=job.pk, state=Job.State.RUNNING, locked_by=worker)
+
+
+def renew(worker, pks):
+    """Продлевает аренду выполняющихся задач обработчика."""
+    now = timezone.now()
+    return Job.objects.filter(
+        pk__in=pks, state=Job.State.RUNNING, locked_by=worker
+    ).update(locked_until=now + lease(), updated_at=now)
+
+
+def progress(job, result):
+    """Промежуточный результат для страницы задачи; заодно продлевает аренду."""
+    now = timezone.now()
+    owned(job, job.locked_by).update(
+        result=result, locked_until=now + lease(), updated_at=now
+    )
+
+
+def complete(job, worker, result):
+    # Если аренду уже забрал другой обработчик, результат не записывается.
+    owned(job, worker).update(
+        state=Job.State.DONE,
+        result=result,
+        error="",
+        locked_by="",
+        locked_until=None,
+        updated_at=timezone.now(),
+    )
+
+
+def fail(job, worker, error):
+    now = timezone.now()
+    fields = {"error": error, "locked_by": "", "locked_until": None, "updated_at": now}
+    if job.attempts < job.max_attempts:
+        owned(job, worker).update(
+            state=Job.State.QUEUED, run_at=now + backoff(job.attempts), **fields
+        )
+    else:
+        owned(job, worker).update(state=Job.State.FAILED, **fields)
+
+
+def refresh_connections():
+    # Как после запроса: устаревшие и сломанные соединения закрываются.
+    # Внутри внешней транзакции (тесты) соединение не трогается.
+    if not connection.in_atomic_block:
+        close_old_connections()
+
+
+def execute(job, worker):
+    fn = TASKS.get(job.kind)
+    try:
+        if fn is None:
+            raise LookupError("Неизвестная задача %s" % job.kind)
+        result = fn(job)
+    except Exception as e:
+        logger.exception(
+            "Задача %s (%s) завершилась ошибкой",
+            job.pk,
+            job.kind,
+            extra={"job": job.pk, "attempt": job.attempts},
+        )
+        fail(job, worker, "%s: %s" % (type(e).__name__, e))
+        return False
+    complete(job, worker, result)
+    return True
+
+
+class Worker:
+    """
+    Обработчик run_workers: забирает задачи по числу свободных потоков и
+    выполняет их в пуле потоков. Задачи в основном ждут базу или диск, а
+    тяжёлые вычисления уходят в пулы процессов (libapp.pools), поэтому
+    потоков достаточно. threads = 0 - задачи выполняются по одной в
+    текущем потоке, аренду продлевает служебный поток.
+    """
+
+    def __init__(self, threads=4, poll=1.0, name=None):
+        self.threads = threads
+        self.poll = poll
+        self.name = name or "%s:%d:%s" % (
+            socket.gethostname(),
+            os.getpid(),
+            uuid.uuid4().hex[:6],
+        )
+        self.stopping = threading.Event()
+        self.stats = {"done": 0, "failed": 0}
+
+    def stop(self):
+        self.stopping.set()
+
+    def count(self, succeeded):
+        self.stats["done" if succeeded else "failed"] += 1
+
+    def run(self, once=False):
+        """once - выполнить доступные задачи и выйти (cron, тесты)."""
+        if self.threads:
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                self.run_pool(pool, once)
+        else:
+            while not self.stopping.is_set():
+                refresh_connections()
+                jobs = claim(self.name)
+                if jobs:
+                    self.count(self.execute_renewing(jobs[0]))
+                elif once:
+                    break
+                else:
+                    self.stopping.wait(self.poll)
+        return self.stats
+
+    def run_pool(self, pool, once):
+        running = {}
+        renewed = timezone.now()
+        while not self.stopping.is_set() or running:
+            refresh_connections()
+            free = self.threads - len(running)
+            if free and not self.stopping.is_set():
+                for job in claim(self.name, free):
+                    running[pool.submit(self.execute, job)] = job.pk
+            if not running:
+                if once:
+                    break
+                self.stopping.wait(self.poll)
+                continue
+            done, _ = wait(running, timeout=self.poll, return_when=FIRST_COMPLETED)
+            for future in done:
+                running.pop(future)
+                self.count(future.result())
+            if running and timezone.now() - renewed > lease() / 3:
+                renew(self.name, list(running.values()))
+                renewed = timezone.now()
+
+    def execute(self, job):
+        try:
+            return execute(job, self.name)
+        finally:
+            # У каждого потока пула своё соединение с базой.
+            connections.close_all()
+
+    def execute_renewing(self, job):
+        """Задача в текущем потоке, пока служебный поток продлевает аренду."""
+        done = threading.Event()
+        renewer = threading.Thread(
+            target=self.renew_until, args=(done, [job.pk]), daemon=True
+        )
+        renewer.start()
+        try:
+            return execute(job, self.name)
+        finally:
+            done.set()
+            renewer.join()
+
+    def renew_until(self, done, pks):
+        try:
+            while not done.wait(lease().total_seconds() / 3):
+                renew(self.name, pks)
+        finally:
+            connections.close_all()
@@ -0,0 +1,210 @@
+import asyncio
+import io
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import include, path, reverse
+
+from libapp import async_views, views
+from libapp.models import Author, SeriesBook, Book
+from libapp.urls import read_patterns
+
+HOST = "testserver"
+
+
+def urlconf(read_views):
+    return (
+        path("", include(read_patterns(read_views))),
+        path("", include("libapp.urls")),
+        path("users/", include("users.urls", namespace="users")),
+    )
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает страницы просмотра под WSGI (синхронные представления, "
+        "пул потоков) и ASGI (async_views, один цикл событий) в одном "
+        "процессе: p50/p99 и запросов в секунду при 1, 16 и 128 клиентах. "
+        "Работает на временной тестовой базе."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, nargs="+", default=[1, 16, 128])
+        parser.add_argument(
+            "--requests", type=int, default=20, help="запросов на клиента"
+        )
+        parser.add_argument(
+            "--wsgi-threads",
+            type=int,
+            default=8,
+            help="потоков WSGI-сервера (как --threads у gunicorn)",
+        )
+        parser.add_argument("--authors", type=int, default=50)
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            cookie = self.seed(options["authors"])
+            for clients in options["clients"]:
+                for mode in ("wsgi", "asgi"):
+                    read_views = async_views if mode == "asgi" else views
+                    with override_settings(ROOT_URLCONF=urlconf(read_views)):
+                        urls = self.get_urls()
+                        if mode == "wsgi":
+                            latencies, elapsed = self.run_wsgi(
+                                urls, cookie, clients, options
+                            )
+                        else:
+                            latencies, elapsed = asyncio.run(
+                                self.run_asgi(urls, cookie, clients, options)
+                            )
+                    self.report(mode, clients, latencies, elapsed)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def seed(self, authors):
+        user = get_user_model().objects.create_user(username="benchmark-asgi")
+        for i in range(authors):
+            author = Author.objects.create(user=user, name="Автор %03d" % i)
+            series = SeriesBook.objects.create(
+                user=user, author=author, name="Серия %d" % i, is_completed=False
+            )
+            for j in range(5):
+                Book.objects.create(
+                    user=user, series=series, name="Книга %d" % j, is_completed=0
+                )
+        self.author, self.series, self.book = author, series, series.book_set.first()
+        client = Client(HTTP_HOST=HOST)
+        client.force_login(user)
+        return "%s=%s" % (
+            settings.SESSION_COOKIE_NAME,
+            client.cookies[settings.SESSION_COOKIE_NAME].value,
+        )
+
+    def get_urls(self):
+        a, s, b = self.author.pk, self.series.pk, self.book.pk
+        return [
+            reverse("main_page"),
+            reverse("show_authors"),
+            reverse("show_author", args=(a,)),
+            reverse("show_series_book", args=(a, s)),
+            reverse("show_book", args=(a, s, b)),
+        ]
+
+    def run_wsgi(self, urls, cookie, clients, options):
+        """Клиенты - потоки; сервер обрабатывает не больше wsgi_threads сразу."""
+        handler = WSGIHandler()
+        server = threading.Semaphore(options["wsgi_threads"])
+        latencies = []
+
+        def check(status):
+            if not status.startswith("200"):
+                raise RuntimeError("Ответ %s" % status)
+
+        def request(url):
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": url,
+                "QUERY_STRING": "",
+                "SERVER_NAME": HOST,
+                "SERVER_PORT": "80",
+                "HTTP_HOST": HOST,
+                "HTTP_COOKIE": cookie,
+                "wsgi.input": io.BytesIO(),
+                "wsgi.errors": io.StringIO(),
+                "wsgi.url_scheme": "http",
+            }
+            started = time.perf_counter()
+            with server:
+                response = handler(environ, lambda status, headers: check(status))
+                b"".join(response)
+                response.close()
+            latencies.append(time.perf_counter() - started)
+
+        def client(number):
+            for i in range(options["requests"]):
+                request(urls[(number + i) % len(urls)])
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(client, range(clients)))
+        return latencies, time.perf_counter() - started
+
+    async def run_asgi(self, urls, cookie, clients, options):
+        handler = ASGIHandler()
+        latencies = []
+        never = asyncio.Event()
+
+        async def request(url):
+            body_sent = False
+
+            async def receive():
+                nonlocal body_sent
+                if not body_sent:
+                    body_sent = True
+                    return {"type": "http.request", "body": b"", "more_body": False}
+                await never.wait()
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    if message["status"] != 200:
+                        raise RuntimeError("Ответ %s" % message["status"])
+
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": url,
+                "raw_path": url.encode(),
+                "query_string": b"",
+                "root_path": "",
+                "headers": [(b"host", HOST.encode()), (b"cookie", cookie.encode())],
+                "client": ("127.0.0.1", 0),
+                "server": (HOST, 80),
+            }
+            started = time.perf_counter()
+            await handler(scope, receive, send)
+            latencies.append(time.perf_counter() - started)
+
+        async def client(number):
+            for i in range(options["requests"]):
+                await request(urls[(number + i) % len(urls)])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(number) for number in range(clients)))
+        return latencies, time.perf_counter() - started
+
+    def report(self, mode, clients, latencies, elapsed):
+        self.stdout.write(
+            "%s, клиентов %3d: p50 %6.1f мс, p99 %6.1f мс, %6.0f запросов/с"
+            % (
+                mode.upper(),
+                clients,
+                statistics.median(latencies) * 1000,
+                percentile(latencies, 99) * 1000,
+                len(latencies) / elapsed,
+            )
+        )
@@ -0,0 +1,67 @@
+import logging
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from library.log import JsonFormatter, QueueFileHandler
+
+
+class SlowWrites:
+    """Обёртка handler.emit с задержкой - имитация медленного диска."""
+
+    def __init__(self, handler, delay):
+        self.emit = handler.emit
+        self.delay = delay
+
+    def __call__(self, record):
+        self.emit(record)
+        time.sleep(self.delay)
+
+
+class Command(BaseCommand):
+    help = (
+        "Измеряет стоимость одного вызова logger.info() в вызывающем потоке: "
+        "обычный FileHandler против QueueFileHandler (очередь + фоновая запись)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calls", type=int, default=20000)
+        parser.add_argument(
+            "--disk-delay-us",
+            type=int,
+            nargs="+",
+            default=[0, 100],
+            help="задержка записи каждой строки, имитация медленного диска",
+        )
+
+    def handle(self, *args, **options):
+        for delay in options["disk_delay_us"]:
+            with tempfile.TemporaryDirectory() as directory:
+                plain = logging.FileHandler(os.path.join(directory, "plain.log"))
+                plain.setFormatter(JsonFormatter())
+                queued = QueueFileHandler(os.path.join(directory, "queued.log"))
+                if delay:
+                    plain.emit = SlowWrites(plain, delay / 1e6)
+                    queued.target.emit = SlowWrites(queued.target, delay / 1e6)
+                for name, handler in (
+                    ("FileHandler", plain),
+                    ("QueueFileHandler", queued),
+                ):
+                    per_call, drain = self.measure(handler, options["calls"])
+                    self.stdout.write(
+                        "задержка диска %d мкс, %s: %.2f мкс на вызов, "
+                        "дописывание очереди %.0f мс"
+                        % (delay, name, per_call * 1e6, drain * 1000)
+                    )
+
+    def measure(self, handler, calls):
+        logger = logging.Logger("benchmark_logging")
+        logger.addHandler(handler)
+        started = time.perf_counter()
+        for i in range(calls):
+            logger.info("GET /author/%d/series_book/ 200", i)
+        elapsed = time.perf_counter() - started
+        handler.close()
+        return elapsed / calls, time.perf_counter() - started - elapsed
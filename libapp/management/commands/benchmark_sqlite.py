@@ -0,0 +1,194 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse
+
+from libapp import object_cache
+from libapp.models import Author, SeriesBook, Book
+from libapp.seed import seed_library
+
+PREFIX = "bench-sqlite"
+
+
+def rate(seconds, requests):
+    """Запросов в секунду группы потоков: до завершения самого медленного."""
+    return len(seconds) * requests / max(seconds) if seconds else 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает SQLite с настройками по умолчанию и профиль LIBAPP_DB=sqlite "
+        "(WAL и LIBAPP_SQLITE_PRAGMAS): заполнение, чтение страниц, запись "
+        "книг через форму и смешанную нагрузку в несколько потоков. Каждый "
+        "вариант работает на своём временном файле базы."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument(
+            "--requests", type=int, default=50, help="запросов на поток"
+        )
+        parser.add_argument("--authors", type=int, default=50)
+        parser.add_argument("--series", type=int, default=250)
+        parser.add_argument("--books", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("Запускайте с профилем SQLite: LIBAPP_DB=sqlite")
+        profiles = [
+            ("По умолчанию", {}, {}),
+            (
+                "WAL и pragma",
+                settings.LIBAPP_SQLITE_PRAGMAS,
+                connection.settings_dict["OPTIONS"],
+            ),
+        ]
+        saved = dict(connection.settings_dict)
+        setup_test_environment(debug=False)
+        results = {}
+        try:
+            for name, pragmas, db_options in profiles:
+                with tempfile.TemporaryDirectory() as directory:
+                    connections.close_all()
+                    connection.settings_dict["NAME"] = os.path.join(
+                        directory, "benchmark.sqlite3"
+                    )
+                    connection.settings_dict["OPTIONS"] = db_options
+                    with override_settings(LIBAPP_SQLITE_PRAGMAS=pragmas):
+                        results[name] = self.run_profile(options)
+                        connections.close_all()
+                self.report(name, results[name])
+        finally:
+            connections.close_all()
+            connection.settings_dict.update(saved)
+            teardown_test_environment()
+        stock, tuned = results.values()
+        for key, label in (
+            ("read", "чтение"),
+            ("write", "запись"),
+            ("mixed_read", "чтение под записью"),
+        ):
+            self.stdout.write(
+                "Ускорение (%s): %.1fx" % (label, tuned[key] / stock[key])
+            )
+
+    def run_profile(self, options):
+        call_command("migrate", verbosity=0)
+        cache.clear()
+        object_cache.clear()
+        started = time.perf_counter()
+        seed_library(
+            authors=options["authors"],
+            series=options["series"],
+            books=options["books"],
+            prefix=PREFIX,
+        )
+        result = {"seed": options["books"] / (time.perf_counter() - started)}
+
+        user = Author.objects.filter(user__username__startswith=PREFIX).first().user
+        login = Client()
+        login.force_login(user)
+        self.session = login.cookies[settings.SESSION_COOKIE_NAME].value
+        self.read_urls = self.get_read_urls(user)
+        self.write_urls = [
+            reverse("add_book", args=(series.author_id, series.pk))
+            for series in SeriesBook.objects.filter(user=user)[: options["threads"]]
+        ]
+        self.errors = 0
+        self.lock = threading.Lock()
+
+        threads, requests = options["threads"], options["requests"]
+        result["read"] = rate(self.run([self.reader] * threads, requests), requests)
+        result["write"] = rate(self.run([self.writer] * threads, requests), requests)
+        readers = max(1, threads // 2)
+        seconds = self.run(
+            [self.reader] * readers + [self.writer] * (threads - readers), requests
+        )
+        result["mixed_read"] = rate(seconds[:readers], requests)
+        result["mixed_write"] = rate(seconds[readers:], requests)
+        result["errors"] = self.errors
+        return result
+
+    def get_read_urls(self, user):
+        book = (
+            Book.objects.filter(user=user)
+            .select_related("series")
+            .order_by("pk")
+            .first()
+        )
+        a, s, b = book.series.author_id, book.series_id, book.pk
+        return [
+            reverse("main_page"),
+            reverse("show_authors"),
+            reverse("show_author", args=(a,)),
+            reverse("show_series_book", args=(a, s)),
+            reverse("show_book", args=(a, s, b)),
+        ]
+
+    def client(self):
+        client = Client(raise_request_exception=False)
+        client.cookies[settings.SESSION_COOKIE_NAME] = self.session
+        return client
+
+    def expect(self, response, status):
+        if response.status_code != status:
+            with self.lock:
+                self.errors += 1
+
+    def reader(self, client, number, i):
+        url = self.read_urls[(number + i) % len(self.read_urls)]
+        self.expect(client.get(url), 200)
+
+    def writer(self, client, number, i):
+        url = self.write_urls[number % len(self.write_urls)]
+        data = {"name": "Книга %d-%d" % (number, i), "description": "", "rating": 5}
+        self.expect(client.post(url, {**data, "is_completed": 0}), 302)
+
+    def work(self, worker, number, requests):
+        client = self.client()
+        started = time.perf_counter()
+        try:
+            for i in range(requests):
+                worker(client, number, i)
+        finally:
+            connections.close_all()
+        return time.perf_counter() - started
+
+    def run(self, workers, requests):
+        """Все потоки стартуют одновременно; возвращает время каждого."""
+        with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+            return list(
+                pool.map(
+                    self.work, workers, range(len(workers)), [requests] * len(workers)
+                )
+            )
+
+    def report(self, name, result):
+        self.stdout.write(
+            "%s: заполнение %6.0f книг/с, чтение %6.0f запросов/с, "
+            "запись %6.0f запросов/с, смешанная нагрузка %6.0f чтений/с и "
+            "%6.0f записей/с, ошибок %d"
+            % (
+                name,
+                result["seed"],
+                result["read"],
+                result["write"],
+                result["mixed_read"],
+                result["mixed_write"],
+                result["errors"],
+            )
+        )
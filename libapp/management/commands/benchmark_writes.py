@@ -0,0 +1,73 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from libapp.models import Author, SeriesBook
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает добавление книг через форму add_book и через пакетный "
+        "JSON API. Все изменения откатываются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200)
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(username="benchmark-writes")
+            author = Author.objects.create(user=user, name="Benchmark")
+            series = SeriesBook.objects.create(
+                user=user, author=author, name="Benchmark", is_completed=False
+            )
+            client = Client(HTTP_HOST="localhost")
+            client.force_login(user)
+            books = [
+                {"name": "Книга %d" % i, "description": "", "rating": i % 11}
+                for i in range(rows)
+            ]
+
+            url = reverse(
+                "add_book",
+                kwargs={"author_id": author.pk, "series_book_id": series.pk},
+            )
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for book in books:
+                    client.post(url, {**book, "is_completed": 0})
+                forms_time = time.perf_counter() - started
+            self.report("Формы", rows, forms_time, len(queries))
+
+            body = json.dumps(
+                {
+                    "create": [
+                        {**book, "series": series.pk, "is_completed": False}
+                        for book in books
+                    ]
+                }
+            )
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                client.post(
+                    reverse("api_batch", args=("books",)),
+                    body,
+                    content_type="application/json",
+                )
+                api_time = time.perf_counter() - started
+            self.report("API", rows, api_time, len(queries))
+            self.stdout.write("Ускорение: %.1fx" % (forms_time / api_time))
+            transaction.set_rollback(True)
+
+    def report(self, name, rows, seconds, queries):
+        self.stdout.write(
+            "%s: %d книг за %.3f с (%.0f книг/с, %d запросов)"
+            % (name, rows, seconds, rows / seconds, queries)
+        )
@@ -0,0 +1,27 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from libapp import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Ставит фоновую задачу, например: enqueue_job command "
+        '\'{"name": "recompute_counters"}\''
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(jobs.TASKS))
+        parser.add_argument("payload", nargs="?", default="{}", help="JSON")
+        parser.add_argument("--max-attempts", type=int)
+
+    def handle(self, *args, **options):
+        try:
+            payload = json.loads(options["payload"])
+        except ValueError as e:
+            raise CommandError("Некорректный JSON: %s" % e)
+        job = jobs.enqueue(
+            options["kind"], payload, max_attempts=options["max_attempts"]
+        )
+        self.stdout.write("Задача %d поставлена" % job.pk)
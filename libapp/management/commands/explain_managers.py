@@ -0,0 +1,79 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from libapp.models import Author, SeriesBook, Book
+
+
+class Command(BaseCommand):
+    help = "Печатает планы выполнения (EXPLAIN) для запросов менеджеров моделей."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, help="id пользователя")
+        parser.add_argument("--author", type=int, help="id автора")
+        parser.add_argument("--series", type=int, help="id серии")
+        parser.add_argument(
+            "--format", dest="explain_format", help="формат EXPLAIN (например JSON)"
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="выполнить запросы (EXPLAIN ANALYZE), если backend поддерживает",
+        )
+
+    def handle(self, *args, **options):
+        user_id = options["user"] or self.first_pk(get_user_model())
+        author_id = options["author"] or self.first_pk(Author)
+        series_id = options["series"] or self.first_pk(SeriesBook)
+        explain_options = {}
+        if options["explain_format"]:
+            explain_options["format"] = options["explain_format"]
+        if options["analyze"]:
+            explain_options["analyze"] = True
+
+        queries = [
+            ("Author.undeleted.all()", Author.undeleted.all()),
+            ("Author.deleted.all()", Author.deleted.all()),
+            ("Author.undeleted.filter(user)", Author.undeleted.filter(user=user_id)),
+            (
+                "SeriesBook.undeleted.filter(author)",
+                SeriesBook.undeleted.filter(author=author_id),
+            ),
+            (
+                "SeriesBook.deleted.filter(author)",
+                SeriesBook.deleted.filter(author=author_id),
+            ),
+            (
+                "SeriesBook.undeleted.filter(user)",
+                SeriesBook.undeleted.filter(user=user_id),
+            ),
+            ("Book.undeleted.filter(series)", Book.undeleted.filter(series=series_id)),
+            (
+                "Book.undeleted.filter(series, is_completed) по оценке",
+                Book.undeleted.filter(series=series_id, is_completed=True).order_by(
+                    "-rating", "-pk"
+                ),
+            ),
+            (
+                "SeriesBook.undeleted.filter(author) по дате",
+                SeriesBook.undeleted.filter(author=author_id).order_by(
+                    "-created_at", "-pk"
+                ),
+            ),
+            ("Book.deleted.filter(series)", Book.deleted.filter(series=series_id)),
+            ("Book.undeleted.filter(user)", Book.undeleted.filter(user=user_id)),
+            (
+                "Book.undeleted.filter(series__in=author series)",
+                Book.undeleted.filter(
+                    series__in=SeriesBook.objects.filter(author=author_id).values("pk")
+                ),
+            ),
+        ]
+        for title, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write("")
+
+    @staticmethod
+    def first_pk(model):
+        return model.objects.values_list("pk", flat=True).order_by("pk").first() or 0
@@ -0,0 +1,36 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from libapp.exporter import CHUNK_SIZE, FORMATS, iter_export
+
+
+class Command(BaseCommand):
+    help = "Потоково выгружает библиотеку пользователя в CSV или JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", required=True, help="имя пользователя")
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--output", help="файл; по умолчанию stdout")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options["user"])
+        except get_user_model().DoesNotExist:
+            raise CommandError("Пользователь %s не найден" % options["user"])
+        chunks = iter_export(
+            user, options["format"], options["gzip"], options["chunk_size"]
+        )
+        if options["output"]:
+            with open(options["output"], "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        elif options["gzip"]:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending="")
@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from libapp import metadata
+from libapp.attachments import METADATA_FORMATS
+from libapp.ebook_metadata import read_many
+from libapp.models import BookFile
+
+
+class Command(BaseCommand):
+    help = (
+        "Читает метаданные EPUB и FB2 в пуле процессов: файлы без книги "
+        "получают книгу, у книг заполняется пустое описание. По умолчанию - "
+        "файлы, ожидающие чтения; --all - все файлы заново."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="все файлы заново")
+        parser.add_argument(
+            "--user", action="append", default=[], help="логин; можно повторять"
+        )
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(), help="0 - без пула"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=50, help="файлов на задачу процесса"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="файлов на транзакцию"
+        )
+
+    def handle(self, *args, **options):
+        files = BookFile.objects.filter(format__in=METADATA_FORMATS).order_by("pk")
+        if not options["all"]:
+            files = files.filter(metadata_state=BookFile.MetadataState.PENDING)
+        if options["user"]:
+            files = files.filter(user__username__in=options["user"])
+        self.totals = {"done": 0, "failed": 0, "books": 0}
+        self.started = time.monotonic()
+        if not options["workers"]:
+            for batch in self.batches(files, options["batch_size"]):
+                self.apply(read_many(metadata.items(batch)))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=options["workers"],
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                self.run_pool(executor, files, options)
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Прочитано: %(done)d, ошибок: %(failed)d, создано книг: %(books)d"
+                % self.totals
+            )
+        )
+
+    def run_pool(self, executor, files, options):
+        # Следующая порция читается процессами, пока предыдущая
+        # записывается в базу.
+        size = options["chunk_size"]
+        waiting = []
+        for batch in self.batches(files, options["batch_size"]):
+            batch = metadata.items(batch)
+            futures = [
+                executor.submit(read_many, batch[i : i + size])
+                for i in range(0, len(batch), size)
+            ]
+            self.collect(waiting)
+            waiting = futures
+        self.collect(waiting)
+
+    def collect(self, futures):
+        if futures:
+            self.apply([result for f in futures for result in f.result()])
+
+    def batches(self, files, batch_size):
+        last_pk = 0
+        while True:
+            batch = list(
+                files.filter(pk__gt=last_pk).only("pk", "sha256", "format")[:batch_size]
+            )
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    def apply(self, results):
+        for key, value in metadata.apply(results).items():
+            self.totals[key] += value
+        count = self.totals["done"] + self.totals["failed"]
+        seconds = time.monotonic() - self.started
+        self.stdout.write(
+            "Обработано %d файлов за %.1f с (%.0f файлов/с)"
+            % (count, seconds, count / seconds if seconds else 0)
+        )
@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from libapp.importer import (
+    FORMATS,
+    LibraryImporter,
+    RecordError,
+    detect_format,
+    read_records,
+    read_text_chunks,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Потоково импортирует книги из CSV, JSON или JSONL. Поля записи: "
+        "author, series, name, description, rating, is_completed, "
+        "series_description, series_rating, series_is_completed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--user", required=True, help="имя пользователя")
+        parser.add_argument("--format", choices=FORMATS)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options["user"])
+        except get_user_model().DoesNotExist:
+            raise CommandError("Пользователь %s не найден" % options["user"])
+        file_format = options["format"] or detect_format(options["path"])
+        importer = LibraryImporter(
+            user, batch_size=options["batch_size"], progress=self.progress
+        )
+        with open(options["path"], encoding="utf-8-sig", newline="") as f:
+            try:
+                stats = importer.run(read_records(read_text_chunks(f), file_format))
+            except RecordError as e:
+                raise CommandError(str(e))
+            except UnicodeDecodeError as e:
+                raise CommandError("Файл не в кодировке UTF-8: %s" % e)
+        for error in stats["errors"]:
+            self.stderr.write(error)
+        self.stdout.write(
+            "Авторов: %(authors)d, серий: %(series)d, книг: %(books)d, "
+            "пропущено: %(skipped)d" % stats
+        )
+
+    def progress(self, stats):
+        rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+        self.stdout.write(
+            "Обработано %d записей за %.1f с (%.0f записей/с)"
+            % (stats["rows"], stats["seconds"], rate)
+        )
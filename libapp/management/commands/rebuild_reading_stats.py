@@ -0,0 +1,38 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from libapp.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Перестраивает сводку статистики чтения (ReadingStat) по фактическим "
+        "книгам: для заполнения после миграции или исправления расхождений."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", action="append", default=[], help="логин; можно повторять"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=100, help="пользователей на транзакцию"
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by("pk")
+        if options["user"]:
+            users = users.filter(username__in=options["user"])
+        count = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                users.filter(pk__gt=last_pk).values_list("pk", flat=True)[
+                    : options["chunk_size"]
+                ]
+            )
+            if not pks:
+                break
+            rebuild(pks)
+            count += len(pks)
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS("Сводка перестроена: %d" % count))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from libapp.models import Author, SeriesBook, Book, SearchIndex
+from libapp.search import index_objects
+
+
+class Command(BaseCommand):
+    help = "Перестраивает поисковый индекс по авторам, сериям и книгам."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        # Удаление и заполнение в одной транзакции: поиск до конца
+        # перестройки видит прежний индекс, а при ошибке он остаётся целым.
+        with transaction.atomic():
+            SearchIndex.objects.all().delete()
+            for model in (Author, SeriesBook, Book):
+                self.index_model(model, options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS("Индекс перестроен"))
+
+    def index_model(self, model, chunk_size):
+        count = 0
+        chunk = []
+        for obj in model.undeleted.order_by("pk").iterator(chunk_size=chunk_size):
+            chunk.append(obj)
+            if len(chunk) >= chunk_size:
+                index_objects(chunk, replace=False)
+                count += len(chunk)
+                chunk = []
+        index_objects(chunk, replace=False)
+        count += len(chunk)
+        self.stdout.write("%s: %d" % (model.__name__, count))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from libapp.counters import author_actual_counters, series_actual_counters
+from libapp.models import Author, SeriesBook
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет счётчики авторов и серий с фактическими данными "
+        "и исправляет расхождения порциями."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="только показать расхождения"
+        )
+
+    def handle(self, *args, **options):
+        for model, expressions in (
+            (SeriesBook, series_actual_counters),
+            (Author, author_actual_counters),
+        ):
+            fixed = self.repair(
+                model, expressions, options["chunk_size"], options["dry_run"]
+            )
+            self.stdout.write("%s: исправлено %d" % (model.__name__, fixed))
+
+    def repair(self, model, expressions, chunk_size, dry_run):
+        fixed = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                model.undeleted.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:chunk_size]
+            )
+            if not pks:
+                return fixed
+            last_pk = pks[-1]
+            actual = {"actual_%s" % k: v for k, v in expressions().items()}
+            drift = Q()
+            for field in model.counter_fields:
+                drift |= ~Q(**{field: F("actual_%s" % field)})
+            with transaction.atomic():
+                drifted = list(
+                    model.objects.filter(pk__in=pks)
+                    .annotate(**actual)
+                    .filter(drift)
+                    .values_list("pk", flat=True)
+                )
+                if drifted and not dry_run:
+                    model.objects.filter(pk__in=drifted).update(
+                        updated_at=timezone.now(), **expressions()
+                    )
+                    model.cached.invalidate(drifted)
+            fixed += len(drifted)
@@ -0,0 +1,35 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from libapp.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Выполняет фоновые задачи из таблицы Job в пуле потоков. SIGTERM и "
+        "Ctrl+C останавливают приём задач, начатые дорабатывают."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threads", type=int, default=4, help="0 - по одной в текущем потоке"
+        )
+        parser.add_argument(
+            "--poll", type=float, default=1.0, help="секунд между проверками очереди"
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="выполнить доступные задачи и выйти"
+        )
+        parser.add_argument("--name", help="имя обработчика в locked_by")
+
+    def handle(self, *args, **options):
+        worker = Worker(options["threads"], options["poll"], options["name"])
+        if not options["once"]:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *args: worker.stop())
+            self.stdout.write("Обработчик %s запущен" % worker.name)
+        stats = worker.run(once=options["once"])
+        self.stdout.write(
+            self.style.SUCCESS("Выполнено: %(done)d, с ошибкой: %(failed)d" % stats)
+        )
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from libapp.seed import seed_library
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерирует синтетическую библиотеку для проверки производительности, "
+        "например: seed_library --users 10 --authors 10000 --series 100000 "
+        "--books 1000000 --no-index"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1)
+        parser.add_argument("--authors", type=int, default=100)
+        parser.add_argument("--series", type=int, default=1000)
+        parser.add_argument("--books", type=int, default=10000)
+        parser.add_argument(
+            "--chunk-size", type=int, default=100, help="авторов на транзакцию"
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--no-index",
+            action="store_true",
+            help="не строить индекс поиска (rebuild_search_index позже)",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--prefix", default="seed", help="префикс имён пользователей"
+        )
+
+    def handle(self, *args, **options):
+        stats = seed_library(
+            users=options["users"],
+            authors=options["authors"],
+            series=options["series"],
+            books=options["books"],
+            chunk_size=options["chunk_size"],
+            batch_size=options["batch_size"],
+            index=not options["no_index"],
+            seed=options["seed"],
+            prefix=options["prefix"],
+            progress=self.progress,
+        )
+        self.stdout.write(
+            "Пользователей: %(users)d, авторов: %(authors)d, серий: %(series)d, "
+            "книг: %(books)d за %(seconds).1f с" % stats
+        )
+
+    def progress(self, stats):
+        rows = stats["authors"] + stats["series"] + stats["books"]
+        self.stdout.write(
+            "Авторов %d, книг %d (%.0f строк/с)"
+            % (stats["authors"], stats["books"], rows / stats["seconds"])
+        )
@@ -0,0 +1,153 @@
+import logging
+import os
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from . import jobs
+from .attachments import METADATA_FORMATS, path_for
+from .bulk import bulk_create_and_notify, bulk_update_and_notify
+from .ebook_metadata import read_many
+from .importer import LibraryImporter
+from .models import Book, BookFile
+from .pools import get_executor
+
+logger = logging.getLogger("libapp.metadata")
+
+UNKNOWN_AUTHOR = "Неизвестный автор"
+NO_SERIES = "Без серии"
+State = BookFile.MetadataState
+
+
+def items(files):
+    """Что передаётся в процесс пула: id, путь и формат файла."""
+    return [(f.pk, path_for(f.sha256), f.format) for f in files]
+
+
+def schedule(attachment):
+    """
+    После фиксации транзакции ставит чтение метаданных файла в пул
+    процессов: загрузка не ждёт разбора файла.
+    """
+    if attachment.format in METADATA_FORMATS:
+        transaction.on_commit(lambda: submit([attachment]))
+
+
+def submit(files):
+    """
+    Читает метаданные в пуле процессов, результат записывается в базу из
+    обратного вызова. С LIBAPP_METADATA_WORKERS = 0 - сразу в текущем
+    процессе (тесты, команды).
+    """
+    if not settings.LIBAPP_METADATA_WORKERS:
+        return apply(read_many(items(files)))
+    executor = get_executor("metadata", settings.LIBAPP_METADATA_WORKERS)
+    future = executor.submit(read_many, items(files))
+    pks = [f.pk for f in files]
+    future.add_done_callback(lambda f: apply_future(f, pks))
+    return future
+
+
+def apply_future(future, pks):
+    # Выполняется в служебном потоке пула, у него своё соединение с базой.
+    # При ошибке файлы остаются в PENDING, чтение повторяется фоновой
+    # задачей (libapp.jobs) или командой extract_book_metadata.
+    try:
+        apply(future.result())
+    except Exception:
+        logger.exception("Не удалось записать метаданные файлов книг")
+        jobs.enqueue("book_metadata", {"ids": pks})
+    finally:
+        connections.close_all()
+
+
+def apply(results):
+    """
+    Записывает результаты ebook_metadata.read_many: для файлов без книги
+    создаёт книгу (и при необходимости автора и серию), у существующих книг
+    заполняет пустое описание аннотацией. Одна транзакция на порцию.
+    """
+    results = {pk: (metadata, error) for pk, metadata, error in results}
+    stats = {"done": 0, "failed": 0, "books": 0}
+    with transaction.atomic():
+        files = list(
+            BookFile.objects.select_for_update(of=("self",))
+            .filter(pk__in=results)
+            .select_related("user", "book")
+            .order_by("pk")
+        )
+        by_user = defaultdict(list)
+        for attachment in files:
+            metadata, error = results[attachment.pk]
+            if error is None:
+                attachment.metadata = metadata
+                attachment.metadata_state = State.DONE
+                stats["done"] += 1
+            else:
+                attachment.metadata = {"error": error}
+                attachment.metadata_state = State.FAILED
+                stats["failed"] += 1
+            by_user[attachment.user_id].append(attachment)
+        for user_files in by_user.values():
+            importer = MetadataImporter(user_files[0].user)
+            importer.link(user_files)
+            stats["books"] += importer.stats["books"]
+        BookFile.objects.bulk_update(files, ["book", "metadata", "metadata_state"])
+    return stats
+
+
+def record(attachment):
+    """Запись для LibraryImporter; без метаданных - по имени файла."""
+    metadata = attachment.metadata if attachment.metadata_state == State.DONE else {}
+    authors = metadata.get("authors") or [UNKNOWN_AUTHOR]
+    return {
+        "author": authors[0][:100],
+        "series": (metadata.get("series") or NO_SERIES)[:255],
+        "name": (metadata.get("title") or os.path.splitext(attachment.name)[0])[:255]
+        or attachment.name[:255],
+        "description": metadata.get("annotation", ""),
+    }
+
+
+class MetadataImporter(LibraryImporter):
+    """
+    Книги по метаданным файлов. Авторы и серии ищутся по имени или
+    создаются так же, как при импорте из CSV.
+    """
+
+    def link(self, files):
+        new = [f for f in files if f.book_id is None]
+        records = [record(f) for f in new]
+        self.resolve_authors({r["author"] for r in records})
+        self.resolve_series({(self.authors[r["author"]], r["series"]) for r in records})
+        books = [
+            Book(
+                user=self.user,
+                name=r["name"],
+                description=r["description"],
+                is_completed=False,
+                series_id=self.series[self.authors[r["author"]], r["series"]],
+            )
+            for r in records
+        ]
+        created = bulk_create_and_notify(
+            Book,
+            books,
+            user=self.user,
+            series_id__in={book.series_id for book in books},
+        )
+        for attachment, book in zip(new, created):
+            attachment.book = book
+        self.stats["books"] += len(created)
+        self.fill_descriptions([f for f in files if f not in new])
+
+    def fill_descriptions(self, files):
+        books = {}
+        for attachment in files:
+            annotation = (attachment.metadata or {}).get("annotation")
+            book = attachment.book
+            if annotation and not book.description and book.pk not in books:
+                book.description = annotation
+                books[book.pk] = book
+        bulk_update_and_notify(Book, books.values(), ["description"])
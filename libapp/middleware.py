@@ -0,0 +1,127 @@
+import json
+import logging
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger("libapp.sql")
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+IN_LIST_RE = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+
+
+def sql_template(sql):
+    """
+    Шаблон запроса без значений: почти одинаковые запросы (N+1, IN разной
+    длины) дают один шаблон.
+    """
+    sql = LITERAL_RE.sub("%s", sql)
+    return IN_LIST_RE.sub("(%s...)", sql)
+
+
+def project_stack():
+    """Кадры стека из кода проекта, без Django и библиотек."""
+    frames = [
+        frame
+        for frame in traceback.extract_stack()[:-3]
+        if str(settings.BASE_DIR) in frame.filename
+        and "site-packages" not in frame.filename
+    ]
+    return "".join(traceback.format_list(frames[-8:]))
+
+
+class QueryRecorder:
+    """execute_wrapper: запоминает запросы, их время и стек второго повтора."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.templates = Counter()
+        self.statements = Counter()
+        self.stacks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            template = sql_template(sql)
+            self.templates[template] += 1
+            try:
+                self.statements[sql, repr(params)] += 1
+            except TypeError:
+                pass
+            if self.templates[template] == 2:
+                self.stacks[template] = project_stack()
+
+    def duplicates(self, limit=5):
+        exact = Counter()
+        for (sql, params), count in self.statements.items():
+            if count > 1:
+                exact[sql_template(sql)] += count - 1
+        return [
+            {"sql": template, "count": count, "exact_repeats": exact[template]}
+            for template, count in self.templates.most_common(limit)
+            if count > 1
+        ]
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Пишет по одной JSON-строке на запрос в логгер "libapp.sql" (по умолчанию
+    log/sql.jsonl): число SQL-запросов, время в базе, повторяющиеся запросы,
+    имя представления и общее время. Включается LIBAPP_SQL_INSTRUMENTATION.
+    Если запросов не меньше LIBAPP_SQL_TRACE_THRESHOLD, в запись добавляются
+    стеки вызова самых частых повторов. LIBAPP_SQL_SERVER_TIMING добавляет
+    заголовок Server-Timing.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "LIBAPP_SQL_INSTRUMENTATION", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.trace_threshold = getattr(settings, "LIBAPP_SQL_TRACE_THRESHOLD", 20)
+        self.server_timing = getattr(settings, "LIBAPP_SQL_SERVER_TIMING", False)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": getattr(request.resolver_match, "view_name", None),
+            "status": response.status_code,
+            "queries": recorder.count,
+            "db_ms": round(recorder.duration * 1000, 2),
+            "total_ms": round(total * 1000, 2),
+            "duplicates": recorder.duplicates(),
+        }
+        if recorder.count >= self.trace_threshold:
+            record["traces"] = [
+                {"sql": item["sql"], "stack": recorder.stacks.get(item["sql"], "")}
+                for item in record["duplicates"][:3]
+            ]
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        else:
+            logger.info(json.dumps(record, ensure_ascii=False))
+
+        if self.server_timing:
+            response["Server-Timing"] = (
+                'db;dur=%.2f;desc="%d queries", app;dur=%.2f'
+                % (recorder.duration * 1000, recorder.count, total * 1000)
+            )
+        return response
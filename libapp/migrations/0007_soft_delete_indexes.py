@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("libapp", "0006_book_description_seriesbook_description_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="author",
+            index=models.Index(
+                fields=["user", "is_deleted"], name="libapp_auth_user_id_60064d_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="author",
+            index=models.Index(
+                fields=["is_deleted"], name="libapp_auth_is_dele_49f3dc_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["series", "is_deleted"], name="libapp_book_series__ba4146_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["user", "is_deleted"], name="libapp_book_user_id_a73cff_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="seriesbook",
+            index=models.Index(
+                fields=["author", "is_deleted"], name="libapp_seri_author__a95663_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="seriesbook",
+            index=models.Index(
+                fields=["user", "is_deleted"], name="libapp_seri_user_id_3fa838_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("libapp", "0007_soft_delete_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="author",
+            name="libapp_auth_is_dele_49f3dc_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="book",
+            name="libapp_book_series__ba4146_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="seriesbook",
+            name="libapp_seri_author__a95663_idx",
+        ),
+        migrations.AddIndex(
+            model_name="author",
+            index=models.Index(
+                fields=["is_deleted", "name"], name="libapp_auth_is_dele_76cd2f_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["series", "is_deleted", "name"],
+                name="libapp_book_series__14207b_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="seriesbook",
+            index=models.Index(
+                fields=["author", "is_deleted", "name"],
+                name="libapp_seri_author__563aa9_idx",
+            ),
+        ),
+    ]
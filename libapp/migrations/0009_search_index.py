@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("libapp", "0008_keyset_name_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchIndex",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("term", models.CharField(max_length=64)),
+                (
+                    "kind",
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, "Автор"), (1, "Серия"), (2, "Книга")]
+                    ),
+                ),
+                ("object_id", models.BigIntegerField()),
+                ("weight", models.PositiveIntegerField(default=1)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["term", "kind", "object_id"],
+                        name="libapp_sear_term_432b8f_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("kind", "object_id", "term"),
+                        name="libapp_searchindex_unique_term",
+                    )
+                ],
+            },
+        ),
+    ]
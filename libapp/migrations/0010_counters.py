@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:04
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def aggregate(queryset, group_field, expression):
+    return Coalesce(
+        Subquery(
+            queryset.order_by()
+            .values(group_field)
+            .annotate(value=expression)
+            .values("value")[:1]
+        ),
+        Value(0),
+    )
+
+
+def book_aggregates(books, group_field):
+    return {
+        "book_count": aggregate(books, group_field, Count("pk")),
+        "rating_sum": aggregate(books, group_field, Sum("rating")),
+        "completed_count": aggregate(
+            books, group_field, Count("pk", filter=Q(is_completed=True))
+        ),
+    }
+
+
+def fill_counters(apps, schema_editor):
+    Author = apps.get_model("libapp", "Author")
+    SeriesBook = apps.get_model("libapp", "SeriesBook")
+    Book = apps.get_model("libapp", "Book")
+    SeriesBook.objects.filter(is_deleted=False).update(
+        **book_aggregates(
+            Book.objects.filter(series=OuterRef("pk"), is_deleted=False), "series"
+        )
+    )
+    Author.objects.filter(is_deleted=False).update(
+        series_count=aggregate(
+            SeriesBook.objects.filter(author=OuterRef("pk"), is_deleted=False),
+            "author",
+            Count("pk"),
+        ),
+        **book_aggregates(
+            Book.objects.filter(
+                series__author=OuterRef("pk"),
+                series__is_deleted=False,
+                is_deleted=False,
+            ),
+            "series__author",
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("libapp", "0009_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="author",
+            name="book_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="author",
+            name="completed_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="author",
+            name="rating_sum",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="author",
+            name="series_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="seriesbook",
+            name="book_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="seriesbook",
+            name="completed_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="seriesbook",
+            name="rating_sum",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("libapp", "0012_reading_stats"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["series", "is_deleted", "rating"],
+                name="libapp_book_series__fd042e_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["series", "is_deleted", "created_at"],
+                name="libapp_book_series__29086b_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["series", "is_deleted", "is_completed", "name"],
+                name="libapp_book_series__b4e02d_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["series", "is_deleted", "is_completed", "rating"],
+                name="libapp_book_series__ccd026_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["series", "is_deleted", "is_completed", "created_at"],
+                name="libapp_book_series__458d3c_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="seriesbook",
+            index=models.Index(
+                fields=["author", "is_deleted", "rating"],
+                name="libapp_seri_author__8fb7ee_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="seriesbook",
+            index=models.Index(
+                fields=["author", "is_deleted", "created_at"],
+                name="libapp_seri_author__e863ff_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="seriesbook",
+            index=models.Index(
+                fields=["author", "is_deleted", "is_completed", "name"],
+                name="libapp_seri_author__b7f6d3_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="seriesbook",
+            index=models.Index(
+                fields=["author", "is_deleted", "is_completed", "rating"],
+                name="libapp_seri_author__71b7bc_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="seriesbook",
+            index=models.Index(
+                fields=["author", "is_deleted", "is_completed", "created_at"],
+                name="libapp_seri_author__56ad66_idx",
+            ),
+        ),
+    ]
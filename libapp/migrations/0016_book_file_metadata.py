@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("libapp", "0015_book_files"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bookfile",
+            name="metadata",
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="bookfile",
+            name="metadata_state",
+            field=models.PositiveSmallIntegerField(
+                choices=[
+                    (0, "Не читаются"),
+                    (1, "Ожидают чтения"),
+                    (2, "Прочитаны"),
+                    (3, "Ошибка"),
+                ],
+                default=0,
+                editable=False,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="bookfile",
+            name="book",
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.CASCADE, to="libapp.book"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookfile",
+            index=models.Index(
+                fields=["user", "metadata_state"], name="libapp_bookfile_state_idx"
+            ),
+        ),
+    ]
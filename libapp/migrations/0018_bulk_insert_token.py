@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("libapp", "0017_jobs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="author",
+            name="insert_token",
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="insert_token",
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="seriesbook",
+            name="insert_token",
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("libapp", "0018_bulk_insert_token"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="storageusage",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.utils import timezone
+
+from .object_cache import ObjectCache
+from .signals import soft_deleted, soft_deleting
 
 
 class UndeletedManager(models.Manager):
@@ -13,23 +17,99 @@ class DeletedManager(models.Manager):
         return super().get_queryset().filter(is_deleted=True)
 
 
-class Author(models.Model):
+class CounterFieldsMixin:
+    """
+    Счётчики обновляются только через F()-выражения в libapp.counters,
+    поэтому обычный save() существующей строки их не перезаписывает.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                f.name
+                for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def average_rating(self):
+        if not self.book_count:
+            return 0
+        return round(self.rating_sum / self.book_count, 1)
+
+    @property
+    def completed_percent(self):
+        if not self.book_count:
+            return 0
+        return round(100 * self.completed_count / self.book_count)
+
+
+class Author(CounterFieldsMixin, models.Model):
     user = models.ForeignKey(
         get_user_model(), on_delete=models.SET_NULL, null=True, default=None
     )
     name = models.CharField(max_length=100, blank=False)
     is_deleted = models.BooleanField(default=False)
     # series = models.ManyToManyField('SeriesBook', blank=True, null=True)
+    series_count = models.IntegerField(default=0, editable=False)
+    book_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.IntegerField(default=0, editable=False)
+    completed_count = models.IntegerField(default=0, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Метка многострочного INSERT, по которой bulk_insert находит созданные
+    # строки там, где база не возвращает pk (MySQL).
+    insert_token = models.UUIDField(null=True, blank=True, editable=False)
+
+    counter_fields = ("series_count", "book_count", "rating_sum", "completed_count")
 
     objects = models.Manager()
     undeleted = UndeletedManager()
     deleted = DeletedManager()
+    cached = ObjectCache()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "is_deleted"]),
+            models.Index(fields=["is_deleted", "name"]),
+            models.Index(fields=["updated_at"]),
+        ]
 
     def get_absolute_url(self):
         return reverse("author", kwargs={"author_id": self.pk})
 
+    def soft_delete(self):
+        """
+        Помечает удалёнными автора, все его серии и книги.
+
+        Выполняется фиксированным числом UPDATE в одной транзакции,
+        независимо от количества серий и книг. Возвращает число
+        затронутых строк по каждому уровню.
+        """
+        series = SeriesBook.objects.filter(author=self).values("pk")
+        now = timezone.now()
+        with transaction.atomic():
+            soft_deleting.send(sender=Author, instance=self)
+            deleted = {
+                "book": Book.undeleted.filter(series__in=series).update(
+                    is_deleted=True, updated_at=now
+                ),
+                "series_book": SeriesBook.undeleted.filter(author=self).update(
+                    is_deleted=True, updated_at=now
+                ),
+                "author": Author.undeleted.filter(pk=self.pk).update(
+                    is_deleted=True, updated_at=now
+                ),
+            }
+            soft_deleted.send(sender=Author, instance=self, deleted=deleted)
+        self.is_deleted = True
+        return deleted
+
 
-class SeriesBook(models.Model):
+class SeriesBook(CounterFieldsMixin, models.Model):
     class Status(models.IntegerChoices):
         UNCOMPLETE = 0, "Не завершено"
         COMPLETE = 1, "Завершено"
@@ -44,15 +124,62 @@ class SeriesBook(models.Model):
     is_completed = models.BooleanField(choices=Status.choices, blank=False)
     description = models.TextField(blank=True, null=True)
     # books = models.ManyToManyField('Book', null=True, blank=True)
+    # sha256 файла обложки (libapp.covers), пусто - без обложки.
+    cover = models.CharField(max_length=64, blank=True, default="", editable=False)
+    book_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.IntegerField(default=0, editable=False)
+    completed_count = models.IntegerField(default=0, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Метка многострочного INSERT, по которой bulk_insert находит созданные
+    # строки там, где база не возвращает pk (MySQL).
+    insert_token = models.UUIDField(null=True, blank=True, editable=False)
+
+    counter_fields = ("book_count", "rating_sum", "completed_count")
+
     objects = models.Manager()
     undeleted = UndeletedManager()
     deleted = DeletedManager()
+    cached = ObjectCache()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["author", "is_deleted", "name"]),
+            models.Index(fields=["user", "is_deleted"]),
+            # Сортировки и фильтры списка серий автора (libapp.utils.ListOptions).
+            models.Index(fields=["author", "is_deleted", "rating"]),
+            models.Index(fields=["author", "is_deleted", "created_at"]),
+            models.Index(fields=["author", "is_deleted", "is_completed", "name"]),
+            models.Index(fields=["author", "is_deleted", "is_completed", "rating"]),
+            models.Index(fields=["author", "is_deleted", "is_completed", "created_at"]),
+        ]
 
     def get_absolute_url(self):
         return reverse(
             "series_book", kwargs={"author_id": self.author.id, "series_id": self.pk}
         )
 
+    def soft_delete(self):
+        """
+        Помечает удалёнными серию и все её книги двумя UPDATE
+        в одной транзакции. Возвращает число затронутых строк.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            soft_deleting.send(sender=SeriesBook, instance=self)
+            deleted = {
+                "author": 0,
+                "book": Book.undeleted.filter(series=self).update(
+                    is_deleted=True, updated_at=now
+                ),
+                "series_book": SeriesBook.undeleted.filter(pk=self.pk).update(
+                    is_deleted=True, updated_at=now
+                ),
+            }
+            soft_deleted.send(sender=SeriesBook, instance=self, deleted=deleted)
+        self.is_deleted = True
+        return deleted
+
 
 class Book(models.Model):
     class Status(models.IntegerChoices):
@@ -68,11 +195,29 @@ class Book(models.Model):
     rating = models.IntegerField(blank=True, default=0)
     is_completed = models.BooleanField(choices=Status.choices, blank=False)
     description = models.TextField(blank=True, null=True)
-    # photo =
+    cover = models.CharField(max_length=64, blank=True, default="", editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Метка многострочного INSERT, по которой bulk_insert находит созданные
+    # строки там, где база не возвращает pk (MySQL).
+    insert_token = models.UUIDField(null=True, blank=True, editable=False)
 
     objects = models.Manager()
     undeleted = UndeletedManager()
     deleted = DeletedManager()
+    cached = ObjectCache()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["series", "is_deleted", "name"]),
+            models.Index(fields=["user", "is_deleted"]),
+            # Сортировки и фильтры списка книг серии (libapp.utils.ListOptions).
+            models.Index(fields=["series", "is_deleted", "rating"]),
+            models.Index(fields=["series", "is_deleted", "created_at"]),
+            models.Index(fields=["series", "is_deleted", "is_completed", "name"]),
+            models.Index(fields=["series", "is_deleted", "is_completed", "rating"]),
+            models.Index(fields=["series", "is_deleted", "is_completed", "created_at"]),
+        ]
 
     def get_absolute_url(self):
         return reverse(
@@ -83,3 +228,159 @@ class Book(models.Model):
                 "book_id": self.pk,
             },
         )
+
+    def soft_delete(self):
+        """Помечает книгу удалённой. Возвращает число затронутых строк."""
+        with transaction.atomic():
+            deleted = {
+                "author": 0,
+                "series_book": 0,
+                "book": Book.undeleted.filter(pk=self.pk).update(
+                    is_deleted=True, updated_at=timezone.now()
+                ),
+            }
+            soft_deleted.send(sender=Book, instance=self, deleted=deleted)
+        self.is_deleted = True
+        return deleted
+
+
+class BookFile(models.Model):
+    """
+    Файл книги (EPUB, FB2, PDF). Содержимое лежит в LIBAPP_ATTACHMENT_ROOT
+    по sha256 (libapp.attachments); одинаковые файлы хранятся один раз.
+    Файл без книги ждёт чтения метаданных, по ним книга будет создана
+    (libapp.metadata).
+    """
+
+    class Format(models.TextChoices):
+        EPUB = "epub", "EPUB"
+        FB2 = "fb2", "FB2"
+        PDF = "pdf", "PDF"
+
+    class MetadataState(models.IntegerChoices):
+        NONE = 0, "Не читаются"
+        PENDING = 1, "Ожидают чтения"
+        DONE = 2, "Прочитаны"
+        FAILED = 3, "Ошибка"
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, null=True)
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    format = models.CharField(max_length=8, choices=Format.choices)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64, db_index=True)
+    metadata_state = models.PositiveSmallIntegerField(
+        choices=MetadataState.choices, default=MetadataState.NONE, editable=False
+    )
+    # Прочитанные метаданные (libapp.ebook_metadata) или {"error": ...}.
+    metadata = models.JSONField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "metadata_state"], name="libapp_bookfile_state_idx"
+            ),
+        ]
+
+
+class Job(models.Model):
+    """
+    Фоновая задача (libapp.jobs). Обработчики run_workers забирают задачи
+    с блокировкой строк и арендой до locked_until: задачу упавшего
+    обработчика после окончания аренды заберёт другой.
+    """
+
+    class State(models.IntegerChoices):
+        QUEUED = 0, "В очереди"
+        RUNNING = 1, "Выполняется"
+        DONE = 2, "Готово"
+        FAILED = 3, "Ошибка"
+
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, null=True)
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    state = models.PositiveSmallIntegerField(
+        choices=State.choices, default=State.QUEUED
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    # Когда задачу можно забрать: время постановки или следующей попытки.
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default="")
+    locked_until = models.DateTimeField(null=True, blank=True)
+    # Результат или промежуточный прогресс задачи.
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["state", "run_at"], name="libapp_job_claim_idx"),
+            models.Index(fields=["user", "-created_at"], name="libapp_job_user_idx"),
+        ]
+
+
+class StorageUsage(models.Model):
+    """
+    Занятое файлами книг место по пользователям, чтобы проверять квоту без
+    обхода файлов и без SUM по всем файлам пользователя. updated_at входит
+    в Last-Modified страницы книги, где показано занятое место.
+    """
+
+    user = models.OneToOneField(
+        get_user_model(), on_delete=models.CASCADE, primary_key=True
+    )
+    bytes_used = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class SearchIndex(models.Model):
+    class Kind(models.IntegerChoices):
+        AUTHOR = 0, "Автор"
+        SERIES_BOOK = 1, "Серия"
+        BOOK = 2, "Книга"
+
+    term = models.CharField(max_length=64)
+    kind = models.PositiveSmallIntegerField(choices=Kind.choices)
+    object_id = models.BigIntegerField()
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["term", "kind", "object_id"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "object_id", "term"],
+                name="libapp_searchindex_unique_term",
+            ),
+        ]
+
+
+class ReadingStat(models.Model):
+    """
+    Сводка по книгам пользователя для главной страницы: число книг в каждой
+    корзине (kind, bucket). Обновляется приращениями из libapp.stats при
+    изменении книг и серий; rebuild_reading_stats перестраивает её целиком.
+    """
+
+    class Kind(models.IntegerChoices):
+        RATING = 0, "Оценка"
+        STATUS = 1, "Статус"
+        MONTH = 2, "Месяц добавления"
+
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    kind = models.PositiveSmallIntegerField(choices=Kind.choices)
+    # Оценка, is_completed (0/1) или год * 100 + месяц.
+    bucket = models.IntegerField()
+    book_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "kind", "bucket"],
+                name="libapp_readingstat_unique_bucket",
+            ),
+        ]
@@ -0,0 +1,169 @@
+import copy
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from library.replicas import reading_replica
+
+KEY_PREFIX = "libapp:object"
+
+# Все кэши объектов по имени модели, для stats() и clear().
+registry = {}
+
+
+def get_cache():
+    return caches[getattr(settings, "LIBAPP_OBJECT_CACHE", "default")]
+
+
+def detach(obj):
+    """
+    Копия объекта без загруженных связей: в кэш кладётся только сама строка,
+    иначе вместе с книгой сохранились бы копии её серии и автора, которые
+    не сбрасываются при их изменении.
+    """
+    obj = copy.copy(obj)
+    obj._state = copy.copy(obj._state)
+    obj._state.fields_cache = {}
+    return obj
+
+
+class ObjectCache:
+    """
+    Сквозной кэш строк модели по pk: Author.cached.get(pk). Размер и время
+    жизни задаются кэшем LIBAPP_OBJECT_CACHE в CACHES. Записи сбрасываются
+    по pk при сохранении, мягком удалении, массовых изменениях и изменении
+    счётчиков (см. libapp.receivers и libapp.counters). Отсутствующие в базе
+    pk и строки, прочитанные с реплики, не кэшируются.
+    """
+
+    def contribute_to_class(self, model, name):
+        self.model = model
+        self.label = model._meta.label_lower
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        registry[self.label] = self
+        setattr(model, name, self)
+
+    def key(self, pk):
+        return "%s:%s:%s" % (KEY_PREFIX, self.label, pk)
+
+    def count(self, hits, misses):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def get(self, pk):
+        return self.get_many([pk]).get(int(pk))
+
+    def get_many(self, pks):
+        """Словарь {pk: объект}; промахи загружаются одним запросом."""
+        found = self.peek_many(pks)
+        missing = {int(pk) for pk in pks} - found.keys()
+        if missing:
+            loaded = list(self.model.objects.filter(pk__in=missing))
+            self.set_many(loaded)
+            found.update((obj.pk, obj) for obj in loaded)
+        return found
+
+    async def aget(self, pk):
+        return (await self.aget_many([pk])).get(int(pk))
+
+    async def aget_many(self, pks):
+        found = await self.apeek_many(pks)
+        missing = {int(pk) for pk in pks} - found.keys()
+        if missing:
+            loaded = [obj async for obj in self.model.objects.filter(pk__in=missing)]
+            await self.aset_many(loaded)
+            found.update((obj.pk, obj) for obj in loaded)
+        return found
+
+    def peek_many(self, pks):
+        """Только то, что уже есть в кэше, без обращения к базе."""
+        pks = [int(pk) for pk in pks]
+        objects = peek([(self.model, pk) for pk in pks])
+        return {pk: obj for pk, obj in zip(pks, objects) if obj is not None}
+
+    async def apeek_many(self, pks):
+        pks = [int(pk) for pk in pks]
+        objects = await apeek([(self.model, pk) for pk in pks])
+        return {pk: obj for pk, obj in zip(pks, objects) if obj is not None}
+
+    def set_many(self, objects):
+        store(objects)
+
+    async def aset_many(self, objects):
+        await astore(objects)
+
+    def invalidate(self, pks):
+        """
+        Сбрасывает записи сразу и ещё раз после фиксации транзакции: иначе
+        параллельный запрос мог бы успеть закэшировать строку, прочитанную
+        до фиксации.
+        """
+        keys = [self.key(pk) for pk in pks if pk is not None]
+        if not keys:
+            return
+        get_cache().delete_many(keys)
+        transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+
+def peek(pairs):
+    """
+    [(модель, pk)] -> [объект или None] одним обращением к кэшу, например
+    для всей цепочки автор -> серия -> книга сразу.
+    """
+    keys = [model.cached.key(pk) for model, pk in pairs]
+    found = get_cache().get_many(keys)
+    count(pairs, keys, found)
+    return [found.get(key) for key in keys]
+
+
+async def apeek(pairs):
+    keys = [model.cached.key(pk) for model, pk in pairs]
+    found = await get_cache().aget_many(keys)
+    count(pairs, keys, found)
+    return [found.get(key) for key in keys]
+
+
+def count(pairs, keys, found):
+    for (model, pk), key in zip(pairs, keys):
+        hit = key in found
+        model.cached.count(int(hit), int(not hit))
+
+
+def store(objects):
+    if reading_replica():
+        return
+    get_cache().set_many({type(obj).cached.key(obj.pk): detach(obj) for obj in objects})
+
+
+async def astore(objects):
+    if reading_replica():
+        return
+    await get_cache().aset_many(
+        {type(obj).cached.key(obj.pk): detach(obj) for obj in objects}
+    )
+
+
+def stats():
+    """Попадания и промахи по моделям с начала работы процесса."""
+    return {label: cache.stats() for label, cache in registry.items()}
+
+
+def clear():
+    """Очищает кэш объектов и обнуляет счётчики попаданий."""
+    get_cache().clear()
+    for cache in registry.values():
+        with cache.lock:
+            cache.hits = cache.misses = 0
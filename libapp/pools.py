@@ -0,0 +1,21 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(name, max_workers):
+    """
+    Пул процессов name создаётся при первом обращении. Процессы запускаются
+    через spawn, а не fork: копия процесса с потоками и открытыми
+    соединениями к базе не нужна, задачам передаются только пути.
+    """
+    with _lock:
+        if name not in _executors:
+            _executors[name] = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executors[name]
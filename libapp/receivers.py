@@ -0,0 +1,257 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from library import sqlite
+
+from . import attachments, cache_versions, counters, stats
+from .models import Author, SeriesBook, Book, BookFile, SearchIndex
+from .search import KINDS, index_objects, unindex
+from .signals import bulk_created, bulk_updated, soft_deleted, soft_deleting
+
+connection_created.connect(sqlite.configure_connection)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=SeriesBook)
+@receiver(post_save, sender=Book)
+def update_search_index(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    index_objects([instance], replace=not created)
+
+
+@receiver(soft_deleted, sender=Author)
+def unindex_author(sender, instance, **kwargs):
+    unindex(SearchIndex.Kind.AUTHOR, [instance.pk])
+    unindex(
+        SearchIndex.Kind.SERIES_BOOK,
+        SeriesBook.objects.filter(author=instance).values("pk"),
+    )
+    unindex(
+        SearchIndex.Kind.BOOK,
+        Book.objects.filter(series__author=instance).values("pk"),
+    )
+
+
+@receiver(soft_deleted, sender=SeriesBook)
+def unindex_series_book(sender, instance, **kwargs):
+    unindex(SearchIndex.Kind.SERIES_BOOK, [instance.pk])
+    unindex(SearchIndex.Kind.BOOK, Book.objects.filter(series=instance).values("pk"))
+
+
+@receiver(soft_deleted, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    unindex(SearchIndex.Kind.BOOK, [instance.pk])
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=SeriesBook)
+@receiver(post_delete, sender=Book)
+def unindex_hard_deleted(sender, instance, **kwargs):
+    # Каскад удаления присылает сигнал для каждой серии и книги автора.
+    unindex(KINDS[sender], [instance.pk])
+
+
+@receiver(post_init, sender=SeriesBook)
+@receiver(post_init, sender=Book)
+def snapshot_counters(sender, instance, **kwargs):
+    counters.snapshot(instance)
+
+
+@receiver(post_save, sender=Book)
+def update_book_counters(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        counters.book_saved(instance, created)
+
+
+@receiver(post_save, sender=SeriesBook)
+def update_series_book_counters(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        counters.series_saved(instance, created)
+
+
+@receiver(soft_deleted, sender=SeriesBook)
+def subtract_series_book_counters(sender, instance, deleted, **kwargs):
+    if deleted["series_book"]:
+        counters.series_soft_deleted(instance)
+
+
+@receiver(soft_deleted, sender=Book)
+def subtract_book_counters(sender, instance, deleted, **kwargs):
+    if deleted["book"]:
+        counters.book_soft_deleted(instance)
+
+
+@receiver(soft_deleting, sender=Author)
+def subtract_author_reading_stats(sender, instance, **kwargs):
+    stats.subtract_books(Book.objects.filter(series__author=instance))
+
+
+@receiver(soft_deleting, sender=SeriesBook)
+def subtract_series_book_reading_stats(sender, instance, **kwargs):
+    stats.subtract_books(Book.objects.filter(series=instance))
+
+
+@receiver(bulk_created, sender=Author)
+@receiver(bulk_created, sender=SeriesBook)
+@receiver(bulk_created, sender=Book)
+def index_bulk_created(sender, objects, **kwargs):
+    index_objects(objects, replace=False)
+
+
+@receiver(bulk_updated, sender=Author)
+@receiver(bulk_updated, sender=SeriesBook)
+@receiver(bulk_updated, sender=Book)
+def index_bulk_updated(sender, objects, **kwargs):
+    index_objects(objects)
+
+
+@receiver(bulk_created, sender=SeriesBook)
+def count_bulk_created_series(sender, objects, **kwargs):
+    counters.add_series(objects)
+
+
+@receiver(bulk_created, sender=Book)
+def count_bulk_created_books(sender, objects, **kwargs):
+    counters.add_books(objects)
+
+
+@receiver(bulk_updated, sender=SeriesBook)
+def count_bulk_updated_series(sender, objects, **kwargs):
+    counters.touch_authors(objects)
+
+
+@receiver(bulk_updated, sender=Book)
+def count_bulk_updated_books(sender, objects, **kwargs):
+    counters.update_books(objects)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=SeriesBook)
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=SeriesBook)
+@receiver(post_delete, sender=Book)
+def invalidate_cached_object(sender, instance, **kwargs):
+    sender.cached.invalidate([instance.pk])
+
+
+@receiver(soft_deleted, sender=Author)
+def invalidate_soft_deleted_author(sender, instance, **kwargs):
+    # Каскад помечает удалёнными и серии с книгами автора.
+    Author.cached.invalidate([instance.pk])
+    SeriesBook.cached.invalidate(
+        SeriesBook.objects.filter(author=instance).values_list("pk", flat=True)
+    )
+    Book.cached.invalidate(
+        Book.objects.filter(series__author=instance).values_list("pk", flat=True)
+    )
+
+
+@receiver(soft_deleted, sender=SeriesBook)
+def invalidate_soft_deleted_series_book(sender, instance, **kwargs):
+    SeriesBook.cached.invalidate([instance.pk])
+    Book.cached.invalidate(
+        Book.objects.filter(series=instance).values_list("pk", flat=True)
+    )
+
+
+@receiver(soft_deleted, sender=Book)
+def invalidate_soft_deleted_book(sender, instance, **kwargs):
+    Book.cached.invalidate([instance.pk])
+
+
+@receiver(bulk_updated, sender=Author)
+@receiver(bulk_updated, sender=SeriesBook)
+@receiver(bulk_updated, sender=Book)
+def invalidate_bulk_updated_objects(sender, objects, **kwargs):
+    sender.cached.invalidate([obj.pk for obj in objects])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def bump_author_version(sender, instance, **kwargs):
+    cache_versions.author_changed(instance.pk)
+
+
+@receiver(post_save, sender=SeriesBook)
+@receiver(post_delete, sender=SeriesBook)
+def bump_series_book_version(sender, instance, **kwargs):
+    cache_versions.series_changed(instance.author_id, instance.pk)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def bump_book_version(sender, instance, **kwargs):
+    cache_versions.books_changed([instance.series_id])
+
+
+@receiver(soft_deleted, sender=Author)
+def bump_soft_deleted_author_version(sender, instance, **kwargs):
+    # Страницы серий удалённого автора отдают 404 до обращения к кэшу.
+    cache_versions.author_changed(instance.pk)
+
+
+@receiver(soft_deleted, sender=SeriesBook)
+def bump_soft_deleted_series_book_version(sender, instance, **kwargs):
+    cache_versions.series_changed(instance.author_id, instance.pk)
+
+
+@receiver(soft_deleted, sender=Book)
+def bump_soft_deleted_book_version(sender, instance, **kwargs):
+    cache_versions.books_changed([instance.series_id])
+
+
+@receiver(bulk_created, sender=Author)
+def bump_bulk_created_author_version(sender, objects, **kwargs):
+    cache_versions.bump(("authors", None))
+
+
+@receiver(bulk_created, sender=SeriesBook)
+def bump_bulk_created_series_book_version(sender, objects, **kwargs):
+    cache_versions.bump(
+        ("authors", None), *{("author", series.author_id) for series in objects}
+    )
+
+
+@receiver(bulk_created, sender=Book)
+def bump_bulk_created_book_version(sender, objects, **kwargs):
+    cache_versions.books_changed([book.series_id for book in objects])
+
+
+@receiver(bulk_updated, sender=Author)
+def bump_bulk_updated_author_version(sender, objects, **kwargs):
+    cache_versions.bump(("authors", None), *{("author", a.pk) for a in objects})
+
+
+@receiver(bulk_updated, sender=SeriesBook)
+def bump_bulk_updated_series_book_version(sender, objects, **kwargs):
+    cache_versions.bump(
+        ("authors", None),
+        *{("author", series.author_id) for series in objects},
+        *{("series", series.pk) for series in objects},
+    )
+
+
+@receiver(bulk_updated, sender=Book)
+def bump_bulk_updated_book_version(sender, objects, **kwargs):
+    cache_versions.books_changed([book.series_id for book in objects])
+
+
+@receiver(post_save, sender=BookFile)
+@receiver(post_delete, sender=BookFile)
+def touch_book_for_file(sender, instance, **kwargs):
+    # Список файлов - часть страницы книги, её Last-Modified берётся из книги.
+    if instance.book_id is None:
+        return
+    Book.objects.filter(pk=instance.book_id).update(updated_at=timezone.now())
+    Book.cached.invalidate([instance.book_id])
+
+
+@receiver(post_delete, sender=BookFile)
+def release_book_file(sender, instance, **kwargs):
+    attachments.release(instance.user_id, instance.size)
+    transaction.on_commit(lambda: attachments.remove_unreferenced(instance.sha256))
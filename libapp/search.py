@@ -0,0 +1,209 @@
+import re
+from collections import Counter
+
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+
+from .models import Author, SeriesBook, Book, SearchIndex
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+CYRILLIC_RE = re.compile(r"^[а-я]+$")
+TERM_MAX_LENGTH = SearchIndex._meta.get_field("term").max_length
+MODELS = {
+    SearchIndex.Kind.AUTHOR: Author,
+    SearchIndex.Kind.SERIES_BOOK: SeriesBook,
+    SearchIndex.Kind.BOOK: Book,
+}
+KINDS = {model: kind for kind, model in MODELS.items()}
+
+STOP_WORDS = frozenset("""
+    а без более бы был была были было быть в вам вас весь во вот все всего
+    всех вы где да даже для до его ее ей ему если есть еще же за здесь и из
+    или им их к как ко когда кто ли либо мне может мы на над надо наш не него
+    нее нет ни них но ну о об однако он она они оно от очень по под при про с
+    со так также такой там те тем то того тоже той только том ты у уже хотя
+    чего чей чем что чтобы чье чья эта эти это я
+    """.split())
+
+# Облегчённый вариант стеммера Snowball (Портера) для русского языка.
+VOWELS_RE = re.compile(r"^(.*?[аеиоуыэюя])(.*)$")
+PERFECTIVE_GERUND_RE = re.compile(
+    r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$"
+)
+REFLEXIVE_RE = re.compile(r"(с[яь])$")
+ADJECTIVE_RE = re.compile(
+    r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю"
+    r"|ая|яя|ою|ею)$"
+)
+PARTICIPLE_RE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+VERB_RE = re.compile(
+    r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят"
+    r"|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем"
+    r"|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+NOUN_RE = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом"
+    r"|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+DERIVATIONAL_RE = re.compile(r"ость?$")
+SUPERLATIVE_RE = re.compile(r"(ейше|ейш)$")
+
+
+def stem(word):
+    match = VOWELS_RE.match(word)
+    if not match or not match.group(2):
+        return word
+    start, rv = match.groups()
+    temp = PERFECTIVE_GERUND_RE.sub("", rv, 1)
+    if temp == rv:
+        rv = REFLEXIVE_RE.sub("", rv, 1)
+        temp = ADJECTIVE_RE.sub("", rv, 1)
+        if temp != rv:
+            rv = PARTICIPLE_RE.sub("", temp, 1)
+        else:
+            temp = VERB_RE.sub("", rv, 1)
+            rv = NOUN_RE.sub("", rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+    if rv.endswith("и"):
+        rv = rv[:-1]
+    rv = DERIVATIONAL_RE.sub("", rv, 1)
+    if rv.endswith("ь"):
+        rv = rv[:-1]
+    else:
+        rv = SUPERLATIVE_RE.sub("", rv, 1)
+        if rv.endswith("нн"):
+            rv = rv[:-1]
+    return start + rv
+
+
+def normalize(text):
+    """
+    Разбивает текст на нормализованные термины: нижний регистр, "ё" -> "е",
+    без стоп-слов, русские слова приводятся к основе.
+    """
+    terms = []
+    for word in WORD_RE.findall((text or "").lower().replace("ё", "е")):
+        if word in STOP_WORDS or len(word) < 2:
+            continue
+        if CYRILLIC_RE.match(word):
+            word = stem(word)
+        terms.append(word[:TERM_MAX_LENGTH])
+    return terms
+
+
+def weighted_terms(*parts):
+    """parts - пары (текст, вес). Возвращает {термин: суммарный вес}."""
+    weights = Counter()
+    for text, weight in parts:
+        for term in normalize(text):
+            weights[term] += weight
+    return weights
+
+
+def document_terms(obj):
+    if isinstance(obj, Author):
+        return SearchIndex.Kind.AUTHOR, weighted_terms((obj.name, 3))
+    if isinstance(obj, SeriesBook):
+        kind = SearchIndex.Kind.SERIES_BOOK
+    else:
+        kind = SearchIndex.Kind.BOOK
+    return kind, weighted_terms((obj.name, 3), (obj.description, 1))
+
+
+def index_objects(objects, replace=True):
+    """
+    Перестраивает записи индекса для объектов одной модели: удаляет старые
+    термины и вставляет новые одним bulk_create. Удалённые объекты только
+    убираются из индекса. Для только что созданных объектов replace=False
+    пропускает удаление.
+    """
+    objects = list(objects)
+    if not objects:
+        return
+    rows = []
+    kind = None
+    for obj in objects:
+        kind, terms = document_terms(obj)
+        if obj.is_deleted:
+            continue
+        rows.extend(
+            SearchIndex(term=term, kind=kind, object_id=obj.pk, weight=weight)
+            for term, weight in terms.items()
+        )
+    if replace:
+        SearchIndex.objects.filter(
+            kind=kind, object_id__in=[obj.pk for obj in objects]
+        ).delete()
+    SearchIndex.objects.bulk_create(rows)
+
+
+def unindex(kind, object_ids):
+    """object_ids - список или подзапрос .values("pk")."""
+    return SearchIndex.objects.filter(kind=kind, object_id__in=object_ids).delete()
+
+
+def alive():
+    """
+    Строки индекса, чей объект есть в базе и не удалён. Индекс чистится
+    приёмниками сигналов, но строки, изменённые мимо них (update(),
+    удаление в обход моделей), остались бы в ранжировании и укорачивали
+    страницы после OFFSET/LIMIT.
+    """
+    condition = Q()
+    for kind, model in MODELS.items():
+        documents = model.undeleted.filter(pk=OuterRef("object_id"))
+        condition |= Q(Exists(documents), kind=kind)
+    return condition
+
+
+def search(query, page=1, page_size=20):
+    """
+    Ищет авторов, серии и книги по индексу. Результаты ранжируются по числу
+    совпавших терминов и их весу. Возвращает (список результатов, есть ли
+    следующая страница). Каждый результат - словарь с kind, object и score.
+    """
+    terms = list(dict.fromkeys(normalize(query)))
+    if not terms:
+        return [], False
+    condition = Q()
+    for term in terms:
+        condition |= Q(term__startswith=term)
+    offset = (page - 1) * page_size
+    ranked = list(
+        SearchIndex.objects.filter(condition)
+        .filter(alive())
+        .values("kind", "object_id")
+        .annotate(matched=Count("term", distinct=True), score=Sum("weight"))
+        .order_by("-matched", "-score", "kind", "object_id")[
+            offset : offset + page_size + 1
+        ]
+    )
+    has_next = len(ranked) > page_size
+    ranked = ranked[:page_size]
+
+    ids = {kind: [] for kind in SearchIndex.Kind.values}
+    for row in ranked:
+        ids[row["kind"]].append(row["object_id"])
+    objects = {}
+    querysets = {
+        SearchIndex.Kind.AUTHOR: Author.undeleted.all(),
+        SearchIndex.Kind.SERIES_BOOK: SeriesBook.undeleted.select_related("author"),
+        SearchIndex.Kind.BOOK: Book.undeleted.select_related("series"),
+    }
+    for kind, queryset in querysets.items():
+        if ids[kind]:
+            for obj in queryset.filter(pk__in=ids[kind]):
+                objects[kind, obj.pk] = obj
+
+    results = []
+    for row in ranked:
+        obj = objects.get((row["kind"], row["object_id"]))
+        if obj is not None:
+            results.append(
+                {
+                    "kind": SearchIndex.Kind(row["kind"]),
+                    "object": obj,
+                    "score": row["score"],
+                }
+            )
+    return results, has_next
@@ -0,0 +1,173 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from . import cache_versions
+from . import stats as summary
+from .bulk import bulk_insert
+from .models import Author, SeriesBook, Book
+from .search import index_objects
+
+FIRST_NAMES = (
+    "Александр Михаил Лев Фёдор Антон Иван Николай Борис Анна Марина Ольга "
+    "Владимир Сергей Татьяна Евгений Максим Константин Виктор Людмила Юрий"
+).split()
+LAST_NAMES = (
+    "Пушкин Лермонтов Толстой Достоевский Чехов Тургенев Гоголь Пастернак "
+    "Ахматова Цветаева Набоков Булгаков Бунин Куприн Горький Есенин Блок "
+    "Шолохов Платонов Зощенко Стругацкий Ефремов Беляев Лукьяненко"
+).split()
+WORDS = (
+    "война мир время дорога город ночь море звезда дом сад путь тайна "
+    "песня остров ветер память судьба огонь зима лето свет тень река "
+    "история хроника возвращение последний первый тихий далёкий белый "
+    "чёрный золотой старый новый долгий странный забытый"
+).split()
+
+
+def title(rng, words=3):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def spread(total, parts):
+    """Делит total на parts почти равных целых частей."""
+    base, extra = divmod(total, parts) if parts else (0, 0)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+def seed_library(
+    users=1,
+    authors=100,
+    series=1000,
+    books=10000,
+    chunk_size=100,
+    batch_size=2000,
+    index=True,
+    seed=0,
+    prefix="seed",
+    progress=None,
+):
+    """
+    Генерирует синтетическую библиотеку: users пользователей, между которыми
+    поровну распределены authors авторов, series серий и books книг.
+    Вставка идёт bulk_create порциями по chunk_size авторов, каждая порция
+    в своей транзакции. Счётчики авторов и серий считаются заранее, поэтому
+    сигналы не нужны; сводка статистики чтения перестраивается в конце.
+    Индекс поиска строится сразу (index=False - без него, тогда его можно
+    построить позже командой rebuild_search_index).
+    Возвращает статистику: число строк и время.
+    """
+    rng = random.Random(seed)
+    started = time.monotonic()
+    stats = {"users": 0, "authors": 0, "series": 0, "books": 0, "seconds": 0.0}
+
+    password = make_password(prefix)
+    user_model = get_user_model()
+    with transaction.atomic():
+        created_users = bulk_insert(
+            user_model,
+            (
+                user_model(username="%s%d" % (prefix, i), password=password)
+                for i in range(users)
+            ),
+            username__startswith=prefix,
+        )
+    stats["users"] = len(created_users)
+
+    series_per_author = spread(series, authors)
+    books_per_series = spread(books, series)
+    series_offset = 0
+    for start in range(0, authors, chunk_size):
+        chunk = range(start, min(start + chunk_size, authors))
+        plan = []
+        for i in chunk:
+            count = series_per_author[i]
+            author_series = []
+            for j in range(series_offset, series_offset + count):
+                author_series.append(
+                    [
+                        (title(rng), rng.randint(0, 10), rng.random() < 0.5)
+                        for _ in range(books_per_series[j])
+                    ]
+                )
+            series_offset += count
+            plan.append((created_users[i % len(created_users)], author_series))
+        with transaction.atomic():
+            seed_chunk(rng, plan, batch_size, index)
+        stats["authors"] += len(plan)
+        stats["series"] += sum(len(s) for _, s in plan)
+        stats["books"] += sum(len(b) for _, s in plan for b in s)
+        stats["seconds"] = time.monotonic() - started
+        if progress:
+            progress(stats)
+
+    summary.rebuild(user.pk for user in created_users)
+    cache_versions.bump(("authors", None))
+    return stats
+
+
+def book_totals(books):
+    return {
+        "book_count": len(books),
+        "rating_sum": sum(rating for _, rating, _ in books),
+        "completed_count": sum(1 for _, _, completed in books if completed),
+    }
+
+
+def seed_chunk(rng, plan, batch_size, index):
+    authors = []
+    for user, author_series in plan:
+        totals = [book_totals(books) for books in author_series]
+        authors.append(
+            Author(
+                user=user,
+                name="%s %s" % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)),
+                series_count=len(author_series),
+                book_count=sum(t["book_count"] for t in totals),
+                rating_sum=sum(t["rating_sum"] for t in totals),
+                completed_count=sum(t["completed_count"] for t in totals),
+            )
+        )
+    users = {user.pk for user, _ in plan}
+    authors = bulk_insert(Author, authors, batch_size, user_id__in=users)
+
+    series = []
+    for author, (user, author_series) in zip(authors, plan):
+        for books in author_series:
+            series.append(
+                SeriesBook(
+                    user=user,
+                    author=author,
+                    name=title(rng, 2),
+                    description=title(rng, 8),
+                    rating=rng.randint(0, 10),
+                    is_completed=rng.random() < 0.5,
+                    **book_totals(books),
+                )
+            )
+    series = bulk_insert(
+        SeriesBook, series, batch_size, author_id__in=[a.pk for a in authors]
+    )
+
+    book_lists = [books for _, author_series in plan for books in author_series]
+    books = [
+        Book(
+            user_id=s.user_id,
+            series=s,
+            name=name,
+            rating=rating,
+            is_completed=completed,
+        )
+        for s, book_list in zip(series, book_lists)
+        for name, rating, completed in book_list
+    ]
+    if not index:
+        Book.objects.bulk_create(books, batch_size=batch_size)
+        return
+    books = bulk_insert(Book, books, batch_size, series_id__in=[s.pk for s in series])
+    for objects in (authors, series, books):
+        for i in range(0, len(objects), batch_size):
+            index_objects(objects[i : i + batch_size], replace=False)
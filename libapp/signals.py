@@ -0,0 +1,18 @@
+from django.dispatch import Signal
+
+
+# Отправляется внутри транзакции Author/SeriesBook.soft_delete() до массовых
+# UPDATE, пока дочерние строки ещё не помечены удалёнными. Аргумент: instance.
+soft_deleting = Signal()
+
+# Отправляется внутри транзакции Author/SeriesBook/Book.soft_delete()
+# после массовых UPDATE. Аргументы: instance, deleted (число строк по уровням).
+soft_deleted = Signal()
+
+# Отправляется после bulk_create, который не вызывает post_save.
+# Аргументы: objects (список созданных объектов с pk).
+bulk_created = Signal()
+
+# Отправляется после bulk_update, который тоже не вызывает post_save.
+# Аргументы: objects (список изменённых объектов).
+bulk_updated = Signal()
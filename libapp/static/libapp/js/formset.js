@@ -0,0 +1,26 @@
+// Кнопка "Добавить строку" формы нескольких книг: новая строка собирается
+// из <template> с пустой формой без запроса к серверу.
+document.querySelectorAll("form[data-formset]").forEach(function (form) {
+    var prefix = form.dataset.formset;
+    var total = form.querySelector("#id_" + prefix + "-TOTAL_FORMS");
+    var max = form.querySelector("#id_" + prefix + "-MAX_NUM_FORMS");
+    var rows = form.querySelector(".formset-rows");
+    var template = form.querySelector("template.formset-empty-row");
+    var button = form.querySelector(".formset-add");
+
+    function update() {
+        button.disabled = Number(total.value) >= Number(max.value);
+    }
+
+    button.addEventListener("click", function () {
+        var index = Number(total.value);
+        var html = template.innerHTML.replace(/__prefix__/g, index);
+        rows.insertAdjacentHTML("beforeend", html);
+        var row = rows.lastElementChild;
+        row.querySelector(".formset-number").textContent = index + 1;
+        total.value = index + 1;
+        update();
+        row.querySelector("input, textarea, select").focus();
+    });
+    update();
+});
@@ -0,0 +1,182 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from .models import Author, Book, ReadingStat
+
+Kind = ReadingStat.Kind
+RATINGS = range(0, 11)
+MONTHS = 12
+TOP_AUTHORS = 5
+
+
+def month_bucket(value):
+    value = timezone.localtime(value) if timezone.is_aware(value) else value
+    return value.year * 100 + value.month
+
+
+def book_buckets(book, counters):
+    """
+    Корзины сводки, в которые попадает книга с вкладом counters в счётчики
+    серии (см. libapp.counters.book_counters): {(kind, bucket): 1}.
+    """
+    if not counters["book_count"] or book.user_id is None:
+        return Counter()
+    return Counter(
+        {
+            (Kind.RATING, counters["rating_sum"]): 1,
+            (Kind.STATUS, counters["completed_count"]): 1,
+            (Kind.MONTH, month_bucket(book.created_at)): 1,
+        }
+    )
+
+
+def add(deltas, user_id, buckets, sign=1):
+    for key, value in buckets.items():
+        deltas[user_id][key] += sign * value
+
+
+def new_deltas():
+    return defaultdict(Counter)
+
+
+def apply(deltas):
+    """
+    Прибавляет deltas ({user_id: {(kind, bucket): delta}}) к сводке.
+    Недостающие строки создаются одним INSERT с игнорированием конфликтов,
+    затем по одному UPDATE на каждое различное значение delta - обычно это
+    +1 и -1, сколько бы корзин ни изменилось.
+    """
+    ensure = []
+    by_delta = defaultdict(Q)
+    for user_id, buckets in deltas.items():
+        for (kind, bucket), delta in buckets.items():
+            if not delta:
+                continue
+            if delta > 0:
+                ensure.append(ReadingStat(user_id=user_id, kind=kind, bucket=bucket))
+            by_delta[delta] |= Q(user_id=user_id, kind=kind, bucket=bucket)
+    if ensure:
+        ReadingStat.objects.bulk_create(ensure, ignore_conflicts=True)
+    for delta, condition in by_delta.items():
+        ReadingStat.objects.filter(condition).update(book_count=F("book_count") + delta)
+
+
+def subtract_books(books):
+    """
+    Вычитает из сводки книги, которые сейчас будут удалены каскадом: один
+    GROUP BY по книгам удаляемой серии или автора, а не по всей библиотеке.
+    """
+    deltas = new_deltas()
+    for user_id, buckets in actual_buckets(books).items():
+        add(deltas, user_id, buckets, -1)
+    apply(deltas)
+
+
+def actual_buckets(books):
+    """
+    Фактические корзины книг queryset: {user_id: {(kind, bucket): count}}.
+    Один GROUP BY по всем трём измерениям сразу; комбинаций немного.
+    """
+    rows = (
+        books.filter(is_deleted=False, series__isnull=False)
+        .order_by()
+        .values(
+            "user_id",
+            "rating",
+            "is_completed",
+            year=ExtractYear("created_at"),
+            month=ExtractMonth("created_at"),
+        )
+        .annotate(count=Count("pk"))
+    )
+    result = defaultdict(Counter)
+    for row in rows:
+        buckets = result[row["user_id"]]
+        buckets[Kind.RATING, row["rating"]] += row["count"]
+        buckets[Kind.STATUS, int(row["is_completed"])] += row["count"]
+        buckets[Kind.MONTH, row["year"] * 100 + row["month"]] += row["count"]
+    return result
+
+
+def rebuild(user_ids):
+    """Перестраивает сводку пользователей по фактическим данным."""
+    user_ids = list(user_ids)
+    with transaction.atomic():
+        ReadingStat.objects.filter(user_id__in=user_ids).delete()
+        buckets = actual_buckets(Book.objects.filter(user_id__in=user_ids))
+        ReadingStat.objects.bulk_create(
+            ReadingStat(user_id=user_id, kind=kind, bucket=bucket, book_count=count)
+            for user_id, counts in buckets.items()
+            for (kind, bucket), count in counts.items()
+        )
+
+
+def stat_rows(user):
+    return ReadingStat.objects.filter(user=user, book_count__gt=0).values_list(
+        "kind", "bucket", "book_count"
+    )
+
+
+def top_authors(user, limit=TOP_AUTHORS):
+    """Авторы с лучшей средней оценкой - по счётчикам, без обхода книг."""
+    return (
+        Author.undeleted.filter(user=user, book_count__gt=0)
+        .annotate(
+            average=ExpressionWrapper(
+                F("rating_sum") * 1.0 / F("book_count"), output_field=FloatField()
+            )
+        )
+        .order_by("-average", "-book_count", "name")[:limit]
+    )
+
+
+def last_months(count=MONTHS):
+    today = timezone.localdate()
+    year, month = today.year, today.month
+    months = []
+    for _ in range(count):
+        months.append(year * 100 + month)
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months[::-1]
+
+
+def bars(items):
+    """[(метка, число)] -> словари с долей от максимума для ширины столбца."""
+    peak = max((count for _, count in items), default=0) or 1
+    return [
+        {"label": label, "count": count, "percent": round(100 * count / peak)}
+        for label, count in items
+    ]
+
+
+def build_dashboard(rows, authors):
+    counts = {kind: Counter() for kind in Kind}
+    for kind, bucket, book_count in rows:
+        counts[kind][bucket] += book_count
+    ratings = sorted(set(RATINGS) | set(counts[Kind.RATING]))
+    months = last_months()
+    return {
+        "total": sum(counts[Kind.STATUS].values()),
+        "completed": counts[Kind.STATUS][1],
+        "in_progress": counts[Kind.STATUS][0],
+        "ratings": bars([(r, counts[Kind.RATING][r]) for r in ratings]),
+        "months": bars(
+            [("%02d.%d" % (m % 100, m // 100), counts[Kind.MONTH][m]) for m in months]
+        ),
+        "top_authors": authors,
+    }
+
+
+def dashboard(user):
+    """Данные для панели статистики на главной странице: два запроса."""
+    return build_dashboard(list(stat_rows(user)), list(top_authors(user)))
+
+
+async def adashboard(user):
+    rows = [row async for row in stat_rows(user)]
+    authors = [author async for author in top_authors(user)]
+    return build_dashboard(rows, authors)
@@ -0,0 +1,87 @@
+import os
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+
+from . import covers, metadata
+from .ebook_metadata import read_many
+from .importer import LibraryImporter, read_records, read_text_chunks
+from .jobs import on_abandon, progress, task
+from .models import BookFile
+from .thumbnails import make_thumbnails
+
+# Команды обслуживания, которые можно поставить задачей "command".
+COMMANDS = {
+    "recompute_counters",
+    "rebuild_search_index",
+    "rebuild_reading_stats",
+    "extract_book_metadata",
+}
+
+
+def job_file_path(name):
+    return os.path.join(settings.LIBAPP_JOB_ROOT, name)
+
+
+def save_upload(upload, name):
+    """Сохраняет загруженный файл для задачи, не читая его в память целиком."""
+    path = job_file_path(name)
+    os.makedirs(settings.LIBAPP_JOB_ROOT, exist_ok=True)
+    with open(path, "wb") as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    return path
+
+
+@task("import_library")
+def import_library(job):
+    """
+    Импорт из файла, сохранённого save_upload. Порции фиксируются по одной,
+    поэтому задача ставится с max_attempts=1: повтор задвоил бы книги.
+    """
+    path = job_file_path(job.payload["file"])
+    importer = LibraryImporter(job.user, progress=lambda stats: progress(job, stats))
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            return importer.run(
+                read_records(read_text_chunks(f), job.payload["format"])
+            )
+    finally:
+        os.remove(path)
+
+
+@on_abandon("import_library")
+def remove_import_file(job):
+    """Обработчик упал посреди импорта, и finally выше не выполнился."""
+    try:
+        os.remove(job_file_path(job.payload["file"]))
+    except FileNotFoundError:
+        pass
+
+
+@task("command")
+def command(job):
+    name = job.payload["name"]
+    if name not in COMMANDS:
+        raise ValueError("Команду %s нельзя запускать задачей" % name)
+    out = StringIO()
+    call_command(name, *job.payload.get("args", []), stdout=out, stderr=out)
+    return {"output": out.getvalue()[-10000:]}
+
+
+@task("book_metadata")
+def book_metadata(job):
+    """Повтор чтения метаданных, если пул процессов не справился."""
+    files = BookFile.objects.filter(
+        pk__in=job.payload["ids"], metadata_state=BookFile.MetadataState.PENDING
+    )
+    return metadata.apply(read_many(metadata.items(files)))
+
+
+@task("cover_thumbnails")
+def cover_thumbnails(job):
+    """Повтор уменьшения обложки, если в пуле процессов оно не удалось."""
+    digest = job.payload["digest"]
+    folder = covers.directory(digest)
+    return make_thumbnails(os.path.join(folder, covers.ORIGINAL), folder, covers.WIDTHS)
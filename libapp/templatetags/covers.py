@@ -0,0 +1,13 @@
+from django import template
+
+from .. import covers
+
+register = template.Library()
+
+
+@register.inclusion_tag("libapp/cover.html")
+def cover(obj, display="list"):
+    """{% cover book "list" %} - уменьшенная обложка, если она загружена."""
+    if not obj.cover:
+        return {}
+    return covers.picture(obj.cover, display)
@@ -1,3 +1,2705 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    DatabaseError,
+    OperationalError,
+    connection,
+    connections,
+    transaction,
+)
+from django.db.models import Q
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.http import HttpResponse
+from django.test import (
+    Client,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve, reverse
+from django.utils import timezone
+from PIL import Image
+
+from library import replicas
+from library.log import QueueFileHandler
+
+from . import (
+    async_views,
+    attachments,
+    cache_versions,
+    covers,
+    ebook_metadata,
+    exporter,
+    jobs,
+    metadata,
+    object_cache,
+    stats,
+    tasks,
+    urls,
+    views,
+)
+from .bulk import bulk_create_and_notify
+from .importer import LibraryImporter, RecordError, read_records
+from .middleware import QueryRecorder, sql_template
+from .models import (
+    Author,
+    SeriesBook,
+    Book,
+    BookFile,
+    Job,
+    ReadingStat,
+    SearchIndex,
+    StorageUsage,
+)
+from .search import index_objects, normalize, search
+from .seed import seed_library
+from .urls import read_patterns
+from .utils import ListOptions, encode_cursor
+
+
+class LibraryTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="reader", password="password"
+        )
+        cls.author = Author.objects.create(user=cls.user, name="Автор")
+        cls.series = SeriesBook.objects.create(
+            user=cls.user, name="Серия", author=cls.author, is_completed=False
+        )
+        cls.book = Book.objects.create(
+            user=cls.user, name="Книга", series=cls.series, is_completed=True
+        )
+        cls.other_author = Author.objects.create(user=cls.user, name="Другой")
+        cls.other_series = SeriesBook.objects.create(
+            user=cls.user,
+            name="Другая серия",
+            author=cls.other_author,
+            is_completed=False,
+        )
+
+    def setUp(self):
+        cache.clear()
+        object_cache.clear()
+        self.client.force_login(self.user)
+
+    def assertMaxQueries(self, num, url, method="get", data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data or {})
+        self.assertLessEqual(
+            len(queries),
+            num,
+            "%s %s: %d queries\n%s"
+            % (
+                method.upper(),
+                url,
+                len(queries),
+                "\n".join(q["sql"] for q in queries.captured_queries),
+            ),
+        )
+        return response
+
+
+def image_upload(color="red", size=(300, 400), name="cover.png", image_format="PNG"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class TemporaryMediaMixin:
+    """
+    MEDIA_ROOT и каталог файлов книг во временном каталоге, обложки
+    уменьшаются и метаданные читаются сразу.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        media = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.enterClassContext(
+            override_settings(
+                MEDIA_ROOT=media,
+                LIBAPP_ATTACHMENT_ROOT=os.path.join(media, "attachments"),
+                LIBAPP_COVER_WORKERS=0,
+                LIBAPP_METADATA_WORKERS=0,
+                LIBAPP_JOB_ROOT=os.path.join(media, "jobs"),
+            )
+        )
+        super().setUpClass()
+
+
+def committing():
+    """
+    on_commit выполняет обратный вызов сразу, как вне транзакции: файл
+    загрузки переносится на место (attachments.store), пока временный файл
+    ещё существует. captureOnCommitCallbacks выполнил бы его после ответа.
+    """
+    return mock.patch.object(
+        transaction, "on_commit", lambda func, using=None, robust=False: func()
+    )
+
+
+def make_book_file(book, content=b"%PDF-1.4 book", name="book.pdf"):
+    """Файл книги без загрузки через форму."""
+    digest = hashlib.sha256(content).hexdigest()
+    path = attachments.path_for(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return BookFile.objects.create(
+        book=book,
+        user=book.user,
+        name=name,
+        format=BookFile.Format.PDF,
+        size=len(content),
+        sha256=digest,
+    )
+
+
+class HierarchyQueryCountTests(LibraryTestCase):
+    def test_read_routes(self):
+        a, s, b = self.author.pk, self.series.pk, self.book.pk
+        routes = [
+            (reverse("main_page"), 4),
+            (reverse("add_author"), 2),
+            (reverse("add_series_book", args=(a,)), 3),
+            (reverse("add_book", args=(a, s)), 3),
+            (reverse("show_authors"), 4),
+            (reverse("show_author", args=(a,)), 4),
+            (reverse("show_series_book", args=(a, s)), 4),
+            (reverse("show_book", args=(a, s, b)), 5),
+            (reverse("edit_author_page", args=(a, "author", a)), 3),
+            (reverse("edit_series_book_page", args=(a, s, "series_book", s)), 3),
+            (reverse("edit_book_page", args=(a, s, b, "book", b)), 3),
+            (reverse("delete_author_page", args=(a, "author")), 4),
+            (reverse("delete_series_book_page", args=(a, s, "series_book")), 4),
+            (reverse("delete_book_page", args=(a, s, b, "book")), 3),
+        ]
+        for url, num in routes:
+            with self.subTest(url=url):
+                response = self.assertMaxQueries(num, url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_create_book_uses_resolved_series(self):
+        url = reverse("add_book", args=(self.author.pk, self.series.pk))
+        data = {"name": "Новая", "description": "", "rating": 5, "is_completed": 0}
+        response = self.assertMaxQueries(9, url, "post", data)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Book.objects.filter(name="Новая", series=self.series).exists())
+
+
+class BookFormsetTests(LibraryTestCase):
+    def url(self):
+        return reverse("add_book", args=(self.author.pk, self.series.pk))
+
+    def rows(self, rows, total=None):
+        data = {
+            "books-TOTAL_FORMS": total or len(rows),
+            "books-INITIAL_FORMS": 0,
+            "books-MIN_NUM_FORMS": 1,
+            "books-MAX_NUM_FORMS": 100,
+        }
+        for i, row in enumerate(rows):
+            row = {"description": "", "rating": "", "is_completed": 0, **row}
+            data.update({"books-%d-%s" % (i, k): v for k, v in row.items()})
+        return data
+
+    def test_get_renders_requested_rows_and_row_template(self):
+        response = self.client.get(self.url(), {"rows": 3})
+        self.assertContains(response, 'name="books-TOTAL_FORMS" value="3"')
+        self.assertContains(response, 'name="books-2-name"')
+        self.assertContains(response, 'name="books-__prefix__-name"')
+        self.assertContains(response, "libapp/js/formset.js")
+        self.assertNotContains(response, 'name="books-0-cover"')
+
+    def test_rows_are_inserted_with_one_statement(self):
+        books = [{"name": "Хроники %d" % i, "rating": i % 11} for i in range(20)]
+        data = self.rows(books + [{}, {}])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url(), data)
+        self.assertRedirects(
+            response,
+            reverse("show_series_book", args=(self.author.pk, self.series.pk)),
+            fetch_redirect_response=False,
+        )
+        inserts = [
+            q["sql"]
+            for q in queries.captured_queries
+            if q["sql"].startswith('INSERT INTO "libapp_book"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Book.objects.filter(series=self.series).count(), 21)
+        self.series.refresh_from_db()
+        self.assertEqual(self.series.book_count, 21)
+        self.assertEqual(search("хроники")[0][0]["object"].series, self.series)
+
+    def test_rows_are_validated_together(self):
+        cases = [
+            [{"name": "Первая", "rating": 5}, {"name": "Вторая", "rating": 11}],
+            [{"name": "Одна", "rating": 5}, {"name": "одна ", "rating": 3}],
+            [{}],
+        ]
+        for rows in cases:
+            with self.subTest(rows=rows):
+                response = self.client.post(self.url(), self.rows(rows))
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.context["formset"].is_valid())
+        self.assertContains(response, "Добавление книг")
+        self.assertEqual(Book.objects.filter(series=self.series).count(), 1)
+
+    def test_row_limit(self):
+        data = self.rows([{"name": "Книга %d" % i} for i in range(101)])
+        response = self.client.post(self.url(), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["formset"].non_form_errors())
+
+
+class HierarchyChainTests(LibraryTestCase):
+    def test_series_of_other_author_is_404(self):
+        url = reverse("show_series_book", args=(self.author.pk, self.other_series.pk))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_book_of_other_series_is_404(self):
+        url = reverse(
+            "show_book", args=(self.other_author.pk, self.other_series.pk, self.book.pk)
+        )
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_deleted_parent_is_404(self):
+        self.series.is_deleted = True
+        self.series.save()
+        url = reverse("show_book", args=(self.author.pk, self.series.pk, self.book.pk))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_edit_object_outside_chain_is_404(self):
+        url = reverse(
+            "edit_series_book_page",
+            args=(self.author.pk, self.series.pk, "series_book", self.other_series.pk),
+        )
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_unknown_edit_kind_is_404(self):
+        url = reverse(
+            "edit_series_book_page",
+            args=(self.author.pk, self.series.pk, "book", self.series.pk),
+        )
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class StaleObjectCacheTests(LibraryTestCase):
+    """
+    Кэш объектов другого процесса может хранить устаревшую копию: изменения
+    и удаления должны работать со строками из базы.
+    """
+
+    def setUp(self):
+        super().setUp()
+        a, s, b = self.author.pk, self.series.pk, self.book.pk
+        self.client.get(reverse("show_book", args=(a, s, b)))
+        self.assertIn(b, Book.cached.peek_many([b]))
+        self.edit_url = reverse("edit_book_page", args=(a, s, b, "book", b))
+
+    def edit(self, **data):
+        data = {"name": "Книга", "description": "", "rating": 0, **data}
+        return self.client.post(self.edit_url, {"is_completed": 1, **data})
+
+    def test_edit_does_not_restore_soft_deleted_row(self):
+        # Удаление в другом процессе: кэш этого процесса не сброшен.
+        Book.objects.filter(pk=self.book.pk).update(is_deleted=True)
+        self.assertEqual(self.edit(name="Новое имя").status_code, 404)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.is_deleted, self.book.name), (True, "Книга"))
+
+    def test_edit_keeps_newer_fields_and_counters(self):
+        Book.objects.filter(pk=self.book.pk).update(rating=8, description="Новее")
+        SeriesBook.objects.filter(pk=self.series.pk).update(
+            rating_sum=self.series.rating_sum + 8
+        )
+        response = self.edit(rating=10, description="Новее")
+        self.assertEqual(response.status_code, 302)
+        self.series.refresh_from_db()
+        self.assertEqual(self.series.rating_sum, 10)
+
+    def test_delete_does_not_act_on_stale_row(self):
+        Book.objects.filter(pk=self.book.pk).update(is_deleted=True)
+        url = reverse(
+            "delete_book_page",
+            args=(self.author.pk, self.series.pk, self.book.pk, "book"),
+        )
+        response = self.client.post(url, {"delete_button": "delete"})
+        self.assertEqual(response.status_code, 404)
+        self.series.refresh_from_db()
+        self.assertEqual(self.series.book_count, 1)
+
+
+class SoftDeleteCascadeTests(LibraryTestCase):
+    def make_subtree(self, series_count, books_per_series):
+        author = Author.objects.create(user=self.user, name="Каскад")
+        series = SeriesBook.objects.bulk_create(
+            SeriesBook(user=self.user, name=str(i), author=author, is_completed=False)
+            for i in range(series_count)
+        )
+        Book.objects.bulk_create(
+            Book(user=self.user, name=str(i), series=s, is_completed=False)
+            for s in series
+            for i in range(books_per_series)
+        )
+        return author
+
+    def test_author_cascade_counts(self):
+        author = self.make_subtree(3, 4)
+        deleted = author.soft_delete()
+        self.assertEqual(deleted, {"author": 1, "series_book": 3, "book": 12})
+        self.assertFalse(SeriesBook.undeleted.filter(author=author).exists())
+        self.assertFalse(Book.undeleted.filter(series__author=author).exists())
+        self.assertTrue(Book.undeleted.filter(pk=self.book.pk).exists())
+
+    def test_series_cascade_counts(self):
+        deleted = self.series.soft_delete()
+        self.assertEqual(deleted, {"author": 0, "series_book": 1, "book": 1})
+        self.assertTrue(Author.undeleted.filter(pk=self.author.pk).exists())
+
+    def test_query_count_does_not_depend_on_subtree_size(self):
+        counts = []
+        for series_count, books_per_series in ((1, 1), (20, 50)):
+            author = self.make_subtree(series_count, books_per_series)
+            with CaptureQueriesContext(connection) as queries:
+                author.soft_delete()
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_delete_views_use_cascade(self):
+        author = self.make_subtree(5, 10)
+        series = SeriesBook.objects.filter(author=author).first()
+        url = reverse("delete_series_book_page", args=(author.pk, series.pk, "author"))
+        # 15 запросов удаления и транзакция с блокировкой строк цепочки.
+        response = self.assertMaxQueries(17, url, "post", {"delete_button": "delete"})
+        self.assertRedirects(response, reverse("show_authors"))
+        self.assertFalse(Book.undeleted.filter(series__author=author).exists())
+
+
+class ExplainManagersCommandTests(LibraryTestCase):
+    def test_prints_plan_for_each_manager_query(self):
+        out = StringIO()
+        call_command("explain_managers", stdout=out)
+        output = out.getvalue()
+        self.assertIn("SeriesBook.undeleted.filter(author)", output)
+        self.assertIn("Book.undeleted.filter(series)", output)
+
+
+class KeysetPaginationTests(LibraryTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Author.objects.bulk_create(
+            Author(user=cls.user, name="Автор %d" % (i % 7)) for i in range(60)
+        )
+
+    def test_walks_all_pages_forward_and_back(self):
+        url = reverse("show_authors")
+        expected = list(Author.undeleted.order_by("name", "pk"))
+        seen, pages = [], []
+        response = self.client.get(url)
+        while True:
+            page = response.context["page_obj"]
+            pages.append(page)
+            seen.extend(page.object_list)
+            if not page.has_next():
+                break
+            response = self.client.get(url, {"after": page.next_cursor()})
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertFalse(pages[0].has_previous())
+
+        response = self.client.get(url, {"before": pages[-1].previous_cursor()})
+        self.assertEqual(
+            list(response.context["page_obj"].object_list), pages[-2].object_list
+        )
+
+    def test_deep_page_has_same_query_count_without_count(self):
+        url = reverse("show_authors")
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(url)
+        cursor = response.context["page_obj"].next_cursor()
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get(url, {"after": cursor})
+        self.assertEqual(len(first), len(deep))
+        for query in deep.captured_queries:
+            self.assertNotIn("COUNT(", query["sql"].upper())
+            self.assertNotIn("OFFSET", query["sql"].upper())
+
+    def test_bad_cursor_is_404(self):
+        response = self.client.get(reverse("show_authors"), {"after": "!!!"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_values_of_wrong_type_are_404(self):
+        for values in (
+            ["name", "x", "abc"],
+            ["name", None, 1],
+            ["name", "x", None],
+            ["name", "x", {}],
+            ["name", "x"],
+            [],
+        ):
+            with self.subTest(values=values):
+                response = self.client.get(
+                    reverse("show_authors"), {"after": encode_cursor(values)}
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+class SearchTests(LibraryTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.pushkin = Author.objects.create(user=cls.user, name="Александр Пушкин")
+        cls.onegin = SeriesBook.objects.create(
+            user=cls.user,
+            name="Романы в стихах",
+            author=cls.pushkin,
+            is_completed=True,
+            description="Произведения о дворянской жизни",
+        )
+        cls.book_onegin = Book.objects.create(
+            user=cls.user,
+            name="Евгений Онегин",
+            series=cls.onegin,
+            is_completed=True,
+            description="Роман о скучающем дворянине",
+        )
+
+    def test_normalize_is_russian_aware(self):
+        self.assertEqual(normalize("Ёлки"), normalize("елка"))
+        self.assertEqual(normalize("дворянской"), normalize("дворянские"))
+        self.assertEqual(normalize("и в на"), [])
+
+    def test_finds_all_kinds_ranked(self):
+        response = self.client.get(reverse("search"), {"q": "Онегина"})
+        results = response.context["results"]
+        self.assertEqual(results[0]["object"], self.book_onegin)
+
+        results, has_next = search("пушкина")
+        self.assertEqual([r["object"] for r in results], [self.pushkin])
+        self.assertFalse(has_next)
+
+        results, _ = search("роман о дворянской жизни")
+        self.assertEqual(
+            [r["object"] for r in results], [self.onegin, self.book_onegin]
+        )
+
+    def test_index_follows_edits_and_soft_delete(self):
+        self.book_onegin.name = "Капитанская дочка"
+        self.book_onegin.save()
+        self.assertEqual(search("онегин")[0], [])
+        self.assertEqual(search("капитанская")[0][0]["object"], self.book_onegin)
+        self.pushkin.soft_delete()
+        self.assertEqual(search("капитанская")[0], [])
+        self.assertFalse(
+            SearchIndex.objects.filter(
+                kind=SearchIndex.Kind.SERIES_BOOK, object_id=self.onegin.pk
+            ).exists()
+        )
+
+    def test_does_not_use_like_scans_on_source_tables(self):
+        with CaptureQueriesContext(connection) as queries:
+            search("онегин")
+        for query in queries.captured_queries:
+            self.assertNotIn("LIKE", query["sql"].split("FROM")[1].split("WHERE")[0])
+
+    def test_pagination(self):
+        SeriesBook.objects.bulk_create(
+            SeriesBook(
+                user=self.user,
+                name="Пушкин %d" % i,
+                author=self.pushkin,
+                is_completed=0,
+            )
+            for i in range(5)
+        )
+        index_objects(SeriesBook.objects.filter(name__startswith="Пушкин "))
+        first, has_next = search("пушкин", 1, 4)
+        second, has_next_2 = search("пушкин", 2, 4)
+        self.assertTrue(has_next)
+        self.assertFalse(has_next_2)
+        self.assertEqual(len(first) + len(second), 6)
+
+    def test_pages_are_full_despite_stale_index_rows(self):
+        SeriesBook.objects.bulk_create(
+            SeriesBook(
+                user=self.user,
+                name="Пушкин %d" % i,
+                author=self.pushkin,
+                is_completed=0,
+            )
+            for i in range(6)
+        )
+        index_objects(SeriesBook.objects.filter(name__startswith="Пушкин "))
+        # Удаление мимо soft_delete: строки индекса остаются.
+        stale = SeriesBook.objects.filter(name__in=["Пушкин 0", "Пушкин 1"])
+        stale.update(is_deleted=True)
+        first, has_next = search("пушкин", 1, 3)
+        second, has_next_2 = search("пушкин", 2, 3)
+        self.assertEqual((len(first), has_next), (3, True))
+        self.assertEqual((len(second), has_next_2), (2, False))
+
+    def test_hard_delete_removes_index_rows(self):
+        self.pushkin.delete()
+        Kind = SearchIndex.Kind
+        deleted = (
+            Q(kind=Kind.AUTHOR, object_id=self.pushkin.pk)
+            | Q(kind=Kind.SERIES_BOOK, object_id=self.onegin.pk)
+            | Q(kind=Kind.BOOK, object_id=self.book_onegin.pk)
+        )
+        self.assertFalse(SearchIndex.objects.filter(deleted).exists())
+        self.assertTrue(SearchIndex.objects.filter(kind=Kind.AUTHOR).exists())
+
+    def test_rebuild_command(self):
+        rows = set(SearchIndex.objects.values_list("kind", "object_id", "term"))
+        SearchIndex.objects.filter(kind=SearchIndex.Kind.BOOK).delete()
+        call_command("rebuild_search_index", chunk_size=2, stdout=StringIO())
+        self.assertEqual(
+            set(SearchIndex.objects.values_list("kind", "object_id", "term")), rows
+        )
+
+    def test_failed_rebuild_keeps_index(self):
+        rows = SearchIndex.objects.count()
+        with mock.patch(
+            "libapp.management.commands.rebuild_search_index.index_objects",
+            side_effect=DatabaseError("сбой"),
+        ):
+            with self.assertRaises(DatabaseError):
+                call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(SearchIndex.objects.count(), rows)
+        results, _ = search("пушкина")
+        self.assertEqual([r["object"] for r in results], [self.pushkin])
+
+
+class CounterTests(LibraryTestCase):
+    def assertCounters(self, obj, **expected):
+        obj.refresh_from_db()
+        self.assertEqual({k: getattr(obj, k) for k in expected}, expected)
+
+    def test_setup_is_counted(self):
+        self.assertCounters(
+            self.author, series_count=1, book_count=1, rating_sum=0, completed_count=1
+        )
+        self.assertCounters(self.series, book_count=1, completed_count=1)
+
+    def test_book_create_edit_and_delete(self):
+        book = Book.objects.create(
+            user=self.user, name="Вторая", series=self.series, rating=8, is_completed=0
+        )
+        self.assertCounters(self.series, book_count=2, rating_sum=8, completed_count=1)
+        book = Book.objects.get(pk=book.pk)
+        book.rating = 6
+        book.is_completed = True
+        book.save()
+        self.assertCounters(self.author, book_count=2, rating_sum=6, completed_count=2)
+        self.assertEqual(self.author.average_rating, 3)
+        self.assertEqual(self.author.completed_percent, 100)
+        book.soft_delete()
+        self.assertCounters(self.author, book_count=1, rating_sum=0, completed_count=1)
+
+    def test_book_moved_between_series(self):
+        self.book.series = self.other_series
+        self.book.save()
+        self.assertCounters(self.author, book_count=0)
+        self.assertCounters(self.other_author, book_count=1, completed_count=1)
+
+    def test_series_cascade(self):
+        self.series.soft_delete()
+        self.assertCounters(
+            self.author, series_count=0, book_count=0, rating_sum=0, completed_count=0
+        )
+
+    def test_form_save_does_not_overwrite_counters(self):
+        stale = SeriesBook.objects.get(pk=self.series.pk)
+        Book.objects.create(
+            user=self.user, name="Ещё", series=self.series, rating=4, is_completed=0
+        )
+        stale.name = "Новое имя"
+        stale.save()
+        self.assertCounters(self.series, name="Новое имя", book_count=2)
+
+    def test_recompute_counters_repairs_drift(self):
+        Author.objects.filter(pk=self.author.pk).update(book_count=42)
+        SeriesBook.objects.filter(pk=self.series.pk).update(rating_sum=-3)
+        out = StringIO()
+        call_command("recompute_counters", chunk_size=1, stdout=out)
+        self.assertIn("SeriesBook: исправлено 1", out.getvalue())
+        self.assertIn("Author: исправлено 1", out.getvalue())
+        self.assertCounters(self.author, book_count=1)
+        self.assertCounters(self.series, rating_sum=0)
+
+
+class ReadingStatsTests(LibraryTestCase):
+    def summary(self, user=None):
+        user = user or self.user
+        return {
+            (kind, bucket): count
+            for kind, bucket, count in ReadingStat.objects.filter(
+                user=user, book_count__gt=0
+            ).values_list("kind", "bucket", "book_count")
+        }
+
+    def assertSummaryIsActual(self, user=None):
+        user = user or self.user
+        actual = stats.actual_buckets(Book.objects.filter(user=user))[user.pk]
+        self.assertEqual(self.summary(user), dict(actual))
+
+    def test_setup_is_counted(self):
+        month = stats.month_bucket(self.book.created_at)
+        self.assertEqual(
+            self.summary(),
+            {
+                (ReadingStat.Kind.RATING, 0): 1,
+                (ReadingStat.Kind.STATUS, 1): 1,
+                (ReadingStat.Kind.MONTH, month): 1,
+            },
+        )
+
+    def test_book_create_edit_and_delete(self):
+        book = Book.objects.create(
+            user=self.user, name="Вторая", series=self.series, rating=8, is_completed=0
+        )
+        self.assertSummaryIsActual()
+        book = Book.objects.get(pk=book.pk)
+        book.rating = 6
+        book.is_completed = True
+        book.save()
+        self.assertSummaryIsActual()
+        self.assertEqual(self.summary()[ReadingStat.Kind.STATUS, 1], 2)
+        book.soft_delete()
+        self.assertSummaryIsActual()
+
+    def test_deferred_book_save_rebuilds(self):
+        book = Book.objects.only("pk", "name", "series").get(pk=self.book.pk)
+        book.rating = 3
+        book.save()
+        self.assertSummaryIsActual()
+
+    def test_series_and_author_cascade(self):
+        Book.objects.create(
+            user=self.user, name="Ещё", series=self.other_series, is_completed=0
+        )
+        self.book.soft_delete()
+        self.series.soft_delete()
+        self.assertSummaryIsActual()
+        self.other_author.soft_delete()
+        self.assertSummaryIsActual()
+        self.assertEqual(self.summary(), {})
+
+    def test_import_and_batch_update(self):
+        data = "author,series,name,rating,is_completed\n" + "".join(
+            "Импорт,Серия %d,Книга %d,%d,%d\n" % (i % 3, i, i % 11, i % 2)
+            for i in range(30)
+        )
+        LibraryImporter(self.user, batch_size=7).run(read_records([data], "csv"))
+        self.assertSummaryIsActual()
+        response = self.client.post(
+            reverse("api_batch", args=("books",)),
+            json.dumps(
+                {"update": [{"id": self.book.pk, "rating": 10, "is_completed": False}]}
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertSummaryIsActual()
+
+    def test_rebuild_command_repairs_drift(self):
+        ReadingStat.objects.filter(user=self.user).update(book_count=42)
+        out = StringIO()
+        call_command("rebuild_reading_stats", user=[self.user.username], stdout=out)
+        self.assertIn("Сводка перестроена: 1", out.getvalue())
+        self.assertSummaryIsActual()
+
+    def test_main_page_dashboard_reads_summary(self):
+        Book.objects.create(
+            user=self.user, name="Вторая", series=self.series, rating=8, is_completed=0
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("main_page"))
+        self.assertNotIn(
+            '"libapp_book"', "".join(q["sql"] for q in queries.captured_queries)
+        )
+        dashboard = response.context["stats"]
+        self.assertEqual(
+            (dashboard["total"], dashboard["completed"], dashboard["in_progress"]),
+            (2, 1, 1),
+        )
+        self.assertEqual(dashboard["ratings"][8]["count"], 1)
+        self.assertEqual(dashboard["months"][-1]["count"], 2)
+        self.assertEqual(dashboard["top_authors"], [self.author])
+        self.assertContains(response, "Лучшие авторы")
+
+
+class ObjectCacheTests(LibraryTestCase):
+    def book_url(self):
+        return reverse("show_book", args=(self.author.pk, self.series.pk, self.book.pk))
+
+    def test_second_visit_skips_hierarchy_query(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.book_url())
+        cache.clear()
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(self.book_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertEqual(response.context["book"].series.author, self.author)
+        self.assertEqual(object_cache.stats()["libapp.book"]["hits"], 1)
+
+    def test_cached_get(self):
+        self.assertEqual(Author.cached.get(self.author.pk).name, "Автор")
+        with self.assertNumQueries(0):
+            self.assertEqual(Author.cached.get(self.author.pk), self.author)
+        self.assertIsNone(Author.cached.get(999999))
+        self.assertEqual(
+            object_cache.stats()["libapp.author"],
+            {"hits": 1, "misses": 2, "hit_rate": 0.333},
+        )
+
+    def test_hierarchy_checks_cached_parents(self):
+        self.client.get(self.book_url())
+        url = reverse(
+            "show_book", args=(self.other_author.pk, self.series.pk, self.book.pk)
+        )
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_save_and_counters_invalidate(self):
+        self.client.get(self.book_url())
+        self.client.post(
+            reverse(
+                "edit_author_page", args=(self.author.pk, "author", self.author.pk)
+            ),
+            {"name": "Переименован"},
+        )
+        self.assertEqual(Author.cached.get(self.author.pk).name, "Переименован")
+        Book.objects.create(
+            user=self.user, name="Вторая", series=self.series, rating=4, is_completed=0
+        )
+        self.assertEqual(SeriesBook.cached.get(self.series.pk).book_count, 2)
+        self.assertEqual(Author.cached.get(self.author.pk).rating_sum, 4)
+
+    def test_soft_delete_invalidates_descendants(self):
+        self.client.get(self.book_url())
+        self.author.soft_delete()
+        self.assertTrue(Book.cached.get(self.book.pk).is_deleted)
+        self.assertTrue(SeriesBook.cached.get(self.series.pk).is_deleted)
+        self.assertEqual(self.client.get(self.book_url()).status_code, 404)
+
+    def test_bulk_update_invalidates(self):
+        self.client.get(self.book_url())
+        response = self.client.post(
+            reverse("api_batch", args=("books",)),
+            json.dumps({"update": [{"id": self.book.pk, "rating": 7}]}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Book.cached.get(self.book.pk).rating, 7)
+        self.assertEqual(SeriesBook.cached.get(self.series.pk).rating_sum, 7)
+
+    def test_stats_endpoint_is_staff_only(self):
+        url = reverse("object_cache_stats")
+        self.assertEqual(self.client.get(url).status_code, 404)
+        get_user_model().objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.client.get(url)
+        self.assertEqual(
+            set(response.json()), {"libapp.author", "libapp.seriesbook", "libapp.book"}
+        )
+
+
+class ListOptionsTests(LibraryTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Book.objects.bulk_create(
+            Book(
+                user=cls.user,
+                series=cls.series,
+                name="Книга %02d" % i,
+                rating=i % 11,
+                is_completed=i % 3 == 0,
+            )
+            for i in range(40)
+        )
+
+    def url(self, **params):
+        return "%s?%s" % (
+            reverse("show_series_book", args=(self.author.pk, self.series.pk)),
+            urlencode(params),
+        )
+
+    def names(self, response):
+        return [book.name for book in response.context["books"]]
+
+    def walk(self, **params):
+        """Все страницы вперёд, затем первая страница обратно со второй."""
+        response = self.client.get(self.url(**params))
+        pages = [self.names(response)]
+        while response.context["page_obj"].has_next():
+            cursor = response.context["page_obj"].next_cursor()
+            response = self.client.get(self.url(after=cursor, **params))
+            pages.append(self.names(response))
+        if len(pages) > 1:
+            cursor = response.context["page_obj"].previous_cursor()
+            back = self.client.get(self.url(before=cursor, **params))
+            self.assertEqual(self.names(back), pages[-2])
+        return [name for page in pages for name in page]
+
+    def test_sort_by_rating_descending_paginates(self):
+        books = Book.undeleted.filter(series=self.series)
+        expected = [b.name for b in books.order_by("-rating", "-pk")]
+        self.assertEqual(self.walk(sort="-rating"), expected)
+        expected = [b.name for b in books.order_by("rating", "pk")]
+        self.assertEqual(self.walk(sort="rating"), expected)
+
+    def test_sort_by_created_paginates(self):
+        books = Book.undeleted.filter(series=self.series)
+        expected = [b.name for b in books.order_by("-created_at", "-pk")]
+        self.assertEqual(self.walk(sort="-created"), expected)
+
+    def test_bad_date_cursor_is_404(self):
+        cursor = encode_cursor(["-created_at", "notadate", 1])
+        response = self.client.get(self.url(sort="-created", after=cursor))
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_of_another_sort_is_404(self):
+        response = self.client.get(self.url(sort="name"))
+        cursor = response.context["page_obj"].next_cursor()
+        for sort in ("-rating", "-name", "created"):
+            with self.subTest(sort=sort):
+                response = self.client.get(self.url(sort=sort, after=cursor))
+                self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            self.url(sort="-rating", after=encode_cursor(["x", 1]))
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_filters(self):
+        names = self.walk(sort="-rating", completed=1, rating_min=3, rating_max=7)
+        expected = Book.undeleted.filter(
+            series=self.series, is_completed=True, rating__range=(3, 7)
+        ).order_by("-rating", "-pk")
+        self.assertEqual(names, [b.name for b in expected])
+
+    def test_rating_range_switches_sort_to_rating(self):
+        response = self.client.get(self.url(sort="name", rating_min=10))
+        self.assertEqual(response.context["list_options"].sort, "rating")
+        self.assertEqual(
+            set(self.names(response)), {"Книга 10", "Книга 21", "Книга 32"}
+        )
+
+    def test_invalid_params(self):
+        for params in ({"sort": "description"}, {"completed": 2}, {"rating_min": "x"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url(**params)).status_code, 404)
+
+    def test_facets(self):
+        response = self.client.get(self.url(completed=0))
+        facets = response.context["facets"]
+        self.assertEqual(
+            [(link["label"], link["count"]) for link in facets.completed_links()],
+            [("Все", 41), ("Завершено", 15), ("Не завершено", 26)],
+        )
+        ratings = {link["label"]: link["count"] for link in facets.rating_links()}
+        self.assertEqual(sum(ratings.values()), 26)
+        self.assertContains(response, "Не завершено (26)")
+
+    def test_fragment_cache_varies_on_options(self):
+        first = self.names(self.client.get(self.url()))
+        by_rating = self.names(self.client.get(self.url(sort="-rating")))
+        self.assertNotEqual(first, by_rating)
+
+    def test_every_combination_has_an_index(self):
+        combinations = [
+            {"sort": sort, **filters}
+            for sort in ("name", "-name", "rating", "-rating", "created", "-created")
+            for filters in (
+                {},
+                {"completed": 1},
+                {"rating_min": 2, "rating_max": 5},
+                {"completed": 0, "rating_max": 5},
+            )
+        ]
+        for model, parent in ((SeriesBook, "author"), (Book, "series")):
+            indexes = [index.fields for index in model._meta.indexes]
+            for params in combinations:
+                with self.subTest(model=model.__name__, params=params):
+                    self.assertIn(ListOptions(params).index_fields(parent), indexes)
+
+
+class CoverTests(TemporaryMediaMixin, LibraryTestCase):
+    def add_book(self, upload, name="С обложкой"):
+        url = reverse("add_book", args=(self.author.pk, self.series.pk))
+        data = {"name": name, "rating": 5, "is_completed": 0, "cover": upload}
+        return self.client.post(url, data)
+
+    def test_upload_stores_content_addressed_thumbnails(self):
+        upload = image_upload()
+        digest = hashlib.sha256(upload.read()).hexdigest()
+        upload.seek(0)
+        self.assertEqual(self.add_book(upload).status_code, 302)
+        book = Book.objects.get(name="С обложкой")
+        self.assertEqual(book.cover, digest)
+        self.assertEqual(
+            sorted(os.listdir(covers.directory(digest))),
+            sorted(
+                ["original"]
+                + ["%d.%s" % (w, e) for w in covers.WIDTHS for e in ("webp", "jpg")]
+            ),
+        )
+        with Image.open(os.path.join(covers.directory(digest), "64.webp")) as image:
+            self.assertEqual(image.size, (64, 96))
+
+        # Та же картинка у другой книги - те же файлы, ничего не переписано.
+        def modified():
+            folder = covers.directory(digest)
+            return {
+                name: os.stat(os.path.join(folder, name)).st_mtime_ns
+                for name in os.listdir(folder)
+            }
+
+        before = modified()
+        self.add_book(image_upload(), name="Вторая")
+        self.assertEqual(Book.objects.get(name="Вторая").cover, digest)
+        self.assertEqual(modified(), before)
+
+    def test_list_and_page_show_sized_lazy_thumbnails(self):
+        self.add_book(image_upload())
+        book = Book.objects.get(name="С обложкой")
+        url = covers.url(book.cover, 64, "webp")
+        response = self.client.get(
+            reverse("show_series_book", args=(self.author.pk, self.series.pk))
+        )
+        self.assertContains(response, 'srcset="%s 1x' % url)
+        self.assertContains(response, 'width="64" height="96" loading="lazy"')
+        response = self.client.get(
+            reverse("show_book", args=(self.author.pk, self.series.pk, book.pk))
+        )
+        self.assertContains(response, 'width="128" height="192" loading="eager"')
+
+    def test_series_cover(self):
+        url = reverse("add_series_book", args=(self.author.pk,))
+        data = {"name": "Серия с обложкой", "rating": 5, "is_completed": 0}
+        self.client.post(url, {**data, "cover": image_upload("blue")})
+        series = SeriesBook.objects.get(name="Серия с обложкой")
+        response = self.client.get(reverse("show_author", args=(self.author.pk,)))
+        self.assertContains(response, covers.url(series.cover, 128, "jpg") + " 2x")
+
+    def test_thumbnails_are_served_with_far_future_caching(self):
+        self.add_book(image_upload())
+        digest = Book.objects.get(name="С обложкой").cover
+        self.client.logout()
+        response = self.client.get(covers.url(digest, 128, "webp"))
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertEqual(response["Cache-Control"], covers.CACHE_CONTROL)
+        self.assertEqual(b"".join(response.streaming_content)[8:12], b"WEBP")
+
+        cover = reverse("cover", args=(digest[:2], digest, "original"))
+        self.assertEqual(self.client.get(cover).status_code, 404)
+        missing = "0" * 64
+        self.assertEqual(
+            self.client.get(covers.url(missing, 64, "jpg")).status_code, 404
+        )
+
+    def test_rejects_non_images_and_large_files(self):
+        text = SimpleUploadedFile("cover.png", b"not an image", "image/png")
+        response = self.add_book(text)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["form"].errors["cover"])
+        with override_settings(LIBAPP_COVER_MAX_BYTES=100):
+            response = self.add_book(image_upload())
+        self.assertIn("Файл больше", str(response.context["form"].errors["cover"]))
+        self.assertFalse(Book.objects.filter(name="С обложкой").exists())
+
+    @override_settings(LIBAPP_COVER_WORKERS=1)
+    def test_thumbnails_are_made_in_process_pool(self):
+        self.add_book(image_upload("green"))
+        digest = Book.objects.get(name="С обложкой").cover
+        future = covers.submit(digest)
+        self.assertEqual(future.result(timeout=60), [])
+        self.assertTrue(covers.is_ready(digest))
+
+
+EPUB = b"PK\x03\x04" + bytes(range(256)) * 40
+
+
+class BookFileTests(TemporaryMediaMixin, LibraryTestCase):
+    def upload(self, content=EPUB, name="book.epub", client=None):
+        url = reverse(
+            "upload_book_file", args=(self.author.pk, self.series.pk, self.book.pk)
+        )
+        upload = SimpleUploadedFile(name, content)
+        with committing():
+            return (client or self.client).post(url, {"file": upload})
+
+    def download_url(self, attachment):
+        return reverse(
+            "download_book_file",
+            args=(self.author.pk, self.series.pk, self.book.pk, attachment.pk),
+        )
+
+    def used(self):
+        return StorageUsage.objects.get(user=self.user).bytes_used
+
+    def test_upload_is_hashed_and_stored_by_content(self):
+        self.assertEqual(self.upload().status_code, 302)
+        attachment = BookFile.objects.get(book=self.book)
+        digest = hashlib.sha256(EPUB).hexdigest()
+        self.assertEqual(
+            (attachment.name, attachment.format, attachment.size, attachment.sha256),
+            ("book.epub", "epub", len(EPUB), digest),
+        )
+        with open(attachments.path_for(digest), "rb") as f:
+            self.assertEqual(f.read(), EPUB)
+        self.assertEqual(self.used(), len(EPUB))
+
+        self.upload(name="copy.epub")
+        self.assertEqual(BookFile.objects.filter(sha256=digest).count(), 2)
+        self.assertEqual(
+            os.listdir(os.path.dirname(attachments.path_for(digest))), [digest]
+        )
+        self.assertEqual(self.used(), 2 * len(EPUB))
+
+        response = self.client.get(
+            reverse("show_book", args=(self.author.pk, self.series.pk, self.book.pk))
+        )
+        self.assertContains(response, "copy.epub")
+        self.assertContains(response, self.download_url(attachment))
+
+    def test_upload_checks_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        self.assertEqual(self.upload(client=client).status_code, 403)
+
+    def test_rejects_unknown_and_mismatched_files(self):
+        for content, name in ((EPUB, "book.txt"), (b"plain text", "book.pdf")):
+            with self.subTest(name=name):
+                response = self.upload(content, name)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context["form"].errors["file"])
+        self.assertEqual(
+            self.upload(b"\xef\xbb\xbf<?xml ?>", "book.fb2").status_code, 302
+        )
+
+    def test_size_limit_and_quota(self):
+        with override_settings(LIBAPP_ATTACHMENT_MAX_BYTES=1000):
+            response = self.upload()
+        self.assertIn("Файл больше", str(response.context["form"].errors["file"]))
+        with override_settings(LIBAPP_ATTACHMENT_QUOTA=len(EPUB) + 10):
+            self.assertEqual(self.upload().status_code, 302)
+            response = self.upload()
+        self.assertIn(
+            "Недостаточно места", str(response.context["form"].errors["file"])
+        )
+        self.assertEqual(BookFile.objects.count(), 1)
+        self.assertEqual(self.used(), len(EPUB))
+
+    def test_download_supports_ranges(self):
+        self.upload()
+        attachment = BookFile.objects.get()
+        url = self.download_url(attachment)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), EPUB)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Content-Length"], str(len(EPUB)))
+        self.assertIn('filename="book.epub"', response["Content-Disposition"])
+        etag = response["ETag"]
+
+        size = len(EPUB)
+        cases = [
+            ("bytes=2-5", 206, EPUB[2:6], "bytes 2-5/%d" % size),
+            ("bytes=-3", 206, EPUB[-3:], "bytes %d-%d/%d" % (size - 3, size - 1, size)),
+            ("bytes=%d-" % (size - 4), 206, EPUB[-4:], None),
+            ("bytes=0-1,4-5", 200, EPUB, None),
+        ]
+        for header, status, body, content_range in cases:
+            with self.subTest(range=header):
+                response = self.client.get(url, headers={"Range": header})
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(b"".join(response.streaming_content), body)
+                self.assertEqual(response["Content-Length"], str(len(body)))
+                if content_range:
+                    self.assertEqual(response["Content-Range"], content_range)
+
+        response = self.client.get(url, headers={"Range": "bytes=%d-" % size})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */%d" % size)
+
+        response = self.client.get(
+            url, headers={"Range": "bytes=0-0", "If-Range": etag}
+        )
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(
+            url, headers={"Range": "bytes=0-0", "If-Range": '"other"'}
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_files_of_other_users_are_404(self):
+        self.upload()
+        other = get_user_model().objects.create_user("other", password="password")
+        self.client.force_login(other)
+        url = self.download_url(BookFile.objects.get())
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_delete_releases_quota_and_unreferenced_file(self):
+        self.upload()
+        attachment = BookFile.objects.get()
+        url = reverse(
+            "delete_book_file",
+            args=(self.author.pk, self.series.pk, self.book.pk, attachment.pk),
+        )
+        self.assertContains(self.client.get(url), "book.epub")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"delete_button": "delete"})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(BookFile.objects.exists())
+        self.assertEqual(self.used(), 0)
+        self.assertFalse(os.path.exists(attachments.path_for(attachment.sha256)))
+
+    def test_quota_change_revalidates_book_page(self):
+        # Файл загружен в другую книгу: занятое место на этой странице уже
+        # другое, и условный GET не должен отвечать 304.
+        url = reverse("show_book", args=(self.author.pk, self.series.pk, self.book.pk))
+        etag = self.client.get(url)["ETag"]
+        other = Book.objects.create(
+            user=self.user,
+            name="Другая книга",
+            series=self.other_series,
+            is_completed=False,
+        )
+        upload = SimpleUploadedFile("other.epub", EPUB)
+        with committing():
+            self.client.post(
+                reverse(
+                    "upload_book_file",
+                    args=(self.other_author.pk, self.other_series.pk, other.pk),
+                ),
+                {"file": upload},
+            )
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["storage"]["used"], len(EPUB))
+        etag = response["ETag"]
+        self.assertEqual(
+            self.client.get(url, headers={"if-none-match": etag}).status_code, 304
+        )
+
+    def test_deleting_book_releases_quota(self):
+        self.upload()
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.filter(pk=self.book.pk).delete()
+        self.assertEqual(self.used(), 0)
+
+    def test_anonymous_upload_body_is_not_read(self):
+        client = Client(enforce_csrf_checks=True)
+        url = reverse("import_book_files")
+        with mock.patch.object(
+            attachments.HashingUploadHandler, "new_file"
+        ) as new_file:
+            response = client.post(url, {"file": SimpleUploadedFile("a.epub", EPUB)})
+            self.assertEqual(response.status_code, 302)
+            response = self.upload(client=client)
+            self.assertEqual(response.status_code, 302)
+        new_file.assert_not_called()
+
+    def test_rolled_back_upload_leaves_no_file(self):
+        content = EPUB + b"rollback"
+        digest = hashlib.sha256(content).hexdigest()
+        url = reverse(
+            "upload_book_file", args=(self.author.pk, self.series.pk, self.book.pk)
+        )
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            upload = SimpleUploadedFile("book.epub", content)
+            self.assertEqual(self.client.post(url, {"file": upload}).status_code, 302)
+            transaction.set_rollback(True)
+        self.assertFalse(BookFile.objects.exists())
+        self.assertFalse(os.path.exists(attachments.path_for(digest)))
+
+    def test_remove_unreferenced_waits_for_store(self):
+        # Ссылки проверяются только после того, как store() параллельной
+        # загрузки того же содержимого снимет блокировку.
+        digest = hashlib.sha256(EPUB).hexdigest()
+        with mock.patch.object(BookFile.objects, "filter") as filter_:
+            filter_.return_value.exists.return_value = True
+            with attachments.file_lock(digest):
+                thread = threading.Thread(
+                    target=attachments.remove_unreferenced, args=(digest,)
+                )
+                thread.start()
+                thread.join(0.2)
+                self.assertTrue(thread.is_alive())
+                filter_.assert_not_called()
+            thread.join()
+        filter_.assert_called_once_with(sha256=digest)
+
+    def test_store_restores_removed_file(self):
+        # Последняя ссылка удалена до фиксации загрузки того же содержимого:
+        # store() после фиксации возвращает файл на место.
+        self.upload()
+        digest = BookFile.objects.get().sha256
+        BookFile.objects.all().delete()
+        attachments.remove_unreferenced(digest)
+        self.assertFalse(os.path.exists(attachments.path_for(digest)))
+        temporary_path = os.path.join(settings.LIBAPP_ATTACHMENT_ROOT, "upload")
+        with open(temporary_path, "wb") as f:
+            f.write(EPUB)
+        attachments.store(digest, temporary_path)
+        with open(attachments.path_for(digest), "rb") as f:
+            self.assertEqual(f.read(), EPUB)
+        self.assertFalse(os.path.exists(temporary_path))
+
+    def test_parse_range(self):
+        self.assertIsNone(attachments.parse_range(None, 10))
+        self.assertIsNone(attachments.parse_range("items=0-1", 10))
+        self.assertIsNone(attachments.parse_range("bytes=5-2", 10))
+        self.assertEqual(attachments.parse_range("bytes=8-20", 10), (8, 9))
+        self.assertEqual(attachments.parse_range("bytes=-20", 10), (0, 9))
+        with self.assertRaises(ValueError):
+            attachments.parse_range("bytes=-0", 10)
+
+
+def make_epub(title="", authors=(), description="", meta=""):
+    opf = (
+        '<package xmlns="http://www.idpf.org/2007/opf" version="3.0">'
+        '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/" '
+        'xmlns:opf="http://www.idpf.org/2007/opf">'
+        "<dc:title>%s</dc:title>%s<dc:description>%s</dc:description>%s"
+        "</metadata><manifest/></package>"
+        % (
+            title,
+            "".join("<dc:creator>%s</dc:creator>" % a for a in authors),
+            description,
+            meta,
+        )
+    )
+    container = (
+        '<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+        '<rootfiles><rootfile full-path="OEBPS/content.opf"/></rootfiles>'
+        "</container>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("mimetype", "application/epub+zip")
+        archive.writestr("META-INF/container.xml", container)
+        archive.writestr("OEBPS/content.opf", opf)
+        archive.writestr("OEBPS/text.xhtml", "<html>" * 1000)
+    return buffer.getvalue()
+
+
+FB2 = """<?xml version="1.0" encoding="windows-1251"?>
+<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0">
+<description><title-info>
+<author><first-name>Лев</first-name><last-name>Толстой</last-name></author>
+<book-title>Война и мир</book-title>
+<annotation><p>Роман-эпопея.</p><p>Том первый.</p></annotation>
+<sequence name="Война и мир" number="1"/>
+</title-info>
+<document-info><author><nickname>верстальщик</nickname></author></document-info>
+</description>
+<body><section><p>Тело книги не читается: <не XML
+""".encode("cp1251")
+
+
+class MetadataTests(TemporaryMediaMixin, LibraryTestCase):
+    def read(self, content, file_format):
+        with tempfile.NamedTemporaryFile(suffix="." + file_format) as f:
+            f.write(content)
+            f.flush()
+            return ebook_metadata.read_metadata(f.name, file_format)
+
+    def import_file(self, content, name):
+        upload = SimpleUploadedFile(name, content)
+        with committing():
+            return self.client.post(reverse("import_book_files"), {"file": upload})
+
+    def test_reads_epub_with_calibre_and_epub3_series(self):
+        calibre = make_epub(
+            "Нос",
+            ["Гоголь", "Иллюстратор"],
+            "&lt;p&gt;Повесть&lt;/p&gt;",
+            '<meta name="calibre:series" content="Петербургские повести"/>'
+            '<meta name="calibre:series_index" content="2.0"/>',
+        )
+        self.assertEqual(
+            self.read(calibre, "epub"),
+            {
+                "title": "Нос",
+                "authors": ["Гоголь", "Иллюстратор"],
+                "series": "Петербургские повести",
+                "series_index": 2,
+                "annotation": "Повесть",
+            },
+        )
+        epub3 = make_epub(
+            "Шинель",
+            meta='<meta property="belongs-to-collection" id="c1">Повести</meta>'
+            '<meta refines="#c1" property="group-position">3.5</meta>',
+        )
+        result = self.read(epub3, "epub")
+        self.assertEqual((result["series"], result["series_index"]), ("Повести", 3.5))
+
+    def test_reads_fb2_description_only(self):
+        self.assertEqual(
+            self.read(FB2, "fb2"),
+            {
+                "title": "Война и мир",
+                "authors": ["Лев Толстой"],
+                "series": "Война и мир",
+                "series_index": 1,
+                "annotation": "Роман-эпопея.\nТом первый.",
+            },
+        )
+        with self.assertRaises(ebook_metadata.MetadataError):
+            self.read(EPUB, "epub")
+        with self.assertRaises(ebook_metadata.MetadataError):
+            self.read(b"<FictionBook><description>", "fb2")
+
+    def test_import_creates_book_author_and_series(self):
+        content = make_epub(
+            "Новая",
+            ["Автор"],
+            "Аннотация",
+            '<meta name="calibre:series" content="Цикл"/>'
+            '<meta name="calibre:series_index" content="4"/>',
+        )
+        response = self.import_file(content, "new.epub")
+        self.assertRedirects(response, reverse("import_book_files"))
+        attachment = BookFile.objects.select_related("book__series").get()
+        book = attachment.book
+        self.assertEqual(attachment.metadata_state, BookFile.MetadataState.DONE)
+        self.assertEqual((book.name, book.description), ("Новая", "Аннотация"))
+        self.assertEqual(book.series.name, "Цикл")
+        self.assertEqual(book.series.author, self.author)
+        self.assertEqual(Author.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(search("новая")[0][0]["object"], book)
+        response = self.client.get(reverse("import_book_files"))
+        self.assertContains(response, "Цикл, № 4")
+
+    def test_unreadable_file_gets_book_named_after_file(self):
+        self.import_file(b"\xef\xbb\xbf<FictionBook>", "Дневник.fb2")
+        attachment = BookFile.objects.select_related("book__series__author").get()
+        self.assertEqual(attachment.metadata_state, BookFile.MetadataState.FAILED)
+        self.assertIn("error", attachment.metadata)
+        self.assertEqual(attachment.book.name, "Дневник")
+        self.assertEqual(attachment.book.series.name, metadata.NO_SERIES)
+        self.assertEqual(attachment.book.series.author.name, metadata.UNKNOWN_AUTHOR)
+
+    def test_import_rejects_pdf(self):
+        response = self.import_file(b"%PDF-1.4 book", "book.pdf")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("EPUB и FB2", str(response.context["form"].errors["file"]))
+        self.assertFalse(BookFile.objects.exists())
+
+    def test_upload_fills_blank_description_only(self):
+        url = reverse(
+            "upload_book_file", args=(self.author.pk, self.series.pk, self.book.pk)
+        )
+        books = Book.objects.count()
+        upload = SimpleUploadedFile("book.fb2", FB2)
+        with committing():
+            self.client.post(url, {"file": upload})
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.name, "Книга")
+        self.assertEqual(self.book.description, "Роман-эпопея.\nТом первый.")
+        self.assertEqual(Book.objects.count(), books)
+
+    def test_batch_command_reads_pending_files_in_pool(self):
+        files = []
+        for i in range(5):
+            content = make_epub("Том %d" % i, ["Пакетный автор"])
+            attachment = make_book_file(self.book, content, "%d.epub" % i)
+            attachment.book = None
+            attachment.format = BookFile.Format.EPUB
+            attachment.metadata_state = BookFile.MetadataState.PENDING
+            attachment.save()
+            files.append(attachment)
+        out = StringIO()
+        call_command(
+            "extract_book_metadata", workers=2, chunk_size=2, batch_size=3, stdout=out
+        )
+        self.assertIn("Прочитано: 5, ошибок: 0, создано книг: 5", out.getvalue())
+        self.assertEqual(
+            sorted(
+                Book.objects.filter(series__author__name="Пакетный автор").values_list(
+                    "name", flat=True
+                )
+            ),
+            ["Том %d" % i for i in range(5)],
+        )
+        out = StringIO()
+        call_command("extract_book_metadata", all=True, workers=0, stdout=out)
+        self.assertIn("Прочитано: 5, ошибок: 0, создано книг: 0", out.getvalue())
+
+
+@jobs.task("test_flaky")
+def flaky_task(job):
+    if job.attempts < job.payload["succeed_on"]:
+        raise RuntimeError("сбой попытки %d" % job.attempts)
+    return {"attempt": job.attempts}
+
+
+@jobs.task("test_lease_check")
+def lease_check_task(job):
+    time.sleep(job.payload["seconds"])
+    leased = Job.objects.filter(pk=job.pk, locked_until__gt=timezone.now())
+    return {"leased": leased.exists()}
+
+
+class JobLeaseRenewalTests(TransactionTestCase):
+    """
+    Аренда продлевается из другого потока, поэтому без внешней транзакции
+    TestCase.
+    """
+
+    @override_settings(LIBAPP_JOB_LEASE_SECONDS=0.3)
+    def test_single_thread_worker_renews_lease(self):
+        job = jobs.enqueue("test_lease_check", {"seconds": 1})
+        stats = jobs.Worker(threads=0, name="test").run(once=True)
+        self.assertEqual(stats, {"done": 1, "failed": 0})
+        job.refresh_from_db()
+        self.assertEqual(job.result, {"leased": True})
+
+
+class JobTests(TemporaryMediaMixin, LibraryTestCase):
+    def run_jobs(self):
+        worker = jobs.Worker(threads=0, name="test")
+        with self.assertNoLogs("libapp.jobs"):
+            return worker.run(once=True)
+
+    def run_failing_jobs(self):
+        worker = jobs.Worker(threads=0, name="test")
+        with self.assertLogs("libapp.jobs", "ERROR") as logs:
+            stats = worker.run(once=True)
+        self.assertEqual(len(logs.records), stats["failed"])
+        return stats
+
+    def make_due(self, job):
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+
+    def test_retries_with_exponential_backoff(self):
+        job = jobs.enqueue("test_flaky", {"succeed_on": 3})
+        for attempt, delay in ((1, 10), (2, 20)):
+            started = timezone.now()
+            self.assertEqual(self.run_failing_jobs(), {"done": 0, "failed": 1})
+            job.refresh_from_db()
+            self.assertEqual((job.state, job.attempts), (Job.State.QUEUED, attempt))
+            self.assertIn("сбой попытки %d" % attempt, job.error)
+            wait = (job.run_at - started).total_seconds()
+            self.assertTrue(delay / 2 <= wait <= delay + 1, wait)
+            self.assertEqual(self.run_jobs(), {"done": 0, "failed": 0})
+            self.make_due(job)
+        self.assertEqual(self.run_jobs(), {"done": 1, "failed": 0})
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.state, job.result, job.error), (Job.State.DONE, {"attempt": 3}, "")
+        )
+
+    def test_fails_after_max_attempts(self):
+        job = jobs.enqueue("test_flaky", {"succeed_on": 9}, max_attempts=2)
+        self.run_failing_jobs()
+        self.make_due(job)
+        self.run_failing_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (Job.State.FAILED, 2))
+        self.assertIsNone(job.locked_until)
+
+    def test_lease_is_exclusive_until_it_expires(self):
+        job = jobs.enqueue("test_flaky", {"succeed_on": 1}, max_attempts=2)
+        [first] = jobs.claim("first")
+        self.assertEqual(jobs.claim("second"), [])
+        self.assertEqual(jobs.renew("first", [job.pk]), 1)
+
+        expired = timezone.now() - timedelta(seconds=1)
+        Job.objects.filter(pk=job.pk).update(locked_until=expired)
+        [second] = jobs.claim("second")
+        self.assertEqual(second.attempts, 2)
+        # Обработчик, потерявший аренду, не перезаписывает результат.
+        jobs.complete(first, "first", {"attempt": 1})
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.locked_by), (Job.State.RUNNING, "second"))
+
+        Job.objects.filter(pk=job.pk).update(locked_until=expired)
+        self.assertEqual(jobs.claim("third"), [])
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.State.FAILED)
+
+    def test_abandoned_import_removes_upload(self):
+        upload = SimpleUploadedFile("books.csv", b"author\n")
+        tasks.save_upload(upload, "abandoned.csv")
+        job = jobs.enqueue(
+            "import_library",
+            {"file": "abandoned.csv", "format": "csv"},
+            user=self.user,
+            max_attempts=1,
+        )
+        jobs.claim("first")
+        expired = timezone.now() - timedelta(seconds=1)
+        Job.objects.filter(pk=job.pk).update(locked_until=expired)
+        self.assertEqual(jobs.claim("second"), [])
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.State.FAILED)
+        self.assertEqual(os.listdir(settings.LIBAPP_JOB_ROOT), [])
+
+    def test_background_import_and_status_page(self):
+        upload = SimpleUploadedFile(
+            "books.csv", "author,series,name\nГоголь,Повести,Нос\n".encode()
+        )
+        response = self.client.post(
+            reverse("import_library"), {"file": upload, "background": "on"}
+        )
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse("show_job", args=(job.pk,)))
+        self.assertContains(self.client.get(response.url), "В очереди")
+
+        out = StringIO()
+        call_command("run_workers", once=True, threads=0, stdout=out)
+        self.assertIn("Выполнено: 1", out.getvalue())
+        self.assertTrue(Book.objects.filter(name="Нос", user=self.user).exists())
+        self.assertEqual(os.listdir(settings.LIBAPP_JOB_ROOT), [])
+        response = self.client.get(response.url)
+        self.assertContains(response, "книг: 1")
+        self.assertNotContains(response, 'http-equiv="refresh"')
+        self.assertContains(self.client.get(reverse("jobs")), "import_library")
+
+        other = get_user_model().objects.create_user("other", password="password")
+        self.client.force_login(other)
+        self.assertEqual(
+            self.client.get(response.request["PATH_INFO"]).status_code, 404
+        )
+
+    def test_maintenance_command_task(self):
+        out = StringIO()
+        call_command(
+            "enqueue_job", "command", '{"name": "recompute_counters"}', stdout=out
+        )
+        call_command(
+            "enqueue_job",
+            "command",
+            '{"name": "flush"}',
+            max_attempts=1,
+            stdout=out,
+        )
+        self.assertEqual(self.run_failing_jobs(), {"done": 1, "failed": 1})
+        done, failed = Job.objects.order_by("pk")
+        self.assertIn("исправлено", done.result["output"])
+        self.assertIn("нельзя запускать", failed.error)
+
+    def test_unknown_task_is_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue("missing")
+
+
+class FragmentCacheTests(LibraryTestCase):
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response.content.decode(), len(queries)
+
+    def check_invalidation(self):
+        url = reverse("show_series_book", args=(self.author.pk, self.series.pk))
+        other_url = reverse("show_author", args=(self.other_author.pk,))
+        content, cold = self.get(url)
+        self.assertIn("Книга", content)
+        content, warm = self.get(url)
+        self.assertIn("Книга", content)
+        self.assertLess(warm, cold)
+        self.get(other_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(
+                user=self.user, name="Свежая", series=self.series, is_completed=0
+            )
+        content, queries = self.get(url)
+        self.assertIn("Свежая", content)
+        self.assertEqual(queries, cold)
+        _, other_queries = self.get(other_url)
+        self.assertEqual(other_queries, warm)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.soft_delete()
+        content, _ = self.get(url)
+        self.assertNotIn(">Книга<", content)
+
+    def test_locmem_cache(self):
+        self.check_invalidation()
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = "django.core.cache.backends.filebased.FileBasedCache"
+            with self.settings(
+                CACHES={"default": {"BACKEND": backend, "LOCATION": location}},
+                LIBAPP_OBJECT_CACHE="default",
+            ):
+                self.check_invalidation()
+
+
+class ConditionalGetTests(LibraryTestCase):
+    def test_show_views_return_304_without_list_query(self):
+        urls = [
+            reverse("show_authors"),
+            reverse("show_author", args=(self.author.pk,)),
+            reverse("show_series_book", args=(self.author.pk, self.series.pk)),
+            reverse("show_book", args=(self.author.pk, self.series.pk, self.book.pk)),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag = response["ETag"]
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], etag)
+                self.assertLessEqual(len(queries), 3)
+
+    def test_child_change_updates_parent_timestamps(self):
+        url = reverse("show_series_book", args=(self.author.pk, self.series.pk))
+        etag = self.client.get(url)["ETag"]
+        author_updated = Author.objects.get(pk=self.author.pk).updated_at
+        book = Book.objects.get(pk=self.book.pk)
+        book.name = "Переименована"
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        self.assertGreater(
+            Author.objects.get(pk=self.author.pk).updated_at, author_updated
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Переименована")
+
+    def test_cascade_updates_timestamps(self):
+        etag = self.client.get(reverse("show_authors"))["ETag"]
+        self.series.soft_delete()
+        response = self.client.get(reverse("show_authors"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        url = reverse("show_author", args=(self.author.pk,))
+        last_modified = self.client.get(url)["Last-Modified"]
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+
+class ImportTests(LibraryTestCase):
+    CSV = (
+        "author,series,name,description,rating,is_completed\n"
+        "Автор,Серия,Новая книга,,7,да\n"
+        "Автор,Новая серия,Первая,Описание,5,нет\n"
+        "Толстой,Романы,Война и мир,,10,1\n"
+        "Толстой,Романы,Анна Каренина,,9,0\n"
+        ",Без автора,Пропуск,,1,0\n"
+        "Толстой,Романы,Плохая оценка,,11,0\n"
+    )
+
+    def chunks(self, text, size=7):
+        return [text[i : i + size] for i in range(0, len(text), size)]
+
+    def run_import(self, text, file_format, batch_size=2):
+        importer = LibraryImporter(self.user, batch_size=batch_size)
+        return importer.run(read_records(self.chunks(text), file_format))
+
+    def test_csv_import(self):
+        stats = self.run_import(self.CSV, "csv")
+        self.assertEqual(
+            (stats["rows"], stats["authors"], stats["series"], stats["books"]),
+            (6, 1, 2, 4),
+        )
+        self.assertEqual(stats["skipped"], 2)
+        self.assertEqual(Author.objects.filter(name="Толстой").count(), 1)
+        self.assertEqual(SeriesBook.objects.filter(name="Романы").count(), 1)
+        self.assertEqual(Book.objects.filter(series=self.series).count(), 2)
+        tolstoy = Author.objects.get(name="Толстой")
+        self.assertEqual(
+            (tolstoy.series_count, tolstoy.book_count, tolstoy.rating_sum),
+            (1, 2, 19),
+        )
+        self.author.refresh_from_db()
+        self.assertEqual((self.author.series_count, self.author.book_count), (2, 3))
+        results, _ = search("каренина")
+        self.assertEqual(results[0]["object"].name, "Анна Каренина")
+
+    def test_json_and_jsonl_import(self):
+        records = [
+            {"author": "Пушкин", "series": "Повести", "name": "Метель", "rating": 8},
+            {"author": "Пушкин", "series": "Повести", "name": "Выстрел"},
+        ]
+        stats = self.run_import(json.dumps(records, ensure_ascii=False), "json")
+        self.assertEqual((stats["authors"], stats["books"]), (1, 2))
+        jsonl = "\n".join(json.dumps(r, ensure_ascii=False) for r in records)
+        stats = self.run_import(jsonl, "jsonl")
+        self.assertEqual((stats["authors"], stats["series"], stats["books"]), (0, 0, 2))
+        self.assertEqual(Book.objects.filter(series__author__name="Пушкин").count(), 4)
+
+    def test_broken_json(self):
+        with self.assertRaises(RecordError):
+            self.run_import('[{"author": "А"', "json")
+
+    def test_queries_per_batch_are_constant(self):
+        def count(rows):
+            text = "author,series,name\n" + "".join(
+                "А%d-%d,С%d,К%d\n" % (rows, i % 3, i % 3, i) for i in range(rows)
+            )
+            with CaptureQueriesContext(connection) as queries:
+                self.run_import(text, "csv", batch_size=1000)
+            return len(queries)
+
+        self.assertEqual(count(20), count(80))
+
+    def test_malformed_csv_is_a_form_error(self):
+        huge = 'author,series,name\nАвтор,Серия,"%s"\n' % ("x" * 200000)
+        for content in ("author,series\nАв\rтор,Серия\n", huge):
+            with self.subTest(size=len(content)):
+                upload = SimpleUploadedFile("books.csv", content.encode())
+                response = self.client.post(reverse("import_library"), {"file": upload})
+                self.assertEqual(response.status_code, 200)
+                self.assertIn("Строка", response.context["form"].errors["file"][0])
+
+    def test_command_reports_bad_encoding(self):
+        with tempfile.NamedTemporaryFile("wb", suffix=".csv", delete=False) as f:
+            f.write("author\nАвтор\n".encode("cp1251"))
+        self.addCleanup(os.unlink, f.name)
+        with self.assertRaisesMessage(CommandError, "UTF-8"):
+            call_command("import_library", f.name, user="reader", stdout=StringIO())
+
+    def test_upload_view_and_command(self):
+        upload = SimpleUploadedFile("books.csv", self.CSV.encode("utf-8-sig"))
+        response = self.client.post(reverse("import_library"), {"file": upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["stats"]["books"], 4)
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            f.write('{"author": "Гоголь", "series": "Сборник", "name": "Нос"}\n')
+        out = StringIO()
+        call_command("import_library", f.name, user="reader", stdout=out)
+        os.unlink(f.name)
+        self.assertIn("книг: 1", out.getvalue())
+        self.assertTrue(Book.objects.filter(name="Нос").exists())
+
+
+class ExportTests(LibraryTestCase):
+    def export(self, **params):
+        response = self.client.get(reverse("export_library"), params)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def test_csv_round_trip(self):
+        Author.objects.create(user=self.user, name="Без серий")
+        SeriesBook.objects.filter(pk=self.series.pk).update(
+            description="О серии", rating=7, is_completed=True
+        )
+        data = self.export(format="csv").decode()
+        self.assertEqual(
+            data.splitlines(),
+            [
+                "author,series,name,description,rating,is_completed,"
+                "series_description,series_rating,series_is_completed",
+                "Автор,Серия,Книга,,0,1,О серии,7,1",
+                "Другой,Другая серия,,,,,,0,0",
+                "Без серий,,,,,,,,",
+            ],
+        )
+        other = get_user_model().objects.create_user(username="other")
+        stats = LibraryImporter(other).run(read_records([data], "csv"))
+        self.assertEqual(
+            (stats["authors"], stats["series"], stats["books"], stats["skipped"]),
+            (3, 2, 1, 0),
+        )
+
+        def series(user):
+            rows = SeriesBook.objects.filter(user=user).order_by("name")
+            return [
+                (s.name, s.description or "", s.rating, s.is_completed) for s in rows
+            ]
+
+        self.assertEqual(series(other), series(self.user))
+
+    def test_jsonl_gzip(self):
+        data = gzip.decompress(self.export(format="jsonl", gzip="1"))
+        records = [json.loads(line) for line in data.decode().splitlines()]
+        self.assertEqual(records[0]["name"], "Книга")
+        self.assertIs(records[0]["is_completed"], True)
+
+    def test_deleted_rows_and_other_users_are_skipped(self):
+        self.series.soft_delete()
+        other = get_user_model().objects.create_user(username="other")
+        Author.objects.create(user=other, name="Чужой")
+        data = self.export(format="jsonl").decode()
+        self.assertNotIn("Серия", data)
+        self.assertNotIn("Чужой", data)
+        self.assertIn("Другая серия", data)
+
+    def test_round_trip_keeps_line_separators_inside_values(self):
+        description = "а\u2028б\u2029в\x85г\x0bд\x0cе\x1cж\x1dз\x1eи\r\nк\nл"
+        records = [
+            {"author": "Автор", "series": "Серия", "name": "Книга %d" % i}
+            for i in range(3)
+        ]
+        records[1]["description"] = description
+        for file_format, writer in exporter.WRITERS.items():
+            with self.subTest(file_format=file_format):
+                data = "".join(writer(records))
+                # Куски по 5 символов: разделители попадают и на их границы.
+                chunks = [data[i : i + 5] for i in range(0, len(data), 5)]
+                read = list(read_records(chunks, file_format))
+                self.assertEqual(
+                    [r["name"] for r in read], ["Книга 0", "Книга 1", "Книга 2"]
+                )
+                self.assertEqual(read[1]["description"], description)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("export_library", user="reader", format="jsonl", stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse("export_library"), {"format": "xml"})
+        self.assertEqual(response.status_code, 404)
+
+
+class BulkInsertTests(LibraryTestCase):
+    """Путь MySQL: база не возвращает pk из многострочного INSERT."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(
+            type(connection.features),
+            "can_return_rows_from_bulk_insert",
+            new_callable=mock.PropertyMock,
+            return_value=False,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def concurrent_insert(self, execute, sql, params, many, context):
+        # Книга того же пользователя, вставленная между чтением Max(pk) и
+        # многострочным INSERT, как параллельная задача импорта.
+        if sql.startswith('INSERT INTO "libapp_book"') and not self.inserted:
+            self.inserted = True
+            Book.objects.create(
+                user=self.user, series=self.series, name="Чужая", is_completed=False
+            )
+        return execute(sql, params, many, context)
+
+    def test_concurrent_insert_is_not_returned(self):
+        self.inserted = False
+        books = [
+            Book(user=self.user, series=self.series, name=name, is_completed=False)
+            for name in ("Первая", "Вторая")
+        ]
+        with connection.execute_wrapper(self.concurrent_insert):
+            created = bulk_create_and_notify(Book, books, user=self.user)
+        self.assertTrue(self.inserted)
+        self.assertEqual([b.name for b in created], ["Первая", "Вторая"])
+        self.series.refresh_from_db()
+        self.assertEqual(self.series.book_count, 4)
+
+
+class BatchApiTests(LibraryTestCase):
+    def post(self, kind, payload):
+        return self.client.post(
+            reverse("api_batch", args=(kind,)),
+            json.dumps(payload),
+            content_type="application/json",
+        )
+
+    def test_create_update_delete_books(self):
+        extra = Book.objects.create(
+            user=self.user, name="Удаляемая", series=self.series, is_completed=0
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(
+                "books",
+                {
+                    "create": [
+                        {
+                            "series": self.series.pk,
+                            "name": "Первая",
+                            "rating": 7,
+                            "is_completed": False,
+                        },
+                        {"series": self.series.pk, "name": "", "rating": 5},
+                        {
+                            "series": self.other_series.pk,
+                            "name": "Вторая",
+                            "rating": 2,
+                            "is_completed": True,
+                        },
+                        {"series": 999999, "name": "Без серии"},
+                    ],
+                    "update": [
+                        {"id": self.book.pk, "rating": 9, "is_completed": False},
+                        {"id": self.book.pk + 1000, "rating": 1},
+                    ],
+                    "delete": [extra.pk],
+                },
+            )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        created = results["create"]
+        self.assertEqual([("id" in r) for r in created], [True, False, True, False])
+        self.assertIn("name", created[1]["errors"])
+        self.assertIn("__all__", created[3]["errors"])
+        self.assertEqual(results["update"][0], {"id": self.book.pk})
+        self.assertIn("errors", results["update"][1])
+        self.assertEqual(results["delete"], [{"id": extra.pk}])
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating, self.book.is_completed), (9, False))
+        self.series.refresh_from_db()
+        self.assertEqual((self.series.book_count, self.series.rating_sum), (2, 16))
+        self.assertEqual(self.series.completed_count, 0)
+        results, _ = search("первая")
+        self.assertEqual(results[0]["object"].pk, created[0]["id"])
+
+    def test_query_count_does_not_grow_with_items(self):
+        def count(rows):
+            payload = {
+                "create": [
+                    {
+                        "series": self.series.pk,
+                        "name": "К%d" % i,
+                        "rating": 1,
+                        "is_completed": 0,
+                    }
+                    for i in range(rows)
+                ],
+                "update": [{"id": self.book.pk, "rating": rows % 10}],
+            }
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post("books", payload).status_code, 200)
+            return len(queries)
+
+        self.assertEqual(count(2), count(20))
+
+    def test_series_and_authors(self):
+        response = self.post(
+            "series_books",
+            {
+                "create": [
+                    {
+                        "author": self.author.pk,
+                        "name": "Новая",
+                        "rating": 3,
+                        "is_completed": True,
+                    }
+                ],
+                "update": [{"id": self.series.pk, "name": "Переименована"}],
+            },
+        )
+        self.assertEqual(len(response.json()["results"]["create"]), 1)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.series_count, 2)
+        self.series.refresh_from_db()
+        self.assertEqual(self.series.name, "Переименована")
+        response = self.post("authors", {"delete": [self.author.pk]})
+        self.assertEqual(response.json()["results"]["delete"], [{"id": self.author.pk}])
+        self.assertFalse(Book.undeleted.filter(pk=self.book.pk).exists())
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post("shelves", {}).status_code, 400)
+        self.assertEqual(self.post("books", {"create": {}}).status_code, 400)
+        response = self.client.post(
+            reverse("api_batch", args=("books",)),
+            "{",
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+ASYNC_URLCONF = (
+    path("", include(read_patterns(async_views))),
+    path("", include("libapp.urls")),
+    path("users/", include("users.urls", namespace="users")),
+)
+
+
+@override_settings(ROOT_URLCONF=ASYNC_URLCONF)
+class AsyncViewTests(LibraryTestCase):
+    def urls(self):
+        a, s, b = self.author.pk, self.series.pk, self.book.pk
+        return [
+            reverse("show_authors"),
+            reverse("show_author", args=(a,)),
+            reverse("show_series_book", args=(a, s)),
+            reverse("show_book", args=(a, s, b)),
+        ]
+
+    async def test_pages_render_with_async_orm(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("main_page"))
+        self.assertContains(response, "reader")
+        for url in self.urls():
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, "Автор")
+                etag = response["ETag"]
+                response = await self.async_client.get(
+                    url, headers={"if-none-match": etag}
+                )
+                self.assertEqual(response.status_code, 304)
+
+    async def test_login_required(self):
+        for url in self.urls():
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 302)
+                self.assertIn(reverse("users:login"), response["Location"])
+
+    async def test_broken_chain(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse("show_series_book", args=(self.other_author.pk, self.series.pk))
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_cached_fragment_skips_list_query(self):
+        url = reverse("show_author", args=(self.author.pk,))
+
+        def list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertContains(self.client.get(url), "Серия")
+            order = 'ORDER BY "libapp_seriesbook"."name"'
+            return [q for q in queries if order in q["sql"]]
+
+        self.assertEqual(len(list_queries()), 1)
+        self.assertEqual(list_queries(), [])
+
+    async def test_fragment_evicted_after_lookup(self):
+        # Фрагмент пропадает из кэша сразу после того, как представление
+        # его прочитало: страница выводится из прочитанного значения, без
+        # синхронного запроса списка.
+        url = reverse("show_author", args=(self.author.pk,))
+        await self.async_client.aforce_login(self.user)
+        expected = (await self.async_client.get(url)).content
+        backend = type(caches["default"])
+        aget = backend.aget
+
+        async def aget_and_evict(cache, key, *args, **kwargs):
+            value = await aget(cache, key, *args, **kwargs)
+            await cache.adelete(key)
+            return value
+
+        with mock.patch.object(backend, "aget", aget_and_evict):
+            response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected)
+
+    def test_fragment_key_matches_template(self):
+        for url, view in [
+            (reverse("show_authors"), views.ShowAuthors),
+            (reverse("show_author", args=(self.author.pk,)), views.ShowAuthor),
+        ]:
+            with self.subTest(url=url):
+                cache.clear()
+                self.client.get(url, {"sort": "-name"})
+                request = RequestFactory().get(url, {"sort": "-name"})
+                request.user = self.user
+                instance = view()
+                instance.setup(request, **resolve(url).kwargs)
+                instance.object_list = instance.get_queryset()
+                context = instance.get_context_data()
+                self.assertIsNotNone(cache.get(instance.fragment_key(context)))
+
+    def test_same_page_as_sync_view(self):
+        for url in self.urls():
+            with self.subTest(url=url):
+                async_content = self.client.get(url).content
+                with override_settings(ROOT_URLCONF="library.urls"):
+                    self.assertEqual(self.client.get(url).content, async_content)
+
+
+@override_settings(
+    LIBAPP_SQL_INSTRUMENTATION=True,
+    LIBAPP_SQL_SERVER_TIMING=True,
+    LIBAPP_SQL_TRACE_THRESHOLD=1000,
+)
+class QueryInstrumentationTests(LibraryTestCase):
+    def records(self, url):
+        with self.assertLogs("libapp.sql", "INFO") as logs:
+            response = self.client.get(url)
+        return response, [json.loads(r.getMessage()) for r in logs.records]
+
+    def test_records_queries_per_request(self):
+        url = reverse("show_author", args=(self.author.pk,))
+        response, records = self.records(url)
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record["view"], "show_author")
+        self.assertEqual(record["status"], 200)
+        self.assertGreater(record["queries"], 0)
+        self.assertLessEqual(record["db_ms"], record["total_ms"])
+        self.assertEqual(record["duplicates"], [])
+        self.assertIn("db;dur=", response["Server-Timing"])
+
+    def test_detects_n_plus_one(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for book in Book.objects.all():
+                book.series.author.name
+            Author.objects.get(pk=self.author.pk)
+        duplicates = recorder.duplicates()
+        self.assertEqual(duplicates[0]["count"], 2)
+        self.assertEqual(duplicates[0]["exact_repeats"], 1)
+        self.assertIn("test_detects_n_plus_one", recorder.stacks[duplicates[0]["sql"]])
+
+    def test_traces_above_threshold(self):
+        with override_settings(LIBAPP_SQL_TRACE_THRESHOLD=1):
+            with self.assertLogs("libapp.sql", "WARNING") as logs:
+                self.client.get(reverse("show_authors"))
+        self.assertIn("traces", json.loads(logs.records[0].getMessage()))
+
+    def test_sql_template(self):
+        self.assertEqual(
+            sql_template("SELECT 1 FROM t WHERE a = 'x' AND b IN (%s, %s, %s)"),
+            "SELECT %s FROM t WHERE a = %s AND b IN (%s...)",
+        )
+
+
+class QueueFileHandlerTests(TestCase):
+    def test_writes_json_and_compresses_rotated_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "app.log")
+            handler = QueueFileHandler(filename, maxBytes=2000, backupCount=2)
+            logger = logging.Logger("libapp.tests.queue")
+            logger.addHandler(handler)
+            for i in range(50):
+                logger.info("запись %d", i, extra={"status_code": 200})
+            try:
+                1 / 0
+            except ZeroDivisionError:
+                logger.exception("ошибка")
+            handler.close()
+
+            with open(filename, encoding="utf-8") as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(records[-1]["message"], "ошибка")
+            self.assertIn("ZeroDivisionError", records[-1]["exc"])
+            self.assertEqual(records[0]["status_code"], 200)
+            with gzip.open(filename + ".1.gz", "rt", encoding="utf-8") as f:
+                self.assertTrue(
+                    json.loads(f.readline())["message"].startswith("запись")
+                )
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                ["app.log", "app.log.1.gz", "app.log.2.gz"],
+            )
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Реплика - отдельный файл SQLite со своими данными: по числу авторов
+    видно, с какой базы пришло чтение. Базы подключаются в setUpClass,
+    чтобы тестовый раннер не пытался создавать для них тестовые копии.
+    TransactionTestCase, потому что внутри транзакции default роутер
+    намеренно читает с default.
+    """
+
+    @classmethod
+    def add_database(cls, alias, name):
+        connections.settings[alias] = connections.configure_settings(
+            {
+                DEFAULT_DB_ALIAS: {"ENGINE": "django.db.backends.dummy"},
+                alias: {"ENGINE": "django.db.backends.sqlite3", "NAME": name},
+            }
+        )[alias]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.add_database("replica", os.path.join(cls.directory.name, "replica.db"))
+        cls.databases = cls.databases | {"replica"}
+        call_command("migrate", database="replica", verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        replicas._down_until.clear()
+        self.factory = RequestFactory()
+        user = get_user_model().objects.db_manager("replica").create_user("r")
+        Author.objects.using("replica").bulk_create(
+            [Author(user=user, name="На реплике %d" % i) for i in range(2)]
+        )
+
+    def request(self, method="get", view=None, **cookies):
+        """Прогоняет запрос через middleware; в ответе - число авторов."""
+
+        def count(request):
+            return HttpResponse(str(Author.objects.count()))
+
+        view = view or count
+        request = getattr(self.factory, method)("/")
+        request.COOKIES.update(cookies)
+        return replicas.ReplicaMiddleware(view)(request)
+
+    def test_get_reads_from_replica(self):
+        response = self.request()
+        self.assertEqual(response.content, b"2")
+        self.assertNotIn(replicas.COOKIE_NAME, response.cookies)
+
+    def test_post_reads_and_writes_primary_and_pins_client(self):
+        response = self.request("post")
+        self.assertEqual(response.content, b"0")
+        cookie = response.cookies[replicas.COOKIE_NAME]
+        self.assertEqual(cookie["max-age"], 10)
+
+        self.assertEqual(
+            self.request(**{replicas.COOKIE_NAME: cookie.value}).content, b"0"
+        )
+        expired = {replicas.COOKIE_NAME: str(int(time.time()) - 1)}
+        self.assertEqual(self.request(**expired).content, b"2")
+        self.assertEqual(self.request(**{replicas.COOKIE_NAME: "x"}).content, b"2")
+
+    def test_replica_reads_do_not_fill_shared_caches(self):
+        user = get_user_model().objects.create_user("p")
+        primary = Author.objects.create(user=user, name="На основной")
+        pks = list(Author.objects.using("replica").values_list("pk", flat=True))
+        object_cache.clear()
+
+        def view(request):
+            found = Author.cached.get_many([*pks, primary.pk])
+            timeout = cache_versions.fragment_timeout()
+            return HttpResponse("%d %d" % (len(found), timeout))
+
+        # С реплики: ничего не кэшируется, и фрагменты тоже.
+        self.assertEqual(self.request(view=view).content, b"2 0")
+        self.assertEqual(Author.cached.peek_many([*pks, primary.pk]), {})
+        # Клиент после записи читает с default: кэши заполняются.
+        pinned = {replicas.COOKIE_NAME: str(int(time.time()) + 10)}
+        response = self.request(view=view, **pinned)
+        self.assertEqual(response.content, b"1 %d" % cache_versions.FRAGMENT_TIMEOUT)
+        self.assertEqual(list(Author.cached.peek_many([primary.pk])), [primary.pk])
+
+    def test_writes_always_go_to_primary(self):
+        router = replicas.ReplicaRouter()
+        self.assertEqual(router.db_for_write(Author), DEFAULT_DB_ALIAS)
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(Author.objects.count(), 0)
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        replica = connections["replica"]
+        replica.close()
+        name = replica.settings_dict["NAME"]
+        replica.settings_dict["NAME"] = os.path.join(self.directory.name, "no", "db")
+        try:
+            self.assertEqual(self.request().content, b"0")
+        finally:
+            replica.settings_dict["NAME"] = name
+        self.assertTrue(replicas.is_down("replica"))
+        # Пока не истёк REPLICA_RETRY_SECONDS, реплику не пробуют снова.
+        self.assertEqual(self.request().content, b"0")
+        with override_settings(REPLICA_RETRY_SECONDS=0):
+            replicas.mark_down("replica")
+            self.assertEqual(self.request().content, b"2")
+
+    def test_replica_error_mid_request_is_retried_on_primary(self):
+        def moved_table(sql):
+            with connections["replica"].cursor() as cursor:
+                cursor.execute(sql)
+
+        def handler(request):
+            # Как BaseHandler: ошибка представления передаётся в
+            # process_exception, без ответа от него - ответ 500.
+            try:
+                return HttpResponse(str(Author.objects.count()))
+            except OperationalError as e:
+                response = middleware.process_exception(request, e)
+                return response or HttpResponse("500", status=500)
+
+        self.assertEqual(self.request().content, b"2")
+        moved_table("ALTER TABLE libapp_author RENAME TO libapp_author_moved")
+        try:
+            self.assertEqual(self.request().content, b"0")
+            self.assertTrue(replicas.is_down("replica"))
+            replicas._down_until.clear()
+            connections["replica"].close()
+            middleware = replicas.ReplicaMiddleware(handler)
+            response = middleware(self.factory.get("/"))
+            self.assertEqual((response.status_code, response.content), (200, b"0"))
+            self.assertTrue(replicas.is_down("replica"))
+        finally:
+            moved_table("ALTER TABLE libapp_author_moved RENAME TO libapp_author")
+
+    def test_primary_errors_are_not_retried(self):
+        def view(request):
+            Author.objects.count()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT * FROM missing_table")
+
+        with self.assertRaises(OperationalError):
+            self.request(view=view)
+        self.assertFalse(replicas.is_down("replica"))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_disabled_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            replicas.ReplicaMiddleware(HttpResponse)
+
+
+class SqlitePragmaTests(TestCase):
+    def connect(self, directory):
+        alias = "pragmas"
+        settings_dict = connections.configure_settings(
+            {
+                DEFAULT_DB_ALIAS: {"ENGINE": "django.db.backends.dummy"},
+                alias: {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": os.path.join(directory, "db.sqlite3"),
+                },
+            }
+        )[alias]
+        return SQLiteDatabaseWrapper(settings_dict, alias)
+
+    def pragmas(self, connection):
+        with connection.cursor() as cursor:
+            values = {}
+            for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size"):
+                cursor.execute("PRAGMA %s" % name)
+                values[name] = cursor.fetchone()[0]
+        connection.close()
+        return values
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(
+                LIBAPP_SQLITE_PRAGMAS={
+                    "journal_mode": "wal",
+                    "synchronous": "normal",
+                    "busy_timeout": 1234,
+                    "cache_size": -2000,
+                }
+            ):
+                values = self.pragmas(self.connect(directory))
+        self.assertEqual(
+            values,
+            {
+                "journal_mode": "wal",
+                "synchronous": 1,
+                "busy_timeout": 1234,
+                "cache_size": -2000,
+            },
+        )
+
+    @override_settings(LIBAPP_SQLITE_PRAGMAS={})
+    def test_stock_connection(self):
+        with tempfile.TemporaryDirectory() as directory:
+            values = self.pragmas(self.connect(directory))
+        self.assertEqual(values["journal_mode"], "delete")
+        self.assertEqual(values["synchronous"], 2)
+
+
+# Время проверяется, только если задан множитель бюджетов: на общих
+# машинах CI оно нестабильно, а число запросов проверяется всегда.
+TIME_BUDGET_SCALE = os.environ.get("LIBAPP_TIME_BUDGET_SCALE")
+
+
+class RouteBudgetTests(TemporaryMediaMixin, TestCase):
+    """
+    Бюджеты числа SQL-запросов и времени ответа для каждого маршрута
+    libapp.urls на синтетических данных seed_library (SQLite), для форм -
+    и для POST. Время - лучшее из трёх запросов с пустым кэшем; оно
+    проверяется, только если задана переменная LIBAPP_TIME_BUDGET_SCALE
+    (множитель бюджетов, 1 - как есть).
+    """
+
+    # Маршрут: (число запросов, миллисекунды).
+    BUDGETS = {
+        "main_page": (4, 50),
+        "add_author": (2, 50),
+        "add_series_book": (3, 50),
+        "add_book": (3, 50),
+        "show_authors": (4, 100),
+        "search": (5, 200),
+        "import_library": (2, 50),
+        "import_book_files": (4, 50),
+        "jobs": (3, 50),
+        "show_job": (3, 50),
+        "export_library": (5, 1000),
+        "api_batch": (15, 150),
+        "object_cache_stats": (2, 50),
+        "cover": (0, 50),
+        "show_author": (5, 100),
+        "show_series_book": (5, 100),
+        "show_book": (5, 50),
+        "upload_book_file": (3, 50),
+        "download_book_file": (4, 50),
+        "delete_book_file": (4, 50),
+        "edit_author_page": (3, 50),
+        "edit_series_book_page": (3, 50),
+        "edit_book_page": (3, 50),
+        "delete_author_page": (4, 50),
+        "delete_series_book_page": (4, 50),
+        "delete_book_page": (3, 50),
+    }
+    # POST маршрутов, изменяющих данные: (число запросов, миллисекунды).
+    WRITE_BUDGETS = {
+        "add_author": (4, 50),
+        "add_series_book": (7, 50),
+        "add_book": (9, 50),
+        "import_library": (18, 100),
+        "import_book_files": (7, 50),
+        "upload_book_file": (9, 50),
+        "delete_book_file": (7, 50),
+        "edit_author_page": (8, 50),
+        "edit_series_book_page": (9, 50),
+        "edit_book_page": (14, 50),
+        "delete_author_page": (24, 100),
+        "delete_series_book_page": (19, 100),
+        "delete_book_page": (13, 50),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_library(users=2, authors=300, series=1500, books=7500, prefix="budget")
+        cls.user = get_user_model().objects.get(username="budget0")
+        cls.user.is_staff = True
+        cls.user.save()
+        cls.author = Author.objects.filter(user=cls.user).order_by("pk").first()
+        cls.series = cls.author.seriesbook_set.order_by("pk").first()
+        cls.book = cls.series.book_set.order_by("pk").first()
+        cls.cover = covers.store(image_upload())
+        cls.file = make_book_file(cls.book)
+        cls.job = Job.objects.create(user=cls.user, kind="command")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def requests(self):
+        a, s, b = self.author.pk, self.series.pk, self.book.pk
+        batch = json.dumps({"update": [{"id": b, "rating": 5}]})
+        return {
+            "main_page": ("get", reverse("main_page"), {}),
+            "add_author": ("get", reverse("add_author"), {}),
+            "add_series_book": ("get", reverse("add_series_book", args=(a,)), {}),
+            "add_book": ("get", reverse("add_book", args=(a, s)), {}),
+            "show_authors": ("get", reverse("show_authors"), {}),
+            "search": ("get", reverse("search"), {"data": {"q": "война мир"}}),
+            "import_library": ("get", reverse("import_library"), {}),
+            "import_book_files": ("get", reverse("import_book_files"), {}),
+            "jobs": ("get", reverse("jobs"), {}),
+            "show_job": ("get", reverse("show_job", args=(self.job.pk,)), {}),
+            "export_library": ("get", reverse("export_library"), {}),
+            "object_cache_stats": ("get", reverse("object_cache_stats"), {}),
+            "cover": ("get", covers.url(self.cover, 64, "webp"), {}),
+            "api_batch": (
+                "post",
+                reverse("api_batch", args=("books",)),
+                {"data": batch, "content_type": "application/json"},
+            ),
+            "show_author": ("get", reverse("show_author", args=(a,)), {}),
+            "show_series_book": (
+                "get",
+                reverse("show_series_book", args=(a, s)),
+                {},
+            ),
+            "show_book": ("get", reverse("show_book", args=(a, s, b)), {}),
+            "upload_book_file": (
+                "get",
+                reverse("upload_book_file", args=(a, s, b)),
+                {},
+            ),
+            "download_book_file": (
+                "get",
+                reverse("download_book_file", args=(a, s, b, self.file.pk)),
+                {},
+            ),
+            "delete_book_file": (
+                "get",
+                reverse("delete_book_file", args=(a, s, b, self.file.pk)),
+                {},
+            ),
+            "edit_author_page": (
+                "get",
+                reverse("edit_author_page", args=(a, "author", a)),
+                {},
+            ),
+            "edit_series_book_page": (
+                "get",
+                reverse("edit_series_book_page", args=(a, s, "series_book", s)),
+                {},
+            ),
+            "edit_book_page": (
+                "get",
+                reverse("edit_book_page", args=(a, s, b, "book", b)),
+                {},
+            ),
+            "delete_author_page": (
+                "get",
+                reverse("delete_author_page", args=(a, "author")),
+                {},
+            ),
+            "delete_series_book_page": (
+                "get",
+                reverse("delete_series_book_page", args=(a, s, "series_book")),
+                {},
+            ),
+            "delete_book_page": (
+                "get",
+                reverse("delete_book_page", args=(a, s, b, "book")),
+                {},
+            ),
+        }
+
+    def writes(self):
+        """POST-запросы: маршрут -> (URL, функция данных, код ответа)."""
+        a, s, b = self.author.pk, self.series.pk, self.book.pk
+        book = {
+            "name": "Новая книга",
+            "description": "",
+            "rating": 5,
+            "is_completed": 1,
+        }
+        delete = {"delete_button": "delete"}
+        return {
+            "add_author": (reverse("add_author"), lambda: {"name": "Новый"}, 302),
+            "add_series_book": (
+                reverse("add_series_book", args=(a,)),
+                lambda: {**book, "name": "Новая серия"},
+                302,
+            ),
+            "add_book": (reverse("add_book", args=(a, s)), lambda: book, 302),
+            "import_library": (
+                reverse("import_library"),
+                lambda: {
+                    "file": SimpleUploadedFile(
+                        "books.csv", "author,series,name\nГоголь,Повести,Нос\n".encode()
+                    )
+                },
+                200,
+            ),
+            "import_book_files": (
+                reverse("import_book_files"),
+                lambda: {"file": SimpleUploadedFile("book.fb2", FB2)},
+                302,
+            ),
+            "upload_book_file": (
+                reverse("upload_book_file", args=(a, s, b)),
+                lambda: {"file": SimpleUploadedFile("new.pdf", b"%PDF-1.4 new")},
+                302,
+            ),
+            "delete_book_file": (
+                reverse("delete_book_file", args=(a, s, b, self.file.pk)),
+                lambda: delete,
+                302,
+            ),
+            "edit_author_page": (
+                reverse("edit_author_page", args=(a, "author", a)),
+                lambda: {"name": "Переименован"},
+                302,
+            ),
+            "edit_series_book_page": (
+                reverse("edit_series_book_page", args=(a, s, "series_book", s)),
+                lambda: {**book, "name": "Переименована"},
+                302,
+            ),
+            "edit_book_page": (
+                reverse("edit_book_page", args=(a, s, b, "book", b)),
+                lambda: {**book, "name": "Переименована"},
+                302,
+            ),
+            "delete_author_page": (
+                reverse("delete_author_page", args=(a, "author")),
+                lambda: delete,
+                302,
+            ),
+            "delete_series_book_page": (
+                reverse("delete_series_book_page", args=(a, s, "series_book")),
+                lambda: delete,
+                302,
+            ),
+            "delete_book_page": (
+                reverse("delete_book_page", args=(a, s, b, "book")),
+                lambda: delete,
+                302,
+            ),
+        }
+
+    def measure(self, method, url, kwargs, status=200):
+        """
+        kwargs - аргументы запроса или функция, которая их создаёт (файлы
+        загрузки читаются один раз). Каждый повтор откатывается, поэтому
+        изменения данных повторяются на тех же строках.
+        """
+        timings = []
+        for _ in range(3):
+            cache.clear()
+            object_cache.clear()
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = getattr(self.client, method)(
+                        url, **(kwargs() if callable(kwargs) else kwargs)
+                    )
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                    timings.append(time.perf_counter() - started)
+                transaction.set_rollback(True)
+            self.assertEqual(response.status_code, status, url)
+            if len(timings) == 1:
+                count = len(queries)
+        return count, min(timings) * 1000
+
+    def assertWithinBudget(self, count, ms, max_queries, max_ms):
+        self.assertLessEqual(count, max_queries)
+        if TIME_BUDGET_SCALE:
+            self.assertLessEqual(ms, max_ms * float(TIME_BUDGET_SCALE))
+
+    def test_every_route_has_a_budget(self):
+        names = {p.name for p in urls.urlpatterns}
+        self.assertEqual(names, set(self.BUDGETS))
+        self.assertEqual(names, set(self.requests()))
+        self.assertEqual(set(self.WRITE_BUDGETS), set(self.writes()))
+
+    def test_seeded_counters_are_consistent(self):
+        out = StringIO()
+        call_command("recompute_counters", dry_run=True, stdout=out)
+        self.assertIn("SeriesBook: исправлено 0", out.getvalue())
+        self.assertIn("Author: исправлено 0", out.getvalue())
+        self.assertEqual(Book.objects.filter(user=self.user).count(), 3750)
+        self.assertEqual(stats.dashboard(self.user)["total"], 3750)
+
+    def test_route_budgets(self):
+        for name, (method, url, kwargs) in self.requests().items():
+            max_queries, max_ms = self.BUDGETS[name]
+            with self.subTest(route=name):
+                count, ms = self.measure(method, url, kwargs)
+                self.assertWithinBudget(count, ms, max_queries, max_ms)
+
+    def test_write_budgets(self):
+        for name, (url, data, status) in self.writes().items():
+            max_queries, max_ms = self.WRITE_BUDGETS[name]
+            with self.subTest(route=name):
+                kwargs = lambda: {"data": data()}
+                count, ms = self.measure("post", url, kwargs, status)
+                self.assertWithinBudget(count, ms, max_queries, max_ms)
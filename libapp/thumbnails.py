@@ -0,0 +1,56 @@
+"""
+Уменьшение обложек. Модуль не зависит от Django: функции выполняются
+в отдельных процессах пула (libapp.covers), куда передаются только пути.
+"""
+
+import os
+import tempfile
+
+from PIL import Image, ImageOps
+
+# Соотношение сторон обложки: ширина 2, высота 3.
+ASPECT = (2, 3)
+FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+
+
+def height_for(width):
+    return width * ASPECT[1] // ASPECT[0]
+
+
+def thumbnail_name(width, extension):
+    return "%d.%s" % (width, extension)
+
+
+def write_atomic(image, path, image_format, quality):
+    """Пишет во временный файл и переименовывает: файл не виден недописанным."""
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, image_format, quality=quality, optimize=True)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def make_thumbnails(source, directory, widths, quality=80):
+    """
+    Обрезает изображение source до пропорций ASPECT и сохраняет в directory
+    уменьшенные копии каждой ширины из widths в WebP и JPEG. Уже
+    существующие файлы не перезаписываются. Возвращает имена созданных.
+    """
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        created = []
+        for width in widths:
+            size = (width, height_for(width))
+            thumbnail = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+            for extension, image_format in FORMATS.items():
+                name = thumbnail_name(width, extension)
+                path = os.path.join(directory, name)
+                if os.path.exists(path):
+                    continue
+                write_atomic(thumbnail, path, image_format, quality)
+                created.append(name)
+    return created
@@ -1,9 +1,32 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+
+def read_patterns(read_views):
+    """Страницы просмотра; под ASGI подставляются async-варианты."""
+    return [
+        path("", read_views.main_page, name="main_page"),
+        path("authors/", read_views.ShowAuthors.as_view(), name="show_authors"),
+        path(
+            "author/<int:author_id>/series_book/",
+            read_views.ShowAuthor.as_view(),
+            name="show_author",
+        ),
+        path(
+            "author/<int:author_id>/series_book/<int:series_book_id>/books",
+            read_views.ShowSeriesBook.as_view(),
+            name="show_series_book",
+        ),
+        path(
+            "author/<int:author_id>/series_book/<int:series_book_id>/book/<int:book_id>/",
+            read_views.ShowBook.as_view(),
+            name="show_book",
+        ),
+    ]
 
 
 urlpatterns = [
-    path("", views.main_page, name="main_page"),
     path("add_author/", views.CreateAuthor.as_view(), name="add_author"),
     path(
         "author/<int:author_id>/add_series_book/",
@@ -15,21 +38,37 @@ urlpatterns = [
         views.CreateBook.as_view(),
         name="add_book",
     ),
-    path("authors/", views.ShowAuthors.as_view(), name="show_authors"),
+    path("search/", views.Search.as_view(), name="search"),
+    path("import/", views.ImportLibrary.as_view(), name="import_library"),
+    path(
+        "import/files/", views.ImportBookFiles.as_view(), name="import_book_files"
+    ),
+    path("export/", views.export_library, name="export_library"),
+    path("jobs/", views.JobList.as_view(), name="jobs"),
+    path("jobs/<int:job_id>/", views.ShowJob.as_view(), name="show_job"),
+    path("api/<str:kind>/batch/", views.api_batch, name="api_batch"),
+    path(
+        "api/object-cache/", views.object_cache_stats, name="object_cache_stats"
+    ),
+    path(
+        "author/<int:author_id>/series_book/<int:series_book_id>/book/<int:book_id>/files/add/",
+        views.UploadBookFile.as_view(),
+        name="upload_book_file",
+    ),
     path(
-        "author/<int:author_id>/series_book/",
-        views.ShowAuthor.as_view(),
-        name="show_author",
+        "author/<int:author_id>/series_book/<int:series_book_id>/book/<int:book_id>/files/<int:file_id>/",
+        views.download_book_file,
+        name="download_book_file",
     ),
     path(
-        "author/<int:author_id>/series_book/<int:series_book_id>/books",
-        views.ShowSeriesBook.as_view(),
-        name="show_series_book",
+        "author/<int:author_id>/series_book/<int:series_book_id>/book/<int:book_id>/files/<int:file_id>/delete/",
+        views.delete_book_file,
+        name="delete_book_file",
     ),
     path(
-        "author/<int:author_id>/series_book/<int:series_book_id>/book/<int:book_id>/",
-        views.ShowBook.as_view(),
-        name="show_book",
+        "media/covers/<str:shard>/<str:digest>/<str:name>",
+        views.cover_image,
+        name="cover",
     ),
     path(
         "author/<int:author_id>/edit/<str:edit>/<int:edit_id>/",
@@ -61,4 +100,4 @@ urlpatterns = [
         views.delete_book_page,
         name="delete_book_page",
     ),
-]
+] + read_patterns(async_views if settings.LIBAPP_ASYNC_VIEWS else views)
@@ -0,0 +1,651 @@
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.core.cache.utils import make_template_fragment_key
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.functional import cached_property
+from django.utils.http import http_date, quote_etag
+from django.http import Http404
+
+from . import object_cache
+from .cache_versions import fragment_timeout
+from .models import Author, SeriesBook, Book
+
+
+def hierarchy_queryset(author_id, series_book_id=None, book_id=None):
+    """
+    Запрос самого нижнего переданного уровня цепочки автор -> серия -> книга
+    с родителями через select_related. Удалённые объекты и объекты, которые
+    не принадлежат своему родителю из URL, в него не попадают.
+    """
+    if book_id is not None:
+        return Book.undeleted.select_related("series__author").filter(
+            pk=book_id,
+            series_id=series_book_id,
+            series__is_deleted=False,
+            series__author_id=author_id,
+            series__author__is_deleted=False,
+        )
+    if series_book_id is not None:
+        return SeriesBook.undeleted.select_related("author").filter(
+            pk=series_book_id,
+            author_id=author_id,
+            author__is_deleted=False,
+        )
+    return Author.undeleted.filter(pk=author_id)
+
+
+def hierarchy_dict(obj):
+    if obj is None:
+        raise Http404
+    if isinstance(obj, Book):
+        return {"author": obj.series.author, "series_book": obj.series, "book": obj}
+    if isinstance(obj, SeriesBook):
+        return {"author": obj.author, "series_book": obj}
+    return {"author": obj}
+
+
+def hierarchy_levels(author_id, series_book_id=None, book_id=None):
+    levels = [(Author, author_id), (SeriesBook, series_book_id), (Book, book_id)]
+    return [(model, pk) for model, pk in levels if pk is not None]
+
+
+def link_hierarchy(objects):
+    """
+    Цепочка из объектов кэша объектов: проверяет её так же, как
+    hierarchy_queryset, и связывает книгу с серией, а серию с автором, чтобы
+    шаблоны не загружали их заново.
+    """
+    if any(obj.is_deleted for obj in objects):
+        raise Http404
+    for parent, child in zip(objects, objects[1:]):
+        field = "author" if isinstance(child, SeriesBook) else "series"
+        if getattr(child, field + "_id") != parent.pk:
+            raise Http404
+        setattr(child, field, parent)
+    return hierarchy_dict(objects[-1])
+
+
+def get_hierarchy_or_404(author_id, series_book_id=None, book_id=None):
+    """
+    Загружает цепочку автор -> серия -> книга.
+
+    Возвращает словарь с ключами "author", "series_book" и "book"
+    (только для переданных уровней). Если какой-то объект удалён или
+    не принадлежит своему родителю из URL, выбрасывается Http404.
+    Объекты берутся из кэша объектов (Author.cached и т.д.) за одно
+    обращение; если какого-то нет, цепочка загружается одним запросом
+    и кладётся в кэш.
+    """
+    objects = object_cache.peek(hierarchy_levels(author_id, series_book_id, book_id))
+    if None not in objects:
+        return link_hierarchy(objects)
+    hierarchy = hierarchy_dict(
+        hierarchy_queryset(author_id, series_book_id, book_id).first()
+    )
+    object_cache.store(hierarchy.values())
+    return hierarchy
+
+
+def load_hierarchy_or_404(
+    author_id, series_book_id=None, book_id=None, for_update=False
+):
+    """
+    Цепочка прямо из базы, мимо кэша объектов: для изменений и удалений.
+    Кэш объектов может быть локальным для процесса (LocMemCache), и после
+    изменения в другом процессе в нём остаётся устаревшая копия; её save()
+    вернул бы старые значения полей, в том числе is_deleted. for_update -
+    строки цепочки блокируются до конца транзакции (select_for_update).
+    """
+    queryset = hierarchy_queryset(author_id, series_book_id, book_id)
+    if for_update:
+        queryset = queryset.select_for_update()
+    return hierarchy_dict(queryset.first())
+
+
+def request_hierarchy_or_404(request, author_id, series_book_id=None, book_id=None):
+    """
+    Для страниц удаления: подтверждение (GET) показывается из кэша объектов,
+    а POST изменяет строки и берёт их из базы с блокировкой (atomic_post).
+    """
+    if request.method == "POST":
+        return load_hierarchy_or_404(
+            author_id, series_book_id, book_id, for_update=True
+        )
+    return get_hierarchy_or_404(author_id, series_book_id, book_id)
+
+
+def atomic_post(view):
+    """POST функции-представления выполняется в транзакции, GET - без неё."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != "POST":
+            return view(request, *args, **kwargs)
+        with transaction.atomic():
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+async def aget_hierarchy_or_404(author_id, series_book_id=None, book_id=None):
+    """Асинхронный вариант get_hierarchy_or_404."""
+    objects = await object_cache.apeek(
+        hierarchy_levels(author_id, series_book_id, book_id)
+    )
+    if None not in objects:
+        return link_hierarchy(objects)
+    hierarchy = hierarchy_dict(
+        await hierarchy_queryset(author_id, series_book_id, book_id).afirst()
+    )
+    await object_cache.astore(hierarchy.values())
+    return hierarchy
+
+
+class HierarchyMixin:
+    """
+    Достаёт автора, серию и книгу из kwargs URL через get_hierarchy_or_404
+    и добавляет их в контекст шаблона.
+    """
+
+    def get_hierarchy(self):
+        if not hasattr(self, "_hierarchy"):
+            self._hierarchy = get_hierarchy_or_404(
+                self.kwargs.get("author_id"),
+                self.kwargs.get("series_book_id"),
+                self.kwargs.get("book_id"),
+            )
+        return self._hierarchy
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(self.get_hierarchy())
+        return context
+
+
+class EditHierarchyMixin(HierarchyMixin):
+    """
+    Для страниц редактирования: редактируемый объект берётся из цепочки,
+    загруженной из базы (load_hierarchy_or_404), по kwargs "edit" и
+    "edit_id". POST выполняется в транзакции с блокировкой строк цепочки.
+    """
+
+    def get_hierarchy(self):
+        if not hasattr(self, "_hierarchy"):
+            self._hierarchy = load_hierarchy_or_404(
+                self.kwargs.get("author_id"),
+                self.kwargs.get("series_book_id"),
+                self.kwargs.get("book_id"),
+                for_update=self.request.method == "POST",
+            )
+        return self._hierarchy
+
+    def post(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().post(request, *args, **kwargs)
+
+    def get_object(self, queryset=None):
+        edit = self.kwargs.get("edit")
+        if edit not in ("author", "series_book", "book"):
+            raise Http404
+        obj = self.get_hierarchy().get(edit)
+        if obj is None or obj.pk != self.kwargs.get(self.pk_url_kwarg):
+            raise Http404
+        return obj
+
+
+class ConditionalGetMixin:
+    """
+    Отвечает 304 Not Modified по ETag / Last-Modified. Отметка времени
+    берётся одним небольшим запросом в get_last_modified(), поэтому при
+    совпадении ни списочный запрос, ни шаблон не выполняются.
+    """
+
+    def get_last_modified(self):
+        raise NotImplementedError
+
+    def get_etag(self, last_modified):
+        # Страница содержит имя пользователя, поэтому ETag зависит от него.
+        value = "%s:%s" % (self.request.user.pk, last_modified.isoformat())
+        return quote_etag(hashlib.md5(value.encode()).hexdigest())
+
+    def check_conditional(self, last_modified):
+        """
+        Возвращает (etag, timestamp, response): response - ответ 304/412
+        или None, если страницу нужно отрисовать.
+        """
+        etag = self.get_etag(last_modified)
+        timestamp = int(last_modified.timestamp())
+        response = get_conditional_response(
+            self.request, etag=etag, last_modified=timestamp
+        )
+        return etag, timestamp, response
+
+    def patch_conditional(self, response, etag, timestamp):
+        response.headers.setdefault("ETag", etag)
+        response.headers.setdefault("Last-Modified", http_date(timestamp))
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ("Cookie",))
+        return response
+
+    def get(self, request, *args, **kwargs):
+        last_modified = self.get_last_modified()
+        if last_modified is None:
+            return super().get(request, *args, **kwargs)
+        etag, timestamp, response = self.check_conditional(last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return self.patch_conditional(response, etag, timestamp)
+
+
+def encode_cursor(values):
+    data = json.dumps(values, ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (binascii.Error, ValueError):
+        raise Http404
+    if not isinstance(values, list):
+        raise Http404
+    return values
+
+
+class KeysetPage:
+    """
+    Страница keyset-пагинации. Запрос выполняется лениво, при первом
+    обращении к данным, поэтому страница, отрисованная из кэша фрагментов,
+    не обращается к базе.
+    """
+
+    def __init__(
+        self, queryset, page_size, cursor_fields, backwards, has_cursor, cursor_key
+    ):
+        self.queryset = queryset
+        self.page_size = page_size
+        self.cursor_fields = cursor_fields
+        self.cursor_key = cursor_key
+        self.backwards = backwards
+        self.has_cursor = has_cursor
+
+    @cached_property
+    def _result(self):
+        return self._build_result(list(self.queryset[: self.page_size + 1]))
+
+    async def aload(self):
+        """Выполняет запрос страницы через асинхронный ORM."""
+        if "_result" not in self.__dict__:
+            object_list = [obj async for obj in self.queryset[: self.page_size + 1]]
+            self.__dict__["_result"] = self._build_result(object_list)
+
+    def _build_result(self, object_list):
+        has_more = len(object_list) > self.page_size
+        object_list = object_list[: self.page_size]
+        if self.backwards:
+            object_list.reverse()
+            return object_list, True, has_more
+        return object_list, has_more, self.has_cursor
+
+    @property
+    def object_list(self):
+        return self._result[0]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._result[1]
+
+    def has_previous(self):
+        return self._result[2]
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def cursor_for(self, obj):
+        values = [getattr(obj, f) for f in self.cursor_fields]
+        return encode_cursor(
+            [self.cursor_key]
+            + [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+        )
+
+    def next_cursor(self):
+        if self.has_next() and self.object_list:
+            return self.cursor_for(self.object_list[-1])
+
+    def previous_cursor(self):
+        if self.has_previous() and self.object_list:
+            return self.cursor_for(self.object_list[0])
+
+
+class KeysetPaginationMixin:
+    """
+    Постраничный вывод для ListView по ключу (поле сортировки, pk)
+    вместо OFFSET. Курсоры передаются в GET-параметрах "after" и "before",
+    поэтому любая страница стоит столько же, сколько первая, и COUNT(*)
+    не выполняется.
+    """
+
+    paginate_by = 25
+    keyset_field = "name"
+    keyset_descending = False
+
+    def get_keyset_fields(self):
+        return [self.keyset_field, "pk"]
+
+    def get_keyset_descending(self):
+        return self.keyset_descending
+
+    def get_cursor_key(self):
+        """
+        Сортировка, для которой выдан курсор: его первый элемент. Курсор
+        другой сортировки (например, по названию при ?sort=-rating) - 404.
+        """
+        prefix = "-" if self.get_keyset_descending() else ""
+        return prefix + self.get_keyset_fields()[0]
+
+    def keyset_filter(self, fields, values, op):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        for i, field in enumerate(fields):
+            q = Q(**{"%s__%s" % (field, op): values[i]})
+            for prev_field, prev_value in zip(fields[:i], values[:i]):
+                q &= Q(**{prev_field: prev_value})
+            condition |= q
+        return condition
+
+    def clean_cursor(self, model, fields, values):
+        """
+        Значения курсора, приведённые к типам полей ключа. Курсор приходит
+        из URL, поэтому чужие типы, null и неразбираемые даты - 404.
+        """
+        if len(values) != len(fields):
+            raise Http404
+        cleaned = []
+        for name, value in zip(fields, values):
+            field = model._meta.pk if name == "pk" else model._meta.get_field(name)
+            if value is None:
+                raise Http404
+            try:
+                cleaned.append(field.to_python(value))
+            except (TypeError, ValueError, ValidationError):
+                raise Http404
+        return cleaned
+
+    def paginate_queryset(self, queryset, page_size):
+        fields = self.get_keyset_fields()
+        after = self.request.GET.get("after")
+        before = self.request.GET.get("before")
+        backwards = bool(before) and not after
+        # Назад по убывающей сортировке - это вперёд по возрастающей.
+        reverse = backwards != self.get_keyset_descending()
+        cursor = after or before
+        key = self.get_cursor_key()
+        if cursor:
+            values = decode_cursor(cursor)
+            if not values or values[0] != key:
+                raise Http404
+            values = self.clean_cursor(queryset.model, fields, values[1:])
+            op = "lt" if reverse else "gt"
+            queryset = queryset.filter(self.keyset_filter(fields, values, op))
+        if reverse:
+            queryset = queryset.order_by(*["-%s" % f for f in fields])
+        else:
+            queryset = queryset.order_by(*fields)
+        page = KeysetPage(queryset, page_size, fields, backwards, bool(after), key)
+        # is_paginated передаётся как метод: шаблон вызовет его только
+        # если доберётся до пагинации, не отдавая страницу из кэша.
+        return None, page, page, page.has_other_pages
+
+
+class FragmentCacheMixin:
+    """
+    Список страницы кэшируется фрагментом шаблона
+    {% cache fragment_timeout <fragment_name> fragment_vary_on %}. Части
+    ключа собираются только в get_fragment_vary_on(), и fragment_key()
+    считает по ним тот же ключ для async_views.
+    """
+
+    fragment_name = None
+
+    def get_list_version(self):
+        raise NotImplementedError
+
+    def get_fragment_vary_on(self):
+        return [
+            self.get_list_version(),
+            self.request.GET.get("after", ""),
+            self.request.GET.get("before", ""),
+        ]
+
+    def fragment_key(self, context):
+        return make_template_fragment_key(
+            self.fragment_name, [context["fragment_vary_on"]]
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["fragment_vary_on"] = self.get_fragment_vary_on()
+        context["fragment_timeout"] = fragment_timeout()
+        return context
+
+
+class ListOptions:
+    """
+    Сортировка и фильтры списка серий или книг из GET-параметров sort
+    (name, rating, created; "-" - по убыванию), completed (0/1), rating_min
+    и rating_max. Допускаются только сочетания, которые обслуживает один
+    составной индекс (родитель, is_deleted, [is_completed,] поле сортировки)
+    из Meta.indexes: диапазон оценок возможен лишь при сортировке по оценке,
+    поэтому с ним сортировка переключается на оценку.
+    """
+
+    SORTS = {"name": "name", "rating": "rating", "created": "created_at"}
+    SORT_LABELS = {"name": "По названию", "rating": "По оценке", "created": "По дате"}
+    # Первое нажатие на сортировку по оценке или дате - сначала лучшие/новые.
+    DEFAULT_DESCENDING = {"name": False, "rating": True, "created": True}
+
+    def __init__(self, params):
+        sort = params.get("sort") or "name"
+        self.descending = sort.startswith("-")
+        self.sort = sort.lstrip("-")
+        if self.sort not in self.SORTS:
+            raise Http404
+        self.completed = self.int_param(params, "completed", 0, 1)
+        self.rating_min = self.int_param(params, "rating_min")
+        self.rating_max = self.int_param(params, "rating_max")
+        if self.has_rating_range() and self.sort != "rating":
+            self.sort, self.descending = "rating", True
+
+    @staticmethod
+    def int_param(params, name, min_value=None, max_value=None):
+        value = params.get(name)
+        if value in (None, ""):
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            raise Http404
+        if (min_value is not None and value < min_value) or (
+            max_value is not None and value > max_value
+        ):
+            raise Http404
+        return value
+
+    def has_rating_range(self):
+        return self.rating_min is not None or self.rating_max is not None
+
+    @property
+    def keyset_fields(self):
+        return [self.SORTS[self.sort], "pk"]
+
+    def index_fields(self, parent):
+        """
+        Поля индекса, который обслуживает список: равенства, затем поле
+        сортировки (по нему же идёт диапазон оценок); pk в конце индекса
+        InnoDB и SQLite добавляют сами.
+        """
+        fields = [parent, "is_deleted"]
+        if self.completed is not None:
+            fields.append("is_completed")
+        return fields + [self.SORTS[self.sort]]
+
+    def filter(self, queryset):
+        if self.completed is not None:
+            queryset = queryset.filter(is_completed=self.completed)
+        if self.rating_min is not None:
+            queryset = queryset.filter(rating__gte=self.rating_min)
+        if self.rating_max is not None:
+            queryset = queryset.filter(rating__lte=self.rating_max)
+        return queryset
+
+    def params(self, **changes):
+        """Параметры текущего списка с изменениями, без курсора страницы."""
+        params = {
+            "sort": ("-" if self.descending else "") + self.sort,
+            "completed": self.completed,
+            "rating_min": self.rating_min,
+            "rating_max": self.rating_max,
+        }
+        params.update(changes)
+        if params["sort"] == "name":
+            del params["sort"]
+        return {k: v for k, v in params.items() if v is not None}
+
+    def url(self, **changes):
+        return "?" + urlencode(self.params(**changes))
+
+    @property
+    def cache_key(self):
+        """Часть ключа кэша фрагмента списка."""
+        return urlencode(self.params()) or "-"
+
+    @property
+    def query_prefix(self):
+        """Начало ссылок пагинации: ?sort=...&after=..."""
+        query = urlencode(self.params())
+        return "?%s&" % query if query else "?"
+
+    def sort_links(self):
+        links = []
+        for sort, label in self.SORT_LABELS.items():
+            active = sort == self.sort
+            descending = (
+                not self.descending if active else self.DEFAULT_DESCENDING[sort]
+            )
+            changes = {"sort": ("-" if descending else "") + sort}
+            if sort != "rating":
+                changes.update(rating_min=None, rating_max=None)
+            links.append({"label": label, "url": self.url(**changes), "active": active})
+        return links
+
+
+class Facets:
+    """
+    Число элементов списка по статусу и по оценкам для фильтров - один
+    GROUP BY (is_completed, rating) по всему списку родителя, который
+    обслуживает индекс (родитель, is_deleted, is_completed, rating).
+    Запрос ленивый, как у KeysetPage.
+    """
+
+    def __init__(self, queryset, options):
+        self.queryset = (
+            queryset.order_by().values("is_completed", "rating").annotate(n=Count("pk"))
+        )
+        self.options = options
+
+    @cached_property
+    def _rows(self):
+        return list(self.queryset)
+
+    async def aload(self):
+        if "_rows" not in self.__dict__:
+            self.__dict__["_rows"] = [row async for row in self.queryset]
+
+    def count(self, **conditions):
+        return sum(
+            row["n"]
+            for row in self._rows
+            if all(row[k] == v for k, v in conditions.items())
+        )
+
+    def completed_links(self):
+        options = self.options
+        return [
+            {
+                "label": label,
+                "count": self.count(
+                    **({} if value is None else {"is_completed": value})
+                ),
+                "url": options.url(completed=value),
+                "active": options.completed == value,
+            }
+            for label, value in (("Все", None), ("Завершено", 1), ("Не завершено", 0))
+        ]
+
+    def rating_links(self):
+        """Оценки в текущем фильтре статуса; ссылка выбирает одну оценку."""
+        options = self.options
+        conditions = {}
+        if options.completed is not None:
+            conditions["is_completed"] = options.completed
+        ratings = sorted({row["rating"] for row in self._rows}, reverse=True)
+        return [
+            {
+                "label": rating,
+                "count": self.count(rating=rating, **conditions),
+                "url": options.url(
+                    sort="-rating", rating_min=rating, rating_max=rating
+                ),
+                "active": options.rating_min == rating == options.rating_max,
+            }
+            for rating in ratings
+            if self.count(rating=rating, **conditions)
+        ]
+
+
+class ListOptionsMixin:
+    """
+    Для ListView с KeysetPaginationMixin: сортировка и фильтры из
+    ListOptions и счётчики Facets в контексте ("list_options", "facets").
+    """
+
+    def get_list_options(self):
+        if not hasattr(self, "_list_options"):
+            self._list_options = ListOptions(self.request.GET)
+        return self._list_options
+
+    def get_keyset_fields(self):
+        return self.get_list_options().keyset_fields
+
+    def get_keyset_descending(self):
+        return self.get_list_options().descending
+
+    def paginate_queryset(self, queryset, page_size):
+        queryset = self.get_list_options().filter(queryset)
+        return super().paginate_queryset(queryset, page_size)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        options = self.get_list_options()
+        context["list_options"] = options
+        context["facets"] = Facets(self.object_list, options)
+        return context
@@ -1,18 +1,31 @@
+import codecs
+import json
+import uuid
+
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Max, Q
 from django.http import (
+    FileResponse,
     HttpResponse,
     HttpResponseNotFound,
     Http404,
     HttpResponseRedirect,
+    JsonResponse,
     HttpResponsePermanentRedirect,
+    StreamingHttpResponse,
 )
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse, reverse_lazy
 from django.template.loader import render_to_string
 from django.template.defaultfilters import slugify
 from django.views import View
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
 from django.views.generic import (
     TemplateView,
     ListView,
@@ -22,12 +35,43 @@ from django.views.generic import (
     UpdateView,
 )
 
-from .models import Author, SeriesBook, Book
-from .forms import AddAuthorForm, AddSeriesBookForm, AddBookForm
+from . import attachments, covers, jobs, metadata, object_cache
+from .models import Author, SeriesBook, Book, BookFile, Job
+from .batch import BatchError, apply_batch
+from .bulk import bulk_create_and_notify
+from .cache_versions import get_version
+from .exporter import CONTENT_TYPES, FORMATS, export_filename, iter_export
+from .forms import (
+    BOOKS_PER_FORMSET,
+    AddAuthorForm,
+    AddSeriesBookForm,
+    AddBookForm,
+    AddBookFormSet,
+    BookFileForm,
+    ImportLibraryForm,
+)
+from .importer import LibraryImporter, RecordError, detect_format, read_records
+from .search import search
+from .stats import dashboard
+from .tasks import save_upload
+from .utils import (
+    ConditionalGetMixin,
+    HierarchyMixin,
+    EditHierarchyMixin,
+    FragmentCacheMixin,
+    KeysetPaginationMixin,
+    ListOptionsMixin,
+    atomic_post,
+    get_hierarchy_or_404,
+    request_hierarchy_or_404,
+)
 
 
 def main_page(request):
-    return render(request, "libapp/main.html")
+    context = {}
+    if request.user.is_authenticated:
+        context["stats"] = dashboard(request.user)
+    return render(request, "libapp/main.html", context)
 
 
 class CreateAuthor(LoginRequiredMixin, CreateView):
@@ -54,15 +98,14 @@ class CreateAuthor(LoginRequiredMixin, CreateView):
         return context
 
 
-class CreateSeriesBook(LoginRequiredMixin, CreateView):
+class CreateSeriesBook(LoginRequiredMixin, HierarchyMixin, CreateView):
     form_class = AddSeriesBookForm
     template_name = "libapp/create.html"
 
     def form_valid(self, form):
         w = form.save(commit=False)
         w.user = self.request.user
-        author_id = self.kwargs.get("author_id")
-        w.author = Author.objects.filter(pk=author_id).first()
+        w.author = self.get_hierarchy()["author"]
         return super().form_valid(form)
 
     def get_success_url(self):
@@ -78,26 +121,81 @@ class CreateSeriesBook(LoginRequiredMixin, CreateView):
             "series_book": False,
             "book": False,
         }
-        author_id = self.kwargs.get("author_id")
-        if not Author.undeleted.filter(pk=author_id).exists():
-            raise Http404
-        author = Author.undeleted.filter(pk=author_id).first()
-        context["author"] = author
         context["title"] = "Добавление серии"
         return context
 
 
-class CreateBook(LoginRequiredMixin, CreateView):
+class CreateBook(LoginRequiredMixin, HierarchyMixin, CreateView):
+    """
+    Одна книга или, с ?rows=N, несколько книг одной формой: строки
+    проверяются вместе и вставляются одним bulk_create в одной транзакции.
+    """
+
     form_class = AddBookForm
     template_name = "libapp/create.html"
+    formset_prefix = "books"
 
     def form_valid(self, form):
         w = form.save(commit=False)
         w.user = self.request.user
-        series_book_id = self.kwargs.get("series_book_id")
-        w.series = SeriesBook.objects.filter(pk=series_book_id).first()
+        w.series = self.get_hierarchy()["series_book"]
         return super().form_valid(form)
 
+    def is_formset(self):
+        if self.request.method == "POST":
+            return self.formset_prefix + "-TOTAL_FORMS" in self.request.POST
+        return "rows" in self.request.GET
+
+    def get(self, request, *args, **kwargs):
+        if not self.is_formset():
+            return super().get(request, *args, **kwargs)
+        self.object = None
+        return self.render_formset(self.get_formset())
+
+    def post(self, request, *args, **kwargs):
+        if not self.is_formset():
+            return super().post(request, *args, **kwargs)
+        self.object = None
+        formset = self.get_formset()
+        if formset.is_valid():
+            return self.formset_valid(formset)
+        return self.render_formset(formset)
+
+    def get_formset(self):
+        if self.request.method == "POST":
+            return AddBookFormSet(self.request.POST, prefix=self.formset_prefix)
+        formset = AddBookFormSet(prefix=self.formset_prefix)
+        try:
+            rows = int(self.request.GET["rows"])
+        except ValueError:
+            rows = 5
+        formset.extra = min(max(rows, 1), BOOKS_PER_FORMSET) - formset.min_num
+        return formset
+
+    def formset_valid(self, formset):
+        series = self.get_hierarchy()["series_book"]
+        books = []
+        for form in formset.filled_forms():
+            book = form.save(commit=False)
+            book.user = self.request.user
+            book.series = series
+            books.append(book)
+        with transaction.atomic():
+            bulk_create_and_notify(
+                Book, books, user=self.request.user, series_id__in={series.pk}
+            )
+        return redirect(self.get_success_url())
+
+    def render_formset(self, formset):
+        context = self.get_context_data(form=None, formset=formset)
+        context["title"] = "Добавление книг"
+        return self.render_to_response(context)
+
+    def get_template_names(self):
+        if self.is_formset():
+            return ["libapp/create_books.html"]
+        return super().get_template_names()
+
     def get_success_url(self):
         return reverse(
             "show_series_book",
@@ -115,48 +213,71 @@ class CreateBook(LoginRequiredMixin, CreateView):
             "series_book": True,
             "book": False,
         }
-        author_id = self.kwargs.get("author_id")
-        series_book_id = self.kwargs.get("series_book_id")
-        if not Author.undeleted.filter(pk=author_id).exists():
-            raise Http404
-        elif not SeriesBook.undeleted.filter(pk=series_book_id).exists():
-            raise Http404
-        author = Author.undeleted.filter(pk=author_id).first()
-        series_book = SeriesBook.undeleted.filter(pk=series_book_id).first()
-        context["author"] = author
-        context["series_book"] = series_book
         context["title"] = "Добавление книги"
         return context
 
 
-class ShowAuthors(LoginRequiredMixin, ListView):
+class ShowAuthors(
+    LoginRequiredMixin,
+    ConditionalGetMixin,
+    FragmentCacheMixin,
+    KeysetPaginationMixin,
+    ListView,
+):
     template_name = "libapp/show_authors.html"
     context_object_name = "authors"
+    fragment_name = "authors_list"
+
+    def get_last_modified(self):
+        # updated_at автора меняется и при изменении его серий и книг.
+        return Author.objects.aggregate(last_modified=Max("updated_at"))[
+            "last_modified"
+        ]
 
     def get_queryset(self):
         return Author.undeleted.all()
 
+    def get_list_version(self):
+        return get_version("authors")
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = 'Авторы'
         return context
 
 
-class ShowAuthor(LoginRequiredMixin, ListView):
+class ShowAuthor(
+    LoginRequiredMixin,
+    HierarchyMixin,
+    ConditionalGetMixin,
+    FragmentCacheMixin,
+    ListOptionsMixin,
+    KeysetPaginationMixin,
+    ListView,
+):
     template_name = "libapp/show_author.html"
     context_object_name = "series_book"
+    fragment_name = "series_list"
+
+    def get_last_modified(self):
+        return self.get_hierarchy()["author"].updated_at
 
     def get_queryset(self):
-        author = Author.undeleted.filter(pk=self.kwargs.get("author_id")).first()
+        author = self.get_hierarchy()["author"]
         return SeriesBook.undeleted.filter(author=author).all()
 
+    def get_list_version(self):
+        return get_version("author", self.kwargs.get("author_id"))
+
+    def get_fragment_vary_on(self):
+        return [
+            self.get_hierarchy()["author"].pk,
+            *super().get_fragment_vary_on(),
+            self.get_list_options().cache_key,
+        ]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        author_id = self.kwargs.get("author_id")
-        if not Author.undeleted.filter(pk=author_id).exists():
-            raise Http404
-        author = Author.undeleted.filter(pk=author_id).first()
-        context["author"] = author
         context["delete"] = {
             "author": "author",
             "series_book": "series_book",
@@ -166,28 +287,39 @@ class ShowAuthor(LoginRequiredMixin, ListView):
         return context
 
 
-class ShowSeriesBook(LoginRequiredMixin, ListView):
+class ShowSeriesBook(
+    LoginRequiredMixin,
+    HierarchyMixin,
+    ConditionalGetMixin,
+    FragmentCacheMixin,
+    ListOptionsMixin,
+    KeysetPaginationMixin,
+    ListView,
+):
     template_name = "libapp/show_series_book.html"
     context_object_name = "books"
+    fragment_name = "books_list"
+
+    def get_last_modified(self):
+        hierarchy = self.get_hierarchy()
+        return max(hierarchy["author"].updated_at, hierarchy["series_book"].updated_at)
 
     def get_queryset(self):
-        series = SeriesBook.undeleted.filter(
-            pk=self.kwargs.get("series_book_id")
-        ).first()
+        series = self.get_hierarchy()["series_book"]
         return Book.undeleted.filter(series=series).all()
 
+    def get_list_version(self):
+        return get_version("series", self.kwargs.get("series_book_id"))
+
+    def get_fragment_vary_on(self):
+        return [
+            self.get_hierarchy()["series_book"].pk,
+            *super().get_fragment_vary_on(),
+            self.get_list_options().cache_key,
+        ]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        author_id = self.kwargs.get("author_id")
-        series_book_id = self.kwargs.get("series_book_id")
-        if not Author.undeleted.filter(pk=author_id).exists():
-            raise Http404
-        elif not SeriesBook.undeleted.filter(pk=series_book_id).exists():
-            raise Http404
-        author = Author.undeleted.filter(pk=author_id).first()
-        series_book = SeriesBook.undeleted.filter(pk=series_book_id).first()
-        context["author"] = author
-        context["series_book"] = series_book
         context["delete"] = {
             "author": "author",
             "series_book": "series_book",
@@ -197,26 +329,37 @@ class ShowSeriesBook(LoginRequiredMixin, ListView):
         return context
 
 
-class ShowBook(LoginRequiredMixin, DetailView):
+class ShowBook(LoginRequiredMixin, HierarchyMixin, ConditionalGetMixin, DetailView):
     template_name = "libapp/show_book.html"
     pk_url_kwarg = "book_id"
     context_object_name = "book"
+    # Занятое место (attachments.storage_usage) и файлы книги; async_views
+    # загружает их заранее.
+    storage = None
+    files_context = None
+
+    def get_storage(self):
+        if self.storage is None:
+            self.storage = attachments.storage_usage(self.request.user)
+        return self.storage
+
+    def get_last_modified(self):
+        # Занятое место меняется и загрузками в другие книги, поэтому время
+        # его изменения тоже входит в Last-Modified.
+        stamps = [obj.updated_at for obj in self.get_hierarchy().values()]
+        changed = self.get_storage()[1]
+        return max(stamps + [changed]) if changed else max(stamps)
+
+    def get_files_context(self):
+        if self.files_context is None:
+            self.files_context = attachments.book_context(
+                self.object, self.request.user, self.get_storage()[0]
+            )
+        return self.files_context
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        author_id = self.kwargs.get("author_id")
-        series_book_id = self.kwargs.get("series_book_id")
-        book_id = self.kwargs.get("book_id")
-        if not Author.undeleted.filter(pk=author_id).exists():
-            raise Http404
-        elif not SeriesBook.undeleted.filter(pk=series_book_id).exists():
-            raise Http404
-        elif not Book.undeleted.filter(pk=book_id).exists():
-            raise Http404
-        author = Author.undeleted.filter(pk=author_id).first()
-        series_book = SeriesBook.undeleted.filter(pk=series_book_id).first()
-        context["author"] = author
-        context["series_book"] = series_book
+        context.update(self.get_files_context())
         context["delete"] = {
             "author": "author",
             "series_book": "series_book",
@@ -226,17 +369,278 @@ class ShowBook(LoginRequiredMixin, DetailView):
         return context
 
     def get_object(self, queryset=None):
-        return get_object_or_404(Book.undeleted, pk=self.kwargs.get(self.pk_url_kwarg))
+        return self.get_hierarchy()["book"]
+
+
+class Search(LoginRequiredMixin, TemplateView):
+    template_name = "libapp/search.html"
+    paginate_by = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get("q", "").strip()
+        try:
+            page = max(int(self.request.GET.get("page", 1)), 1)
+        except ValueError:
+            raise Http404
+        results, has_next = search(query, page, self.paginate_by)
+        context["query"] = query
+        context["results"] = results
+        context["page"] = page
+        context["has_next"] = has_next
+        context["title"] = "Поиск"
+        return context
+
+
+class ImportLibrary(LoginRequiredMixin, FormView):
+    form_class = ImportLibraryForm
+    template_name = "libapp/import.html"
+
+    def form_valid(self, form):
+        uploaded = form.cleaned_data["file"]
+        file_format = form.cleaned_data["format"] or detect_format(uploaded.name)
+        if form.cleaned_data["background"]:
+            name = "%s.%s" % (uuid.uuid4().hex, file_format)
+            save_upload(uploaded, name)
+            job = jobs.enqueue(
+                "import_library",
+                {"file": name, "format": file_format, "filename": uploaded.name},
+                user=self.request.user,
+                max_attempts=1,
+            )
+            return redirect("show_job", job.pk)
+        # Файл читается кусками по мере импорта, целиком в память не загружается.
+        chunks = codecs.iterdecode(uploaded.chunks(), "utf-8-sig")
+        try:
+            stats = LibraryImporter(self.request.user).run(
+                read_records(chunks, file_format)
+            )
+        except (RecordError, UnicodeDecodeError) as e:
+            form.add_error("file", str(e))
+            return self.form_invalid(form)
+        return self.render_to_response(self.get_context_data(form=form, stats=stats))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = "Импорт"
+        return context
+
+
+@login_required
+def export_library(request):
+    file_format = request.GET.get("format", "csv")
+    if file_format not in FORMATS:
+        raise Http404
+    compress = request.GET.get("gzip") == "1"
+    # Сжатый файл отдаётся как есть (application/gzip), а не через
+    # Content-Encoding, иначе браузер распакует его при скачивании.
+    if compress:
+        content_type = "application/gzip"
+    else:
+        content_type = CONTENT_TYPES[file_format] + "; charset=utf-8"
+    response = StreamingHttpResponse(
+        iter_export(request.user, file_format, compress), content_type=content_type
+    )
+    response["Content-Disposition"] = 'attachment; filename="%s"' % export_filename(
+        file_format, compress
+    )
+    return response
+
+
+@login_required
+@require_POST
+def api_batch(request, kind):
+    try:
+        payload = json.loads(request.body)
+        results = apply_batch(request.user, kind, payload)
+    except (ValueError, BatchError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"results": results})
+
+
+def user_jobs(user):
+    """Задачи пользователя; сотрудник видит и задачи без владельца."""
+    if user.is_staff:
+        return Job.objects.filter(Q(user=user) | Q(user__isnull=True))
+    return Job.objects.filter(user=user)
+
+
+class JobList(LoginRequiredMixin, ListView):
+    template_name = "libapp/jobs.html"
+    context_object_name = "jobs"
+
+    def get_queryset(self):
+        return user_jobs(self.request.user).order_by("-created_at", "-pk")[:50]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = "Задачи"
+        return context
+
+
+class ShowJob(LoginRequiredMixin, DetailView):
+    template_name = "libapp/show_job.html"
+    context_object_name = "job"
+    pk_url_kwarg = "job_id"
+
+    def get_queryset(self):
+        return user_jobs(self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = "Задача %d" % self.object.pk
+        context["refresh"] = self.object.state in (
+            Job.State.QUEUED,
+            Job.State.RUNNING,
+        )
+        return context
+
+
+@login_required
+def object_cache_stats(request):
+    """Попадания и промахи кэша объектов в этом процессе - для подбора размера."""
+    if not request.user.is_staff:
+        raise Http404
+    return JsonResponse(object_cache.stats())
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class BookFileUploadMixin:
+    form_class = BookFileForm
+
+    def dispatch(self, request, *args, **kwargs):
+        # Обработчик загрузки нужно заменить до первого чтения POST, а его
+        # читает CsrfViewMiddleware, поэтому CSRF проверяется здесь.
+        # Вход проверяется до этого: тело запроса анонимного пользователя
+        # (до LIBAPP_ATTACHMENT_MAX_BYTES) не читается.
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        self.upload_handler = attachments.HashingUploadHandler(request)
+        request.upload_handlers = [self.upload_handler]
+        return csrf_protect(super().dispatch)(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["too_large"] = self.upload_handler.too_large
+        return kwargs
+
+    def attach(self, form, book):
+        try:
+            attachment = attachments.attach(
+                book, self.request.user, form.cleaned_data["file"]
+            )
+        except ValidationError as e:
+            form.add_error("file", e)
+            return self.form_invalid(form)
+        metadata.schedule(attachment)
+        return super().form_valid(form)
+
+
+class UploadBookFile(
+    BookFileUploadMixin, LoginRequiredMixin, HierarchyMixin, FormView
+):
+    template_name = "libapp/create.html"
+
+    def form_valid(self, form):
+        return self.attach(form, self.get_hierarchy()["book"])
+
+    def get_success_url(self):
+        return reverse("show_book", kwargs=self.kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["back_url"] = {
+            "authors": False,
+            "author": False,
+            "series_book": False,
+            "book": True,
+        }
+        context["title"] = "Добавление файла"
+        return context
+
+
+class ImportBookFiles(BookFileUploadMixin, LoginRequiredMixin, FormView):
+    """
+    Загрузка EPUB или FB2 без книги: книга, автор и серия создаются по
+    метаданным файла, которые читаются в фоне (libapp.metadata).
+    """
+
+    template_name = "libapp/import_files.html"
+    success_url = reverse_lazy("import_book_files")
+
+    def form_valid(self, form):
+        if attachments.detect_format(form.cleaned_data["file"]) not in (
+            attachments.METADATA_FORMATS
+        ):
+            form.add_error("file", "Книги создаются по файлам EPUB и FB2")
+            return self.form_invalid(form)
+        return self.attach(form, None)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        files = BookFile.objects.filter(user=self.request.user)
+        context["pending"] = files.filter(book__isnull=True).order_by("-pk")[:50]
+        context["recent"] = (
+            files.filter(
+                book__isnull=False,
+                metadata_state__in=(
+                    BookFile.MetadataState.DONE,
+                    BookFile.MetadataState.FAILED,
+                ),
+            )
+            .select_related("book__series")
+            .order_by("-pk")[:20]
+        )
+        context["title"] = "Книги из файлов"
+        return context
+
+
+@login_required
+def download_book_file(request, author_id, series_book_id, book_id, file_id):
+    book = get_hierarchy_or_404(author_id, series_book_id, book_id)["book"]
+    attachment = get_object_or_404(
+        attachments.book_files(book, request.user), pk=file_id
+    )
+    return attachments.serve(request, attachment)
+
+
+@login_required
+def delete_book_file(request, author_id, series_book_id, book_id, file_id):
+    hierarchy = get_hierarchy_or_404(author_id, series_book_id, book_id)
+    attachment = get_object_or_404(
+        attachments.book_files(hierarchy["book"], request.user), pk=file_id
+    )
+    if request.method == "POST" and request.POST.get("delete_button") == "delete":
+        attachment.delete()
+        return redirect("show_book", author_id, series_book_id, book_id)
+    return render(
+        request,
+        "libapp/delete_book_file.html",
+        {**hierarchy, "file": attachment, "title": "Удаление файла"},
+    )
+
+
+def cover_image(request, shard, digest, name):
+    """
+    Уменьшенная обложка. В рабочей установке /media/ отдаёт веб-сервер
+    с теми же заголовками; представление нужно для разработки и тестов.
+    """
+    path = covers.thumbnail_path(shard, digest, name)
+    try:
+        response = FileResponse(
+            open(path, "rb"), content_type=covers.CONTENT_TYPES[name.split(".")[1]]
+        )
+    except FileNotFoundError:
+        raise Http404
+    response["Cache-Control"] = covers.CACHE_CONTROL
+    return response
 
 
-class EditAuthorPage(LoginRequiredMixin, UpdateView):
+class EditAuthorPage(LoginRequiredMixin, EditHierarchyMixin, UpdateView):
     form_class = AddAuthorForm
     template_name = "libapp/create.html"
     pk_url_kwarg = "edit_id"
 
-    def get_queryset(self):
-        return Author.undeleted
-
     def get_success_url(self):
         return reverse(
             "show_author", kwargs={"author_id": self.kwargs.get("author_id")}
@@ -250,19 +654,11 @@ class EditAuthorPage(LoginRequiredMixin, UpdateView):
             "series_book": False,
             "book": False,
         }
-        author_id = self.kwargs.get("author_id")
-        edit = self.kwargs.get("edit")
-        if not edit == "author" and not edit == "series_book" and not edit == "book":
-            raise Http404
-        if not Author.undeleted.filter(pk=author_id).exists():
-            raise Http404
-        author = Author.undeleted.filter(pk=author_id).first()
-        context["author"] = author
         context["title"] = "Редактирование автора"
         return context
 
 
-class EditSeriesBookPage(LoginRequiredMixin, UpdateView):
+class EditSeriesBookPage(LoginRequiredMixin, EditHierarchyMixin, UpdateView):
     template_name = "libapp/create.html"
     pk_url_kwarg = "edit_id"
 
@@ -273,13 +669,6 @@ class EditSeriesBookPage(LoginRequiredMixin, UpdateView):
         elif edit == "series_book":
             return AddSeriesBookForm
 
-    def get_queryset(self):
-        edit = self.kwargs.get("edit")
-        if edit == "author":
-            return Author.undeleted
-        elif edit == "series_book":
-            return SeriesBook.undeleted
-
     def get_success_url(self):
         return reverse(
             "show_series_book",
@@ -297,24 +686,11 @@ class EditSeriesBookPage(LoginRequiredMixin, UpdateView):
             "series_book": True,
             "book": False,
         }
-        author_id = self.kwargs.get("author_id")
-        series_book_id = self.kwargs.get("series_book_id")
-        edit = self.kwargs.get("edit")
-        if not edit == "author" and not edit == "series_book" and not edit == "book":
-            raise Http404
-        if not Author.undeleted.filter(pk=author_id).exists():
-            raise Http404
-        elif not SeriesBook.undeleted.filter(pk=series_book_id).exists():
-            raise Http404
-        author = Author.undeleted.filter(pk=author_id).first()
-        series_book = SeriesBook.undeleted.filter(pk=series_book_id).first()
-        context["author"] = author
-        context["series_book"] = series_book
         context["title"] = "Редактирование серии"
         return context
 
 
-class EditBookPage(LoginRequiredMixin, UpdateView):
+class EditBookPage(LoginRequiredMixin, EditHierarchyMixin, UpdateView):
     template_name = "libapp/create.html"
     pk_url_kwarg = "edit_id"
 
@@ -327,15 +703,6 @@ class EditBookPage(LoginRequiredMixin, UpdateView):
         elif edit == "book":
             return AddBookForm
 
-    def get_queryset(self):
-        edit = self.kwargs.get("edit")
-        if edit == "author":
-            return Author.undeleted
-        elif edit == "series_book":
-            return SeriesBook.undeleted
-        elif edit == "book":
-            return Book.undeleted
-
     def get_success_url(self):
         return reverse(
             "show_book",
@@ -354,50 +721,22 @@ class EditBookPage(LoginRequiredMixin, UpdateView):
             "series_book": False,
             "book": True,
         }
-        author_id = self.kwargs.get("author_id")
-        series_book_id = self.kwargs.get("series_book_id")
-        book_id = self.kwargs.get("book_id")
-        edit = self.kwargs.get("edit")
-        if not edit == "author" and not edit == "series_book" and not edit == "book":
-            raise Http404
-        if not Author.undeleted.filter(pk=author_id).exists():
-            raise Http404
-        elif not SeriesBook.undeleted.filter(pk=series_book_id).exists():
-            raise Http404
-        elif not Book.undeleted.filter(pk=book_id).exists():
-            raise Http404
-        author = Author.undeleted.filter(pk=author_id).first()
-        series_book = SeriesBook.undeleted.filter(pk=series_book_id).first()
-        book = Book.undeleted.filter(pk=book_id).first()
-        context["author"] = author
-        context["series_book"] = series_book
-        context["book"] = book
         context["title"] = "Редактирование книги"
         return context
 
 
 @login_required
+@atomic_post
 def delete_author_page(request, author_id, delete):
+    if not delete == "author" and not delete == "series_book" and not delete == "book":
+        raise Http404
+    hierarchy = request_hierarchy_or_404(request, author_id)
+    author = hierarchy["author"]
     if request.method == "POST":
         if request.POST.get("delete_button") == "delete":
-            author = Author.undeleted.filter(pk=author_id).first()
-            series_book = SeriesBook.undeleted.filter(author=author).all()
-            for series in series_book:
-                books = Book.undeleted.filter(series=series).all()
-                for book in books:
-                    book.is_deleted = True
-                    book.save()
-                series.is_deleted = True
-                series.save()
-            author.is_deleted = True
-            author.save()
+            author.soft_delete()
             url = reverse("show_authors")
             return redirect(url)
-    if not delete == "author" and not delete == "series_book" and not delete == "book":
-        raise Http404
-    if not Author.undeleted.filter(pk=author_id).exists():
-        raise Http404
-    author = Author.undeleted.filter(pk=author_id).first()
     series_book = SeriesBook.undeleted.filter(author=author).all()
     title = "Удаление автора"
     return render(
@@ -408,41 +747,23 @@ def delete_author_page(request, author_id, delete):
 
 
 @login_required
+@atomic_post
 def delete_series_book_page(request, author_id, series_book_id, delete):
+    if not delete == "author" and not delete == "series_book" and not delete == "book":
+        raise Http404
+    hierarchy = request_hierarchy_or_404(request, author_id, series_book_id)
+    author = hierarchy["author"]
+    series_book = hierarchy["series_book"]
     if request.method == "POST":
         if request.POST.get("delete_button") == "delete":
             if delete == "author":
-                author = Author.undeleted.filter(pk=author_id).first()
-                series_book = SeriesBook.undeleted.filter(author=author).all()
-                for series in series_book:
-                    books = Book.undeleted.filter(series=series).all()
-                    for book in books:
-                        book.is_deleted = True
-                        book.save()
-                    series.is_deleted = True
-                    series.save()
-                author.is_deleted = True
-                author.save()
+                author.soft_delete()
                 url = reverse("show_authors")
                 return redirect(url)
             elif delete == "series_book":
-                series = SeriesBook.undeleted.filter(pk=series_book_id).first()
-                books = Book.undeleted.filter(series=series).all()
-                for book in books:
-                    book.is_deleted = True
-                    book.save()
-                series.is_deleted = True
-                series.save()
+                series_book.soft_delete()
                 url = reverse("show_author", args=(author_id,))
                 return redirect(url)
-    if not delete == "author" and not delete == "series_book" and not delete == "book":
-        raise Http404
-    if not Author.undeleted.filter(pk=author_id).exists():
-        raise Http404
-    elif not SeriesBook.undeleted.filter(pk=series_book_id).exists():
-        raise Http404
-    author = Author.undeleted.filter(pk=author_id).first()
-    series_book = SeriesBook.undeleted.filter(pk=series_book_id).first()
     books = Book.undeleted.filter(series=series_book).all()
     if delete == 'author':
         title = "Удаление автора"
@@ -462,37 +783,28 @@ def delete_series_book_page(request, author_id, series_book_id, delete):
 
 
 @login_required
+@atomic_post
 def delete_book_page(request, author_id, series_book_id, book_id, delete):
+    if not delete == "author" and not delete == "series_book" and not delete == "book":
+        raise Http404
+    hierarchy = request_hierarchy_or_404(
+        request, author_id, series_book_id, book_id
+    )
+    author = hierarchy["author"]
+    series_book = hierarchy["series_book"]
+    book = hierarchy["book"]
     if request.method == "POST":
         if request.POST.get("delete_button") == "delete":
             if delete == "author":
-                author = Author.undeleted.filter(pk=author_id).first()
-                series_book = SeriesBook.undeleted.filter(author=author).all()
-                for series in series_book:
-                    books = Book.undeleted.filter(series=series).all()
-                    for book in books:
-                        book.is_deleted = True
-                        book.save()
-                    series.is_deleted = True
-                    series.save()
-                author.is_deleted = True
-                author.save()
+                author.soft_delete()
                 url = reverse("show_authors")
                 return redirect(url)
             elif delete == "series_book":
-                series = SeriesBook.undeleted.filter(pk=series_book_id).first()
-                books = Book.undeleted.filter(series=series).all()
-                for book in books:
-                    book.is_deleted = True
-                    book.save()
-                series.is_deleted = True
-                series.save()
+                series_book.soft_delete()
                 url = reverse("show_author", args=(author_id,))
                 return redirect(url)
             elif delete == "book":
-                book = Book.undeleted.filter(pk=book_id).first()
-                book.is_deleted = True
-                book.save()
+                book.soft_delete()
                 url = reverse(
                     "show_series_book",
                     args=(
@@ -501,17 +813,6 @@ def delete_book_page(request, author_id, series_book_id, book_id, delete):
                     ),
                 )
                 return redirect(url)
-    if not delete == "author" and not delete == "series_book" and not delete == "book":
-        raise Http404
-    if not Author.undeleted.filter(pk=author_id).exists():
-        raise Http404
-    elif not SeriesBook.undeleted.filter(pk=series_book_id).exists():
-        raise Http404
-    elif not Book.undeleted.filter(pk=book_id).exists():
-        raise Http404
-    author = Author.undeleted.filter(pk=author_id).first()
-    series_book = SeriesBook.undeleted.filter(pk=series_book_id).first()
-    book = Book.undeleted.filter(pk=book_id).first()
     if delete == 'author':
         title = "Удаление автора"
     elif delete == 'series_book':
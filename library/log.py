@@ -0,0 +1,123 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+
+# Атрибуты, которые есть у любой LogRecord; всё остальное - поля из extra.
+RECORD_ATTRS = frozenset(
+    logging.makeLogRecord({}).__dict__.keys() | {"message", "asctime"}
+)
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись; простые поля из extra добавляются как есть."""
+
+    def format(self, record):
+        data = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "process": record.process,
+            "thread": record.thread,
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRS and isinstance(
+                value, (str, int, float, bool, type(None))
+            ):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = record.stack_info
+        return json.dumps(data, ensure_ascii=False)
+
+
+def gzip_namer(name):
+    return name + ".gz"
+
+
+def gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class QueueFileHandler(QueueHandler):
+    """
+    Потоки запросов только кладут запись в очередь; в файл пишет один
+    фоновый поток QueueListener. Файл ротируется по размеру (maxBytes) или,
+    если задан when, по времени; старые части сжимаются gzip. Форматтер из
+    настроек LOGGING применяется к записи в файл (по умолчанию JsonFormatter).
+    Очередь дописывается в файл при close() - его вызывает logging.shutdown()
+    при выходе из процесса.
+    """
+
+    def __init__(
+        self,
+        filename,
+        maxBytes=10 * 1024 * 1024,
+        backupCount=5,
+        when=None,
+        interval=1,
+        encoding="utf-8",
+    ):
+        super().__init__(queue.SimpleQueue())
+        if when:
+            self.target = TimedRotatingFileHandler(
+                filename,
+                when=when,
+                interval=interval,
+                backupCount=backupCount,
+                encoding=encoding,
+                delay=True,
+            )
+        else:
+            self.target = RotatingFileHandler(
+                filename,
+                maxBytes=maxBytes,
+                backupCount=backupCount,
+                encoding=encoding,
+                delay=True,
+            )
+        self.target.namer = gzip_namer
+        self.target.rotator = gzip_rotator
+        self.target.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # В отличие от QueueHandler.prepare, запись не форматируется в потоке
+        # запроса: подставляются только аргументы сообщения и текст
+        # исключения, чтобы запись можно было передать в другой поток.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            self.target.close()
+        super().close()
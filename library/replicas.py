@@ -0,0 +1,174 @@
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, OperationalError, connections
+from django.http import HttpResponseServerError
+
+SAFE_METHODS = ("GET", "HEAD")
+COOKIE_NAME = "db_primary_until"
+
+# Запрос, которому можно читать с реплики, и уже выбранная для него реплика.
+_read_state = ContextVar("replica_read_state", default=None)
+
+# Реплики, к которым не удалось подключиться: алиас -> время следующей попытки.
+_down_until = {}
+_down_lock = threading.Lock()
+
+
+class ReadState:
+    def __init__(self):
+        self.alias = None
+        self.failed = False
+
+    def replica_failed(self):
+        """Была ли ошибка базы на соединении с выбранной репликой."""
+        if self.alias in (None, DEFAULT_DB_ALIAS):
+            return False
+        return self.failed or connections[self.alias].errors_occurred
+
+
+def replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+def mark_down(alias):
+    retry = getattr(settings, "REPLICA_RETRY_SECONDS", 30)
+    with _down_lock:
+        _down_until[alias] = time.monotonic() + retry
+
+
+def is_down(alias):
+    with _down_lock:
+        until = _down_until.get(alias)
+        if until is not None and until <= time.monotonic():
+            del _down_until[alias]
+            until = None
+    return until is not None
+
+
+def healthy_replica():
+    """
+    Случайная реплика, к которой удаётся подключиться. Неудачная
+    помечается недоступной на REPLICA_RETRY_SECONDS; если живых нет,
+    возвращается None и чтение идёт с основной базы.
+    """
+    candidates = [alias for alias in replicas() if not is_down(alias)]
+    random.shuffle(candidates)
+    for alias in candidates:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            mark_down(alias)
+            continue
+        return alias
+    return None
+
+
+def reading_replica():
+    """
+    Читает ли текущий запрос с реплики (или ещё выберет её). Реплика может
+    отставать от default, поэтому прочитанное с неё не кладут в общие кэши
+    (кэш объектов, фрагменты шаблонов): иначе устаревшие данные остались бы
+    там и после сброса, сделанного при записи.
+    """
+    state = _read_state.get()
+    if state is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return False
+    return state.alias != DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """
+    Пишет всегда в default. Читает с реплики из DATABASE_REPLICAS только
+    внутри безопасного запроса, отмеченного ReplicaMiddleware; реплика
+    выбирается одна на запрос. Команды, тесты и запросы внутри транзакции
+    default читают с default.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _read_state.get()
+        if state is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.alias is None:
+            state.alias = healthy_replica() or DEFAULT_DB_ALIAS
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Разрешает чтение с реплик для GET/HEAD. После небезопасного запроса
+    (POST и т.п.) ставит cookie, и REPLICA_STICKY_SECONDS секунд все
+    запросы клиента читают с default - так он видит свои изменения,
+    даже если реплика отстаёт. Если реплика отказала посреди запроса
+    (OperationalError), она помечается недоступной, а запрос выполняется
+    заново с default. Без DATABASE_REPLICAS не подключается.
+    """
+
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, "REPLICA_STICKY_SECONDS", 10)
+
+    def pinned_to_primary(self, request):
+        try:
+            return float(request.COOKIES.get(COOKIE_NAME, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def __call__(self, request):
+        safe = request.method in SAFE_METHODS
+        state = ReadState() if safe and not self.pinned_to_primary(request) else None
+        token = _read_state.set(state)
+        try:
+            response = self.read(request, state)
+        finally:
+            _read_state.reset(token)
+        if not safe:
+            response.set_cookie(
+                COOKIE_NAME,
+                "%d" % (time.time() + self.sticky_seconds),
+                max_age=self.sticky_seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    def read(self, request, state):
+        try:
+            response = self.get_response(request)
+        except OperationalError:
+            if state is None or not state.replica_failed():
+                raise
+            state.failed = True
+        if state is not None and state.failed:
+            # Запрос безопасный (GET/HEAD), поэтому его можно повторить.
+            mark_down(state.alias)
+            state.alias = DEFAULT_DB_ALIAS
+            state.failed = False
+            response = self.get_response(request)
+        return response
+
+    def process_exception(self, request, exception):
+        # Ошибку из представления или шаблона обработчик Django превращает
+        # в ответ 500 раньше, чем она дойдёт до __call__: вместо этого
+        # запрос отмечается для повтора с default.
+        state = _read_state.get()
+        if isinstance(exception, OperationalError) and state is not None:
+            if state.replica_failed():
+                state.failed = True
+                return HttpResponseServerError()
+        return None
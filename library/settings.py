@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,25 +50,34 @@ LOGGING = {
             "format": "{levelname} {asctime} {module} {process} {thread} {message}",
             "style": "{",
         },
-        "simple": {
-            "format": "{levelname} {message}",
+        "message": {
+            "format": "{message}",
             "style": "{",
         },
+        "json": {
+            "()": "library.log.JsonFormatter",
+        },
     },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
             "formatter": "verbose",
         },
+        # Запись в файлы идёт в фоновом потоке через очередь, с ротацией
+        # и сжатием старых частей (см. library/log.py).
         "file": {
-            "class": "logging.FileHandler",
+            "class": "library.log.QueueFileHandler",
             "filename": "./log/django.log",
-            "formatter": "verbose",
+            "formatter": "json",
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
         },
-        "file2": {
-            "class": "logging.FileHandler",
-            "filename": "./log/django.log",
-            "formatter": "simple",
+        "sql": {
+            "class": "library.log.QueueFileHandler",
+            "filename": "./log/sql.jsonl",
+            "formatter": "message",
+            "maxBytes": 50 * 1024 * 1024,
+            "backupCount": 5,
         },
     },
     "loggers": {
@@ -76,14 +86,21 @@ LOGGING = {
             "level": "INFO",
         },
         "shopapp": {
-            "handlers": ["console", "file2"],
+            "handlers": ["console", "file"],
             "level": "INFO",
             "propagate": True,
         },
+        "libapp.sql": {
+            "handlers": ["sql"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
 }
 
 MIDDLEWARE = [
+    "libapp.middleware.QueryInstrumentationMiddleware",
+    "library.replicas.ReplicaMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -118,18 +135,102 @@ WSGI_APPLICATION = "library.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
+# LIBAPP_DB=sqlite - встроенная база в файле LIBAPP_SQLITE_PATH (по умолчанию
+# db.sqlite3) для небольших установок, тестов и бенчмарков без сервера MySQL.
+
+LIBAPP_DB = os.environ.get("LIBAPP_DB", "mysql")
+
+if LIBAPP_DB == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("LIBAPP_SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {
+                # Транзакция сразу берёт блокировку записи: иначе при
+                # повышении чтения до записи SQLite возвращает "database is
+                # locked" без ожидания busy_timeout.
+                "transaction_mode": "IMMEDIATE",
+            },
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': 'library',
+            'USER': 'root',
+            # 'PASSWORD': ,
+            'HOST': 'localhost',
+            'PORT': '3306',
+        }
+    }
+
+# Применяются к каждому соединению с SQLite (library.sqlite). WAL: чтение не
+# ждёт записи; synchronous=NORMAL в режиме WAL не теряет целостность, только
+# последние транзакции при сбое питания. cache_size < 0 - в КиБ.
+# Сравнение с настройками SQLite по умолчанию: manage.py benchmark_sqlite.
+LIBAPP_SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 5000,
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",
+}
+
+# Реплики только для чтения (library.replicas): алиасы из DATABASES, с которых
+# читают GET/HEAD-запросы. Пусто - всё идёт в default, middleware отключается.
+# Например: DATABASES["replica"] = {..., "HOST": "replica.local"},
+# DATABASE_REPLICAS = ["replica"].
+DATABASE_ROUTERS = ["library.replicas.ReplicaRouter"]
+DATABASE_REPLICAS = []
+# Сколько секунд после POST клиент читает с default (свои изменения).
+REPLICA_STICKY_SECONDS = 10
+# Через сколько секунд снова пробовать недоступную реплику.
+REPLICA_RETRY_SECONDS = 30
 
-DATABASES = {
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Для нескольких процессов без внешних сервисов подойдёт
+# "django.core.cache.backends.filebased.FileBasedCache" с LOCATION в BASE_DIR.
+
+CACHES = {
     "default": {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': 'library',
-        'USER': 'root',
-        # 'PASSWORD': ,
-        'HOST': 'localhost',
-        'PORT': '3306',
-    }
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Кэш объектов Author/SeriesBook/Book по pk (libapp.object_cache).
+    # Размер ограничен MAX_ENTRIES, устаревание - TIMEOUT (секунды).
+    # LocMemCache у каждого процесса свой, и сброс после изменения доходит
+    # только до процесса, который его сделал: с ним страницы корректны лишь
+    # при одном процессе. С несколькими процессами (gunicorn, uwsgi) нужен
+    # общий бэкенд - Redis, Memcached или FileBasedCache. Изменения и
+    # удаления кэш не используют (libapp.utils.load_hierarchy_or_404).
+    "objects": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "libapp-objects",
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
 }
 
+LIBAPP_OBJECT_CACHE = "objects"
+
+# Время жизни кэша фрагментов списков (секунды). Актуальность обеспечивают
+# версии в ключах, а не истечение времени.
+LIBAPP_FRAGMENT_CACHE_TIMEOUT = 600
+
+# Асинхронные страницы просмотра (libapp.async_views). library/asgi.py
+# включает их по умолчанию, под WSGI остаются синхронные.
+LIBAPP_ASYNC_VIEWS = os.environ.get("LIBAPP_ASYNC_VIEWS") == "1"
+
+# Журнал SQL-запросов по каждому HTTP-запросу (libapp.middleware) в
+# log/sql.jsonl. Выключен по умолчанию: LIBAPP_SQL_INSTRUMENTATION=1.
+LIBAPP_SQL_INSTRUMENTATION = os.environ.get("LIBAPP_SQL_INSTRUMENTATION") == "1"
+# С этого числа запросов в запись добавляются стеки самых частых повторов.
+LIBAPP_SQL_TRACE_THRESHOLD = 20
+LIBAPP_SQL_SERVER_TIMING = DEBUG
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -168,6 +269,35 @@ USE_TZ = True
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Обложки (libapp.covers): оригиналы и уменьшенные копии в MEDIA_ROOT/covers
+# по хэшу содержимого. Адреса не меняются, поэтому веб-сервер может отдавать
+# /media/covers/ с "Cache-Control: public, max-age=31536000, immutable".
+# Процессов для уменьшения; 0 - уменьшать сразу в процессе запроса.
+LIBAPP_COVER_WORKERS = 2
+LIBAPP_COVER_MAX_BYTES = 10 * 1024 * 1024
+
+# Файлы книг (libapp.attachments): не в MEDIA_ROOT, отдаются только
+# владельцу через представление. Временные файлы загрузки (FILE_UPLOAD_TEMP_DIR)
+# лучше держать на той же файловой системе - тогда файл переносится без копирования.
+LIBAPP_ATTACHMENT_ROOT = BASE_DIR / "attachments"
+LIBAPP_ATTACHMENT_MAX_BYTES = 200 * 1024 * 1024
+# Квота на пользователя, байт.
+LIBAPP_ATTACHMENT_QUOTA = 2 * 1024 * 1024 * 1024
+# Процессы чтения метаданных EPUB и FB2 (libapp.metadata); 0 - в процессе
+# запроса.
+LIBAPP_METADATA_WORKERS = 2
+
+# Фоновые задачи (libapp.jobs, manage.py run_workers). Аренда задачи
+# продлевается, пока она выполняется; после падения обработчика задачу
+# заберёт другой, когда аренда истечёт.
+LIBAPP_JOB_LEASE_SECONDS = 300
+LIBAPP_JOB_MAX_ATTEMPTS = 5
+# Задержка перед повтором: удваивается с каждой попыткой до максимума.
+LIBAPP_JOB_RETRY_SECONDS = 10
+LIBAPP_JOB_RETRY_MAX_SECONDS = 3600
+# Файлы, загруженные для задач (импорт в фоне).
+LIBAPP_JOB_ROOT = BASE_DIR / "jobs"
+
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "static/"
 
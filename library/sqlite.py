@@ -0,0 +1,20 @@
+from django.conf import settings
+
+
+def apply_pragmas(connection, pragmas):
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA %s = %s" % (name, value))
+
+
+def configure_connection(sender, connection, **kwargs):
+    """
+    Обработчик connection_created: применяет LIBAPP_SQLITE_PRAGMAS к каждому
+    новому соединению с SQLite. Большинство этих настроек действует только
+    на соединение, поэтому их нельзя задать один раз при создании базы;
+    journal_mode=wal сохраняется в файле, для базы в памяти он не нужен
+    и SQLite его игнорирует.
+    """
+    if connection.vendor != "sqlite":
+        return
+    apply_pragmas(connection, getattr(settings, "LIBAPP_SQLITE_PRAGMAS", {}))
@@ -1,3 +1,81 @@
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import urls
+
+# Время проверяется, только если задан множитель бюджетов: на общих
+# машинах CI оно нестабильно, а число запросов проверяется всегда.
+TIME_BUDGET_SCALE = os.environ.get("LIBAPP_TIME_BUDGET_SCALE")
+
+REGISTER_DATA = {
+    "username": "budgetreader",
+    "email": "budgetreader@example.com",
+    "password1": "Sl0zhnyi-parol",
+    "password2": "Sl0zhnyi-parol",
+}
+
+
+class RouteBudgetTests(TestCase):
+    """
+    Бюджеты SQL-запросов и времени ответа для маршрутов users.urls, включая
+    POST. Время - при заданной переменной LIBAPP_TIME_BUDGET_SCALE.
+    """
+
+    # (маршрут, метод): (данные, число запросов, миллисекунды).
+    BUDGETS = {
+        ("login", "get"): ({}, 0, 50),
+        ("login", "post"): ({"username": "reader", "password": "password"}, 6, 1000),
+        ("logout", "get"): ({}, 4, 50),
+        ("logout", "post"): ({}, 4, 50),
+        ("register", "get"): ({}, 0, 50),
+        ("register", "post"): (REGISTER_DATA, 4, 1000),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="reader", password="password"
+        )
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual(
+            {p.name for p in urls.urlpatterns}, {name for name, _ in self.BUDGETS}
+        )
+
+    def test_route_budgets(self):
+        for (name, method), (data, max_queries, max_ms) in self.BUDGETS.items():
+            with self.subTest(route=name, method=method):
+                self.client.force_login(self.user)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = getattr(self.client, method)(
+                        reverse("users:%s" % name), data
+                    )
+                    ms = (time.perf_counter() - started) * 1000
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(len(queries), max_queries)
+                if TIME_BUDGET_SCALE:
+                    self.assertLessEqual(ms, max_ms * float(TIME_BUDGET_SCALE))
+
+    def test_login_page(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("users:login"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 0)
 
-# Create your tests here.
+    def test_register(self):
+        data = {
+            "username": "newreader",
+            "email": "newreader@example.com",
+            "password1": "Sl0zhnyi-parol",
+            "password2": "Sl0zhnyi-parol",
+        }
+        response = self.client.post(reverse("users:register"), data)
+        self.assertRedirects(response, reverse("users:login"))
+        self.assertTrue(get_user_model().objects.filter(username="newreader").exists())